@@ -1,5 +1,11 @@
 from cash import *
+from terminal import *
 from wizards import *
 from reporting import *
 from product import *
+from spool import *
+from closing import *
+from export import *
+from journal import *
+from probe import *
 
@@ -16,6 +16,11 @@
     ],
     'xml' : [
         'cash.xml',
+        'terminal.xml',
+        'spool.xml',
+        'closing.xml',
+        'export.xml',
+        'journal.xml',
     ],
     'translation': [
     ]
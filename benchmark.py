@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+#This file is part of Tryton.  The COPYRIGHT file at the top level of
+#this repository contains the full copyright notices and license terms.
+'''
+Benchmark of the POS hot paths against simulated devices.
+
+Runs the sale flow (scan items, subtotal, cash) on a test database, with
+in-memory stand-ins for the receipt printer and the serial display which
+simulate their throughput, and reports per operation latency, number of
+SQL queries and bytes written to the devices.
+
+Usage: python benchmark.py [--sales N] [--items N] [--baud N]
+    [--printer-rate BYTES_PER_SECOND]
+'''
+from decimal import Decimal
+import optparse
+import sys
+import time
+
+import serial
+
+from trytond.tests.test_tryton import POOL, DB_NAME, USER, CONTEXT, \
+    install_module
+from trytond.transaction import Transaction
+
+
+class SimulatedSerial(object):
+    '''
+    Stand-in for serial.Serial writing at the speed of a serial line with
+    8N1 framing, i.e. 10 bits per byte.
+    '''
+    baud = 9600
+
+    def __init__(self, port, baudrate=9600, *args, **kwargs):
+        self.port = port
+        self.baudrate = baudrate or self.baud
+        self.data = []
+
+    def write(self, data):
+        time.sleep(len(data) * 10.0 / self.baudrate)
+        self.data.append(data)
+        return len(data)
+
+    def close(self):
+        pass
+
+
+class SimulatedFileDevice(object):
+    '''
+    Stand-in for escpos.FileDevice writing at a fixed rate in bytes per
+    second and keeping what it got in memory.
+    '''
+    rate = 20000
+    written = []
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._open = False
+
+    def open_device(self):
+        self._open = True
+
+    def close_device(self):
+        self._open = False
+
+    def is_healthy(self):
+        return self._open
+
+    def write(self, text):
+        if not self._open:
+            raise Exception('Device not open.')
+        time.sleep(float(len(text)) / self.rate)
+        self.written.append(text)
+
+
+class QueryCounter(object):
+    '''
+    Count the queries executed on the cursor of the transaction.
+    '''
+
+    def __init__(self, cursor):
+        self.count = 0
+        self._execute = cursor.execute
+        cursor.execute = self.execute
+
+    def execute(self, *args, **kwargs):
+        self.count += 1
+        return self._execute(*args, **kwargs)
+
+
+class Recorder(object):
+
+    def __init__(self, counter):
+        self.counter = counter
+        self.measures = {}
+
+    def __call__(self, name, function, *args, **kwargs):
+        queries = self.counter.count
+        start = time.time()
+        res = function(*args, **kwargs)
+        duration = time.time() - start
+        self.measures.setdefault(name, []).append(
+            (duration, self.counter.count - queries))
+        return res
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+
+def setup(item_count):
+    '''
+    Create the company, the configuration and item_count products.
+    Return the codes of the products.
+    '''
+    currency_obj = POOL.get('currency.currency')
+    company_obj = POOL.get('company.company')
+    sequence_obj = POOL.get('ir.sequence.strict')
+    configuration_obj = POOL.get('pos_cash.configuration')
+    uom_obj = POOL.get('product.uom')
+    product_obj = POOL.get('product.product')
+
+    currency_id = currency_obj.create({
+            'name': 'Euro',
+            'symbol': u'\u20ac',
+            'code': 'EUR',
+            })
+    company_id = company_obj.create({
+            'name': 'POS Benchmark',
+            'currency': currency_id,
+            'addresses': [('create', {
+                        'street': 'Main street 1',
+                        'zip': '12345',
+                        'city': 'Town',
+                        })],
+            })
+    sequence_id = sequence_obj.create({
+            'name': 'POS Benchmark',
+            'code': 'pos_cash',
+            })
+    configuration_obj.write(1, {
+            'sequence': sequence_id,
+            'company': company_id,
+            'printer_port': '/dev/lp-benchmark',
+            'display_port': '/dev/ttyS-benchmark',
+            'display_baud': SimulatedSerial.baud,
+            'display_digits': 20,
+            })
+
+    unit_id, = uom_obj.search([('name', '=', 'Unit')])
+    codes = []
+    for i in range(item_count):
+        code = '4000000%06d' % i
+        product_obj.create({
+                'name': 'Benchmark product %s' % i,
+                'code': code,
+                'type': 'goods',
+                'consumable': True,
+                'list_price': Decimal('1.99') + i,
+                'cost_price': Decimal('1'),
+                'default_uom': unit_id,
+                })
+        codes.append(code)
+    return codes
+
+
+def run(sale_count, item_count):
+    from trytond.modules.pos_cash import probe
+
+    sale_obj = POOL.get('pos_cash.sale')
+    print_job_obj = POOL.get('pos_cash.print_job')
+    receipt = POOL.get('pos_cash.receipt', 'report')
+
+    cursor = Transaction().cursor
+    codes = setup(item_count)
+    recorder = Recorder(QueryCounter(cursor))
+    probe.reset_metrics()
+
+    for i in range(sale_count):
+        sale_id = recorder('create sale', sale_obj.create, {})
+        for code in codes:
+            recorder('scan', sale_obj.scan, sale_id, code)
+        recorder('add sum', sale_obj.add_sum, sale_id)
+        total = sale_obj.browse(sale_id).total_amount
+        recorder('cash sale', sale_obj.cash_sale, sale_id, total + 10)
+        recorder('render receipt', receipt.print_sale,
+            sale_obj.browse(sale_id))
+
+    # The jobs are drained here in the transaction, as the spool worker
+    # does not see uncommitted jobs
+    job_ids = print_job_obj.search([('state', '=', 'pending')],
+        order=[('id', 'ASC')])
+    for job_id in job_ids:
+        recorder('print job', print_job_obj.print_job, job_id)
+    return recorder.measures
+
+
+def report(measures, out=sys.stdout):
+    from trytond.modules.pos_cash import probe
+
+    out.write('%-20s %7s %9s %9s %9s %9s %9s\n' % ('operation', 'count',
+            'mean ms', 'p50 ms', 'p95 ms', 'max ms', 'queries'))
+    for name in sorted(measures):
+        durations = [x[0] * 1000 for x in measures[name]]
+        queries = [x[1] for x in measures[name]]
+        out.write('%-20s %7d %9.3f %9.3f %9.3f %9.3f %9.1f\n' % (name,
+                len(durations), sum(durations) / len(durations),
+                percentile(durations, 50), percentile(durations, 95),
+                max(durations), float(sum(queries)) / len(queries)))
+
+    out.write('\n%-24s %-22s %7s %9s %9s %9s\n' % ('probe', 'lane/device',
+            'count', 'mean ms', 'max ms', 'bytes'))
+    for metric in probe.get_metrics():
+        out.write('%-24s %-22s %7d %9.3f %9.3f %9d\n' % (metric['name'],
+                metric['lane'] or '-', metric['count'],
+                metric['total_ms'] / metric['count'], metric['max_ms'],
+                metric['bytes']))
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--sales', type='int', default=20,
+        help='number of sales [default: %default]')
+    parser.add_option('--items', type='int', default=30,
+        help='number of items scanned per sale [default: %default]')
+    parser.add_option('--baud', type='int', default=9600,
+        help='baud rate of the simulated display [default: %default]')
+    parser.add_option('--printer-rate', type='int', default=20000,
+        help='throughput of the simulated printer in bytes per second '
+        '[default: %default]')
+    options, args = parser.parse_args()
+
+    from trytond.modules.pos_cash import spool
+    from trytond.modules.pos_cash.escpos import escpos
+
+    SimulatedSerial.baud = options.baud
+    SimulatedFileDevice.rate = options.printer_rate
+    serial.Serial = SimulatedSerial
+    escpos.FileDevice = SimulatedFileDevice
+
+    class NoWorker(object):
+        def wakeup(self):
+            pass
+    spool.get_spool_worker = lambda database_name, port: NoWorker()
+
+    install_module('pos_cash')
+    with Transaction().start(DB_NAME, USER, context=CONTEXT):
+        measures = run(options.sales, options.items)
+        # Let the display worker finish its last redraw
+        time.sleep(1)
+        report(measures)
+
+if __name__ == '__main__':
+    main()
@@ -2,13 +2,20 @@
 #this repository contains the full copyright notices and license terms.
 from __future__ import with_statement
 from decimal import Decimal
-import serial
-from escpos import escpos
+import datetime
 
 from trytond.model import ModelSQL, ModelView, ModelStorage, ModelSingleton, fields
 from trytond.wizard import Wizard
 from trytond.pyson import If, In, Eval, Get, Or, Not, Equal, Bool, And
 from trytond.pool import Pool
+from trytond.cache import Cache
+from trytond.transaction import Transaction
+from trytond.backend import TableHandler
+from probe import timed
+
+# The fields of the configuration which a terminal can override
+_PROFILE_FIELDS = ['printer_port', 'display_port', 'display_baud',
+    'display_digits', 'logo']
 
 class PosCashConfiguration(ModelSingleton, ModelSQL, ModelView):
     _name = 'pos_cash.configuration'
@@ -22,6 +29,12 @@ class PosCashConfiguration(ModelSingleton, ModelSQL, ModelView):
     display_digits = fields.Numeric('Digits per row', digits=(10,0))
     company = fields.Many2One('company.company', 'Company')
     logo = fields.Binary('Receipt Logo')
+    receipt_numbering = fields.Selection([
+            ('store', 'Store sequence'),
+            ('lane', 'Sequence per lane'),
+            ], 'Receipt numbering', required=True,
+            help='With a sequence per lane, the sales of a lane with a '
+            'terminal are numbered by the terminal')
 
     def __init__(self):
         super(PosCashConfiguration, self).__init__()
@@ -39,27 +52,63 @@ class PosCashConfiguration(ModelSingleton, ModelSQL, ModelView):
     def default_display_baud(self):
         return 9600
 
+    def default_receipt_numbering(self):
+        return 'store'
+
+    @Cache('pos_cash_configuration.get_singleton')
+    def get_singleton(self):
+        '''
+        Return the values of the configuration singleton as a dictionary.
+        Many2One fields are returned as ids.
+        '''
+        configuration_id = self.search([])[0]
+        return self.read(configuration_id)
+
+    def get_profile(self, lane=None):
+        '''
+        Return the values of the configuration with the devices of the
+        terminal of lane, by default the lane of the context, if it has one.
+        The devices which the terminal leaves empty are the configured ones.
+        '''
+        terminal_obj = Pool().get('pos_cash.terminal')
+
+        if lane is None:
+            lane = Transaction().context.get('pos_lane')
+        configuration = self.get_singleton()
+        terminal = terminal_obj.get_terminal(lane)
+        if not terminal:
+            return configuration
+        profile = configuration.copy()
+        for field in _PROFILE_FIELDS:
+            if terminal[field]:
+                profile[field] = terminal[field]
+        return profile
+
+    def create(self, vals):
+        res = super(PosCashConfiguration, self).create(vals)
+        # Restart the cache for get_singleton
+        self.get_singleton.reset()
+        return res
+
+    def write(self, ids, vals):
+        res = super(PosCashConfiguration, self).write(ids, vals)
+        # Restart the cache for get_singleton
+        self.get_singleton.reset()
+        return res
+
+    def delete(self, ids):
+        res = super(PosCashConfiguration, self).delete(ids)
+        # Restart the cache for get_singleton
+        self.get_singleton.reset()
+        return res
+
     def test_printer(self, ids):
         receipt = Pool().get('pos_cash.receipt', 'report')
         receipt.test_printer()
 
     def test_display(self, ids):
-        configuration_obj = Pool().get('pos_cash.configuration')
-
-        configuration_id = configuration_obj.search([])[0]
-        configuration = configuration_obj.browse(configuration_id)
-
-        if configuration.display_port:
-            port = serial.Serial(
-                configuration.display_port, configuration.display_baud)
-            display = escpos.Display(port)
-            display.set_cursor(False)
-            display.clear()
-            display.text('Display works!!!')
-            display.new_line()
-            display.text('Well!!!')
-            del display
-            port.close()
+        display = Pool().get('pos_cash.display', 'report')
+        display.show_message('Display works!!!', 'Well!!!')
 
 PosCashConfiguration()
 
@@ -72,23 +121,50 @@ class PosCashSale(ModelSQL, ModelView):
     cash_received = fields.Numeric('Cash received')
     taxes = fields.Function(fields.One2Many('account.tax', None, 'Taxes'),
             'get_taxes')
-    total_amount = fields.Function(fields.Numeric('Total amount', readonly=True),
-            'get_total_amount')
-    total_tax = fields.Function(fields.Numeric('Total tax'), 'get_total_tax')
-    total_without_tax = fields.Function(fields.Numeric('Without tax'),
-            'get_without_tax')
+    total_amount = fields.Numeric('Total amount', readonly=True)
+    total_tax = fields.Numeric('Total tax', readonly=True)
+    total_without_tax = fields.Numeric('Without tax', readonly=True)
     total_paid = fields.Numeric('Total paid', readonly=True)
-    drawback = fields.Function(fields.Numeric('Drawback'), 'get_drawback')
+    drawback = fields.Numeric('Drawback', readonly=True)
+    lane = fields.Char('Lane', readonly=True, select=1)
+    closing = fields.Many2One('pos_cash.closing', 'Z-Report', readonly=True,
+            select=1, ondelete='RESTRICT')
+    journal_key = fields.Char('Journal key', readonly=True, select=1,
+            help='Key of the sale in the journal of its lane')
+    sale_date = fields.DateTime('Sale date', readonly=True, select=1,
+            help='Date of the sale at the lane, which is the date of its '
+            'journal entry for a journaled sale')
 
     def __init__(self):
         super(PosCashSale, self).__init__()
         self._disp = False
         self._rpc.update({
             'add_product': True,
+            'add_products': True,
+            'scan': True,
             'add_sum': True,
             'set_quantity': True,
-            'cash_sale': True
+            'cash_sale': True,
+            'reprint_receipt': True,
+            'recompute_totals': True,
         })
+        self._error_messages.update({
+            'unknown_barcode': 'No product found for barcode "%s"!',
+            'sale_closed': 'The sale "%s" is closed by a Z-report!',
+        })
+
+    def init(self, module_name):
+        cursor = Transaction().cursor
+
+        migrate = (TableHandler.table_exist(cursor, self._table)
+            and not TableHandler(cursor, self, module_name).column_exist(
+                'sale_date'))
+        super(PosCashSale, self).init(module_name)
+
+        # Migration from 2.4.1.0: the sales have a sale date
+        if migrate:
+            cursor.execute('UPDATE "' + self._table + '" '
+                'SET sale_date = create_date WHERE sale_date IS NULL')
 
     @property
     def _display(self):
@@ -96,122 +172,293 @@ class PosCashSale(ModelSQL, ModelView):
             self._disp = Pool().get('pos_cash.display', 'report')
         return self._disp
 
+    @timed('sale.receipt_code')
     def default_receipt_code(self):
         config_obj = Pool().get('pos_cash.configuration')
-        config = config_obj.browse(1)
+        config = config_obj.get_singleton()
+        if config['receipt_numbering'] == 'lane':
+            terminal_obj = Pool().get('pos_cash.terminal')
+            terminal = terminal_obj.get_terminal(self.default_lane())
+            if terminal:
+                return terminal_obj.get_receipt_code(terminal,
+                    config['company'])
         sequence_obj = Pool().get('ir.sequence.strict')
-        seq_code = sequence_obj.get_id(config.sequence.id)
-        res = '%04d%s' % (config.company.id, seq_code)
+        seq_code = sequence_obj.get_id(config['sequence'])
+        res = '%04d%s' % (config['company'], seq_code)
         return res
 
-    def get_total_amount(self, ids, name):
-        res = {}
-        for sale in self.browse(ids):
-            total = Decimal(0)
-            for line in sale.lines:
-                total += line.quantity * line.unit_price
-            res[sale.id] = total
-        return res
+    def default_lane(self):
+        return Transaction().context.get('pos_lane') or None
+
+    def default_sale_date(self):
+        return datetime.datetime.now()
+
+    def default_total_amount(self):
+        return Decimal(0)
+
+    def default_total_tax(self):
+        return Decimal(0)
+
+    def default_total_without_tax(self):
+        return Decimal(0)
+
+    def default_drawback(self):
+        return Decimal(0)
 
     def get_taxes(self, ids, name):
-        res = {}
-        for sale in self.browse(ids):
-            taxes = []
-            for line in sale.lines:
-                for tax in line.taxes:
-                    if tax.id not in taxes:
-                        taxes.append(tax.id)
-            res[sale.id] = taxes
-        return res
+        line_obj = Pool().get('pos_cash.sale.line')
 
-    def get_total_tax(self, ids, name):
         res = {}
-        for sale in self.browse(ids):
-            res[sale.id] = sale.total_amount - sale.total_without_tax
+        for sale_id in ids:
+            res[sale_id] = []
+        line_ids = line_obj.search([
+                ('sale', 'in', ids),
+                ('line_type', '!=', 'sum'),
+                ])
+        for line in line_obj.read(line_ids, ['sale', 'taxes']):
+            taxes = res[line['sale']]
+            for tax_id in line['taxes']:
+                if tax_id not in taxes:
+                    taxes.append(tax_id)
         return res
 
-    def get_without_tax(self, ids, name):
-        res = {}
-        for sale in self.browse(ids):
-            amount = Decimal(0)
-            for line in sale.lines:
-                amount += line.without_tax
-            res[sale.id] = amount
+    def _get_drawback(self, total_paid, total_amount):
+        if not total_paid:
+            return Decimal(0)
+        return total_paid - total_amount
+
+    def check_open(self, ids):
+        '''
+        Raise an error if one of the sales is closed by a Z-report
+        '''
+        cursor = Transaction().cursor
+
+        ids = list(set(ids))
+        for i in range(0, len(ids), cursor.IN_MAX):
+            sub_ids = ids[i:i + cursor.IN_MAX]
+            cursor.execute('SELECT receipt_code FROM "' + self._table + '" '
+                'WHERE id IN (' + ','.join(('%s',) * len(sub_ids)) + ') '
+                    'AND closing IS NOT NULL', sub_ids)
+            row = cursor.fetchone()
+            if row:
+                self.raise_user_error('sale_closed', (row[0],))
+
+    def write(self, ids, vals):
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        self.check_open(ids)
+        res = super(PosCashSale, self).write(ids, vals)
+        if (('total_paid' in vals or 'total_amount' in vals)
+                and 'drawback' not in vals):
+            for sale in self.browse(ids):
+                super(PosCashSale, self).write(sale.id, {
+                        'drawback': self._get_drawback(sale.total_paid,
+                            sale.total_amount),
+                        })
         return res
 
-
+    def delete(self, ids):
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        self.check_open(ids)
+        return super(PosCashSale, self).delete(ids)
+
+    def add_amounts(self, amounts):
+        '''
+        Add amounts to the stored totals of the sales.
+        The totals are incremented in SQL, so that concurrent updates of the
+        lines of a sale do not overwrite each other.
+
+        :param amounts: a dictionary with sale id as key and a tuple of the
+            amount and the amount without tax to add as value
+        '''
+        cursor = Transaction().cursor
+
+        sale_ids = []
+        for sale_id, (amount, without_tax) in amounts.iteritems():
+            if not amount and not without_tax:
+                continue
+            cursor.execute('UPDATE "' + self._table + '" SET '
+                    'total_amount = COALESCE(total_amount, 0) + %s, '
+                    'total_without_tax = COALESCE(total_without_tax, 0) + %s, '
+                    'total_tax = COALESCE(total_tax, 0) + %s, '
+                    'drawback = CASE WHEN COALESCE(total_paid, 0) = 0 THEN 0 '
+                        'ELSE total_paid - COALESCE(total_amount, 0) - %s '
+                        'END, '
+                    'write_uid = %s, write_date = %s '
+                'WHERE id = %s', (amount, without_tax, amount - without_tax,
+                    amount, Transaction().user, datetime.datetime.now(),
+                    sale_id))
+            sale_ids.append(sale_id)
+
+        # Clean cursor cache like ModelStorage.write
+        for cache in cursor.cache.values():
+            for cache in [cache] + cache.get('_language_cache', {}).values():
+                if self._name in cache:
+                    for sale_id in sale_ids:
+                        if sale_id in cache[self._name]:
+                            cache[self._name][sale_id] = {}
+
+    def recompute_totals(self, ids):
+        '''
+        Compute again the stored totals of the sales and the amounts of their
+        lines, to repair existing data.
+        '''
+        pool = Pool()
+        line_obj = pool.get('pos_cash.sale.line')
+        cursor = Transaction().cursor
+
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        line_obj.update_amounts(line_obj.search([('sale', 'in', ids)]))
+
+        totals = {}
+        for i in range(0, len(ids), cursor.IN_MAX):
+            sub_ids = ids[i:i + cursor.IN_MAX]
+            cursor.execute('SELECT sale, '
+                    'SUM(COALESCE(unit_price, 0) * COALESCE(quantity, 0)), '
+                    'SUM(COALESCE(without_tax, 0)) '
+                'FROM "' + line_obj._table + '" '
+                'WHERE line_type != %s '
+                    'AND sale IN (' + ','.join(('%s',) * len(sub_ids)) + ') '
+                'GROUP BY sale', ['sum'] + sub_ids)
+            for sale_id, amount, without_tax in cursor.fetchall():
+                totals[sale_id] = (Decimal(str(amount)),
+                    Decimal(str(without_tax)))
+
+        for sale_id in ids:
+            amount, without_tax = totals.get(sale_id,
+                (Decimal(0), Decimal(0)))
+            self.write(sale_id, {
+                    'total_amount': amount,
+                    'total_without_tax': without_tax,
+                    'total_tax': amount - without_tax,
+                    })
+        return True
+
+    @timed('sale.add_product')
     def add_product(self, sale, product, qty, unit_price=None):
+        return self.add_products(sale, [(product, qty, unit_price)])[0]
+
+    @timed('sale.add_products')
+    def add_products(self, sale, entries):
+        '''
+        Add lines to the sale from a list of (product, quantity, unit price)
+        entries, the unit price defaulting to the list price of the product.
+        The totals of the sale are updated once for all the lines.
+        Return the ids of the new lines.
+        '''
         pool = Pool()
         product_obj = pool.get('product.product')
         configuration_obj = pool.get('pos_cash.configuration')
         sale_line_obj = pool.get('pos_cash.sale.line')
 
-        product = product_obj.browse(product)
-        unit_price = unit_price or product.list_price
-        line_id = sale_line_obj.create({'sale': sale,
-                    'product': product.id,
+        if not entries:
+            return []
+        snapshot = product_obj.get_snapshot()
+
+        vlist = []
+        for entry in entries:
+            product, qty = entry[:2]
+            unit_price = len(entry) > 2 and entry[2] or None
+            if not unit_price:
+                if product in snapshot:
+                    unit_price = snapshot.get_list_price(product)
+                else:
+                    unit_price = product_obj.browse(product).list_price
+            vlist.append({'sale': sale,
+                    'product': product,
                     'unit_price': unit_price,
                     'quantity': qty,
-                })
-
-        line = sale_line_obj.browse(line_id)
-        configuration_id = configuration_obj.search([])[0]
-        configuration = configuration_obj.browse(configuration_id)
-        if configuration.display_port:
-            self._display.show_sale_line(line)
-        return line_id
-
+                    })
+        line_ids = sale_line_obj.create_lines(vlist)
+
+        configuration = configuration_obj.get_profile()
+        if configuration['display_port']:
+            self._display.show_sale_line(sale_line_obj.browse(line_ids[-1]))
+        return line_ids
+
+    @timed('sale.scan')
+    def scan(self, sale, barcode, qty=1):
+        '''
+        Add a line to the sale for the product with the scanned barcode.
+        Return the id of the new line.
+        '''
+        product_obj = Pool().get('product.product')
+
+        barcode = barcode.strip()
+        snapshot = product_obj.get_snapshot()
+        product = snapshot.find(barcode)
+        if product is None:
+            self.raise_user_error('unknown_barcode', (barcode,))
+        unit_price = snapshot.get_list_price(product)
+        return self.add_products(sale, [(product, qty, unit_price)])[0]
+
+    @timed('sale.cash_sale')
     def cash_sale(self, sale_id, cash_amount):
         pool = Pool()
         receipt = pool.get('pos_cash.receipt', 'report')
         configuration_obj = pool.get('pos_cash.configuration')
 
-        configuration_id = configuration_obj.search([])[0]
-        configuration = configuration_obj.browse(configuration_id)
+        configuration = configuration_obj.get_profile()
         sale = self.browse(sale_id)
-        drawback = self.get_drawback([sale_id], '')
 
         total_paid = sale.total_paid
         if total_paid <= cash_amount:
             self.write(sale.id, {'total_paid': cash_amount})
+            # The drawback is the one of the payment, like in the journal
+            sale = self.browse(sale.id)
 
-
-        if configuration.display_port:
+        if configuration['display_port']:
             self._display.show_paid(sale)
-        if configuration.logo:
-            receipt.kick_cash_drawer()
-        if configuration.printer_port:
-            receipt.print_sale(sale)
+        if configuration['printer_port']:
+            receipt.print_sale(sale, kick_drawer=bool(configuration['logo']))
 
-        return drawback
+        return sale.drawback
 
 
-    def get_drawback(self, ids, name):
-        res = {}
-        for sale in self.browse(ids):
-            if sale.total_paid == Decimal(0):
-                res[sale.id] = Decimal(0)
-            else:
-                res[sale.id] = sale.total_paid - sale.total_amount
-        return res
+    def reprint_receipt(self, ids):
+        '''
+        Print the last receipt of the sales again.
+        '''
+        print_job_obj = Pool().get('pos_cash.print_job')
 
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        job_ids = []
+        for sale_id in ids:
+            job_ids += print_job_obj.search([
+                    ('sale', '=', sale_id),
+                    ('kind', '=', 'receipt'),
+                    ], order=[('id', 'DESC')], limit=1)
+        return print_job_obj.reprint(job_ids)
+
+    @timed('sale.add_sum')
     def add_sum(self, ids):
         line_obj = Pool().get('pos_cash.sale.line')
         configuration_obj = Pool().get('pos_cash.configuration')
 
-        configuration_id = configuration_obj.search([])[0]
-        configuration = configuration_obj.browse(configuration_id)
+        configuration = configuration_obj.get_profile()
         if isinstance(ids, list):
             ids = ids[0]
-        if configuration.display_port:
+        if configuration['display_port']:
             self._display.show_total(self.browse(ids))
         return line_obj.create({'sale': ids, 'line_type': 'sum'})
 
+    @timed('sale.set_quantity')
     def set_quantity(self, ids, quantity):
+        '''
+        Set the quantity of the sale lines and show the first one on the
+        display.
+        '''
         line_obj = Pool().get('pos_cash.sale.line')
+        configuration_obj = Pool().get('pos_cash.configuration')
+
+        if isinstance(ids, (int, long)):
+            ids = [ids]
         res = line_obj.write(ids, {'quantity': int(quantity)})
-        if res:
-            self._display.show_sale_line(line_obj.browse(ids))
+        if res and configuration_obj.get_profile()['display_port']:
+            self._display.show_sale_line(line_obj.browse(ids[0]))
         return res
 
 PosCashSale()
@@ -231,10 +478,11 @@ class PosCashSaleLine(ModelSQL, ModelView):
     unit_price = fields.Numeric('Unit price', digits=(16, 2), states=STATES)
     total = fields.Function(fields.Numeric('Total'), 'get_total')
     quantity = fields.Numeric('Quantity', states=STATES)
-    without_tax = fields.Function(fields.Numeric('Without Tax'),
-            'get_without_tax')
-    taxes = fields.Function(fields.One2Many('account.tax', None, 'Taxes'),
-            'get_taxes')
+    without_tax = fields.Numeric('Without Tax', readonly=True)
+    tax_amount = fields.Numeric('Tax Amount', readonly=True)
+    taxes = fields.Many2Many('pos_cash.sale.line-account.tax', 'line', 'tax',
+            'Taxes', readonly=True)
+    journal_key = fields.Char('Journal key', readonly=True, select=1)
 
     def default_line_type(self):
         return 'position'
@@ -245,54 +493,214 @@ class PosCashSaleLine(ModelSQL, ModelView):
     def default_quantity(self):
         return 0
 
-    def get_taxes(self, ids, name):
+    def _get_amounts(self, line_type, product, unit_price, quantity):
+        '''
+        Return the values of the amounts and taxes stored on a line.
+        '''
+        product_obj = Pool().get('product.product')
+
+        if line_type == 'sum' or not product:
+            return {
+                'without_tax': Decimal('0'),
+                'tax_amount': Decimal('0'),
+                'taxes': [('set', [])],
+                }
+        snapshot = product_obj.get_snapshot()
+        if product in snapshot:
+            tax_ids = list(snapshot.get_taxes(product))
+            percentages = [snapshot.get_tax_percentage(x) for x in tax_ids]
+        else:
+            taxes = product_obj.browse(product).customer_taxes_used
+            tax_ids = [x.id for x in taxes]
+            percentages = [x.percentage or Decimal(0) for x in taxes]
+        taxes = sum(percentages, Decimal(0))
+        total = (unit_price or Decimal(0)) * (quantity or Decimal(0))
+        without_tax = total / ((taxes/100)+1)
+        return {
+            'without_tax': without_tax,
+            'tax_amount': total - without_tax,
+            'taxes': [('set', tax_ids)],
+            }
+
+    def _get_sale_amounts(self, ids):
+        '''
+        Return the amounts the lines add to the totals of their sales, as a
+        dictionary with sale id as key and a tuple of the amount and the
+        amount without tax as value.
+        '''
         res = {}
-        for line in self.browse(ids):
-            res[line.id] = []
-            if line.line_type == 'sum':
-               continue
-            res[line.id] += [x.id for x in line.product.customer_taxes_used]
+        for line in self.read(ids, ['sale', 'line_type', 'unit_price',
+                    'quantity', 'without_tax']):
+            amount, without_tax = res.get(line['sale'],
+                (Decimal(0), Decimal(0)))
+            if line['line_type'] != 'sum':
+                amount += (line['unit_price'] or Decimal(0)) \
+                    * (line['quantity'] or Decimal(0))
+                without_tax += line['without_tax'] or Decimal(0)
+            res[line['sale']] = (amount, without_tax)
         return res
 
-    def get_without_tax(self, ids, name):
-        res = {}
-        for line in self.browse(ids):
-            if line.line_type == 'sum':
-                res[line.id] = Decimal('0')
-                continue
-            taxes = Decimal(0)
-            for tax in line.product.customer_taxes_used:
-                taxes += tax.percentage
+    def _update_sale_totals(self, old_amounts, new_amounts):
+        sale_obj = Pool().get('pos_cash.sale')
+
+        amounts = {}
+        for sale_id in set(old_amounts) | set(new_amounts):
+            old_amount, old_without_tax = old_amounts.get(sale_id,
+                (Decimal(0), Decimal(0)))
+            new_amount, new_without_tax = new_amounts.get(sale_id,
+                (Decimal(0), Decimal(0)))
+            amounts[sale_id] = (new_amount - old_amount,
+                new_without_tax - old_without_tax)
+        sale_obj.add_amounts(amounts)
+
+    def _check_sales_open(self, ids, vals=None):
+        '''
+        Raise an error if the lines or the sale of vals belong to a sale
+        closed by a Z-report
+        '''
+        sale_obj = Pool().get('pos_cash.sale')
+
+        sale_ids = [x['sale'] for x in self.read(ids, ['sale'])]
+        if vals and vals.get('sale'):
+            sale_ids.append(vals['sale'])
+        sale_obj.check_open(sale_ids)
+
+    def create(self, vals):
+        return self.create_lines([vals])[0]
+
+    def create_lines(self, vlist):
+        '''
+        Create the lines of the list of values and update the totals of
+        their sales once. The lines are still inserted one by one, as the
+        ORM creates one record at a time.
+        Return the ids of the lines.
+        '''
+        sale_obj = Pool().get('pos_cash.sale')
+
+        sale_obj.check_open([x['sale'] for x in vlist if x.get('sale')])
+        ids = []
+        for vals in vlist:
+            vals = vals.copy()
+            vals.update(self._get_amounts(
+                    vals.get('line_type', self.default_line_type()),
+                    vals.get('product'),
+                    vals.get('unit_price', self.default_unit_price()),
+                    vals.get('quantity', self.default_quantity())))
+            ids.append(super(PosCashSaleLine, self).create(vals))
+        self._update_sale_totals({}, self._get_sale_amounts(ids))
+        return ids
+
+    def write(self, ids, vals):
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        self._check_sales_open(ids, vals)
+        update = set(vals) & set(['sale', 'line_type', 'product',
+                'unit_price', 'quantity'])
+        if update:
+            old_amounts = self._get_sale_amounts(ids)
+        res = super(PosCashSaleLine, self).write(ids, vals)
+        if update:
+            self.update_amounts(ids)
+            self._update_sale_totals(old_amounts,
+                self._get_sale_amounts(ids))
+        return res
 
-            res[line.id] = line.total / ((taxes/100)+1)
+    def delete(self, ids):
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        self._check_sales_open(ids)
+        old_amounts = self._get_sale_amounts(ids)
+        res = super(PosCashSaleLine, self).delete(ids)
+        self._update_sale_totals(old_amounts, {})
         return res
 
+    def update_amounts(self, ids):
+        '''
+        Compute again the amounts and taxes stored on the lines.
+        '''
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        for line in self.browse(ids):
+            self.write(line.id, self._get_amounts(line.line_type,
+                    line.product and line.product.id or None,
+                    line.unit_price, line.quantity))
+
     def get_name(self, ids, name):
+        product_obj = Pool().get('product.product')
+
+        snapshot = product_obj.get_snapshot()
         res = {}
-        for rec in self.browse(ids):
-            if rec.line_type == 'sum':
-                res[rec.id] = 'Sum:'
+        for line in self.read(ids, ['line_type', 'product']):
+            if line['line_type'] == 'sum':
+                res[line['id']] = 'Sum:'
+            elif line['product']:
+                product_name = None
+                if line['product'] in snapshot:
+                    product_name = snapshot.get_name(line['product'])
+                if product_name is None:
+                    product_name = product_obj.browse(line['product']).name
+                res[line['id']] = product_name
             else:
-                res[rec.id] = rec.product.name
+                res[line['id']] = False
         return res
 
     def get_total(self, ids, name):
         res = {}
-        for line in self.browse(ids):
-            if line.line_type == 'sum':
-                lines = self.search([('sale', '=', line.sale),
-                        ('create_date', '<', line.create_date),
-                        ('line_type', '!=', 'sum')])
-                s = Decimal('0')
-                for l in self.browse(lines):
-                    s += l.total
-                res[line.id] = s
+        sale_ids = set()
+        for line in self.read(ids, ['sale', 'line_type', 'unit_price',
+                    'quantity']):
+            if line['line_type'] == 'sum':
+                sale_ids.add(line['sale'])
+            else:
+                res[line['id']] = line['unit_price'] * line['quantity']
+        if not sale_ids:
+            return res
+
+        # Sum lines hold the running total of the preceding lines, so all
+        # of them are computed with one ordered pass over their sales.
+        # The subtotals are kept per sale, so the lines are only ordered by
+        # creation.
+        line_ids = self.search([
+                ('sale', 'in', list(sale_ids)),
+                ], order=[('create_date', 'ASC'), ('id', 'ASC')])
+        sum_ids = set(ids)
+        subtotals = {}
+        for line in self.read(line_ids, ['sale', 'line_type', 'unit_price',
+                    'quantity']):
+            subtotal = subtotals.setdefault(line['sale'], Decimal('0'))
+            if line['line_type'] == 'sum':
+                if line['id'] in sum_ids:
+                    res[line['id']] = subtotal
             else:
-                res[line.id] = line.unit_price * line.quantity
+                subtotals[line['sale']] = subtotal \
+                    + line['unit_price'] * line['quantity']
         return res
 
 PosCashSaleLine()
 
 
+class PosCashSaleLineTax(ModelSQL):
+    'POS Sale Line - Tax'
+    _name = 'pos_cash.sale.line-account.tax'
+    _table = 'pos_cash_sale_line_account_tax'
+    _description = __doc__
+
+    line = fields.Many2One('pos_cash.sale.line', 'POS Sale Line',
+            ondelete='CASCADE', select=1, required=True)
+    tax = fields.Many2One('account.tax', 'Tax', ondelete='RESTRICT',
+            select=1, required=True)
+
+    def init(self, module_name):
+        cursor = Transaction().cursor
+
+        migrate = not TableHandler.table_exist(cursor, self._table)
+        super(PosCashSaleLineTax, self).init(module_name)
 
+        # Migration from 2.4.1.0: the amounts and taxes of the lines and the
+        # totals of the sales are stored. It runs here, once all the tables
+        # of the module exist.
+        if migrate:
+            sale_obj = Pool().get('pos_cash.sale')
+            sale_obj.recompute_totals(sale_obj.search([]))
 
+PosCashSaleLineTax()
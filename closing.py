@@ -0,0 +1,258 @@
+#This file is part of Tryton.  The COPYRIGHT file at the top level of
+#this repository contains the full copyright notices and license terms.
+from decimal import Decimal
+import datetime
+
+from trytond.model import ModelSQL, ModelView, fields
+from trytond.transaction import Transaction
+from trytond.pool import Pool
+
+
+class PosCashClosing(ModelSQL, ModelView):
+    'POS Closing'
+    _name = 'pos_cash.closing'
+    _description = __doc__
+    _rec_name = 'number'
+
+    kind = fields.Selection([
+            ('x', 'X-Report'),
+            ('z', 'Z-Report'),
+            ], 'Kind', required=True, readonly=True, select=1)
+    number = fields.Integer('Number', readonly=True,
+            help='Consecutive number of the Z-reports of the lane')
+    lane = fields.Char('Lane', readonly=True, select=1)
+    start_date = fields.DateTime('Start date', readonly=True)
+    end_date = fields.DateTime('End date', readonly=True)
+    receipts = fields.Integer('Receipts', readonly=True)
+    turnover = fields.Numeric('Turnover', digits=(16, 2), readonly=True)
+    total_without_tax = fields.Numeric('Without tax', digits=(16, 2),
+            readonly=True)
+    total_tax = fields.Numeric('Total tax', digits=(16, 2), readonly=True)
+    total_paid = fields.Numeric('Total paid', digits=(16, 2), readonly=True)
+    drawback = fields.Numeric('Drawback', digits=(16, 2), readonly=True)
+    cancellations = fields.Integer('Cancellations', readonly=True)
+    cancellation_amount = fields.Numeric('Cancellation amount',
+            digits=(16, 2), readonly=True)
+    taxes = fields.One2Many('pos_cash.closing.tax', 'closing', 'Taxes',
+            readonly=True)
+    sales = fields.One2Many('pos_cash.sale', 'closing', 'Sales',
+            readonly=True)
+
+    def __init__(self):
+        super(PosCashClosing, self).__init__()
+        self._rpc.update({
+            'x_report': True,
+            'z_report': True,
+            'print_closing': True,
+        })
+
+    def _sale_where(self, lane, start_date=None, end_date=None,
+            open_only=True):
+        '''
+        Return the SQL clause and parameters selecting the settled sales of
+        a lane, the sale table being aliased as s. The sales not paid in full
+        are still being rung up. The period applies to the sale date, as the
+        journaled sales are created when they are replayed.
+        '''
+        clauses = ['s.total_paid >= COALESCE(s.total_amount, 0)']
+        params = []
+        if lane:
+            clauses.append('s.lane = %s')
+            params.append(lane)
+        else:
+            clauses.append('s.lane IS NULL')
+        if open_only:
+            clauses.append('s.closing IS NULL')
+        if start_date:
+            clauses.append('s.sale_date >= %s')
+            params.append(start_date)
+        if end_date:
+            clauses.append('s.sale_date <= %s')
+            params.append(end_date)
+        return ' AND '.join(clauses), params
+
+    def aggregate(self, lane, start_date=None, end_date=None,
+            open_only=True):
+        '''
+        Aggregate the sales of a lane in SQL and return the values of a
+        closing, the tax lines included.
+
+        :param open_only: only aggregate the sales not closed by a Z-report
+        '''
+        pool = Pool()
+        sale_obj = pool.get('pos_cash.sale')
+        line_obj = pool.get('pos_cash.sale.line')
+        line_tax_obj = pool.get('pos_cash.sale.line-account.tax')
+        tax_obj = pool.get('account.tax')
+        cursor = Transaction().cursor
+
+        where, params = self._sale_where(lane, start_date, end_date,
+            open_only)
+
+        cursor.execute('SELECT COUNT(s.id), SUM(s.total_amount), '
+                'SUM(s.total_without_tax), SUM(s.total_tax), '
+                'SUM(s.total_paid), SUM(s.drawback) '
+            'FROM "' + sale_obj._table + '" AS s '
+            'WHERE ' + where, params)
+        (receipts, turnover, without_tax, tax, paid,
+            drawback) = cursor.fetchone()
+
+        # The dates are read from the column, as SQLite does not type the
+        # result of MIN and MAX
+        first_date = last_date = None
+        if receipts:
+            for order in ('ASC', 'DESC'):
+                cursor.execute('SELECT s.sale_date '
+                    'FROM "' + sale_obj._table + '" AS s '
+                    'WHERE ' + where + ' '
+                    'ORDER BY s.sale_date ' + order + ' LIMIT 1', params)
+                if order == 'ASC':
+                    first_date, = cursor.fetchone()
+                else:
+                    last_date, = cursor.fetchone()
+
+        cursor.execute('SELECT COUNT(l.id), '
+                'SUM(l.unit_price * l.quantity) '
+            'FROM "' + line_obj._table + '" AS l '
+                'JOIN "' + sale_obj._table + '" AS s ON s.id = l.sale '
+            'WHERE l.line_type = %s AND ' + where,
+            ['cancellation'] + params)
+        cancellations, cancellation_amount = cursor.fetchone()
+
+        # The base of each tax is the net amount of the lines it applies to,
+        # its amount is computed from the base as the tax amount of a line
+        # with several taxes is the sum of them
+        cursor.execute('SELECT r.tax, SUM(l.without_tax) '
+            'FROM "' + line_obj._table + '" AS l '
+                'JOIN "' + sale_obj._table + '" AS s ON s.id = l.sale '
+                'JOIN "' + line_tax_obj._table + '" AS r ON r.line = l.id '
+            'WHERE ' + where + ' '
+            'GROUP BY r.tax', params)
+        tax_rows = cursor.fetchall()
+
+        percentages = {}
+        for tax_values in tax_obj.read([x[0] for x in tax_rows],
+                ['percentage']):
+            percentages[tax_values['id']] = tax_values['percentage']
+
+        def amount(value):
+            return Decimal(str(value or 0))
+
+        taxes = []
+        for tax_id, tax_without_tax in tax_rows:
+            tax_without_tax = amount(tax_without_tax)
+            tax_amount = (tax_without_tax
+                * (percentages.get(tax_id) or Decimal(0)) / 100)
+            taxes.append({
+                    'tax': tax_id,
+                    'percentage': percentages.get(tax_id),
+                    'amount': tax_without_tax + tax_amount,
+                    'without_tax': tax_without_tax,
+                    'tax_amount': tax_amount,
+                    })
+
+        return {
+            'lane': lane,
+            'start_date': start_date or first_date,
+            'end_date': end_date or last_date or datetime.datetime.now(),
+            'receipts': receipts or 0,
+            'turnover': amount(turnover),
+            'total_without_tax': amount(without_tax),
+            'total_tax': amount(tax),
+            'total_paid': amount(paid),
+            'drawback': amount(drawback),
+            'cancellations': cancellations or 0,
+            'cancellation_amount': amount(cancellation_amount),
+            'taxes': [('create', x) for x in taxes],
+            }
+
+    def _get_lane(self, lane):
+        if lane is None:
+            lane = Transaction().context.get('pos_lane')
+        return lane or None
+
+    def x_report(self, lane=None, start_date=None, end_date=None):
+        '''
+        Create and print an X-report, the interim report of the settled sales
+        of the lane which are not yet closed, or of all of them in a period.
+        Return the id of the report.
+        '''
+        lane = self._get_lane(lane)
+        open_only = not (start_date or end_date)
+        values = self.aggregate(lane, start_date, end_date,
+            open_only=open_only)
+        values['kind'] = 'x'
+        closing_id = self.create(values)
+        self.print_closing(closing_id)
+        return closing_id
+
+    def z_report(self, lane=None):
+        '''
+        Create and print the Z-report closing the settled sales of the lane
+        which are not yet closed.
+        Return the id of the report.
+        '''
+        sale_obj = Pool().get('pos_cash.sale')
+        cursor = Transaction().cursor
+
+        lane = self._get_lane(lane)
+        # Serialise the Z-reports to keep their numbers consecutive and
+        # every sale in exactly one of them
+        cursor.lock(self._table)
+
+        end_date = datetime.datetime.now()
+        values = self.aggregate(lane, end_date=end_date)
+        values['kind'] = 'z'
+
+        if lane:
+            cursor.execute('SELECT MAX(number) FROM "' + self._table + '" '
+                'WHERE kind = %s AND lane = %s', ('z', lane))
+        else:
+            cursor.execute('SELECT MAX(number) FROM "' + self._table + '" '
+                'WHERE kind = %s AND lane IS NULL', ('z',))
+        values['number'] = (cursor.fetchone()[0] or 0) + 1
+
+        closing_id = self.create(values)
+
+        # Close the sales aggregated, with the same clause, as a domain on
+        # the date would be rounded to the second
+        where, params = self._sale_where(lane, end_date=end_date)
+        cursor.execute('SELECT s.id FROM "' + sale_obj._table + '" AS s '
+            'WHERE ' + where, params)
+        sale_ids = [x[0] for x in cursor.fetchall()]
+        sale_obj.write(sale_ids, {'closing': closing_id})
+
+        self.print_closing(closing_id)
+        return closing_id
+
+    def print_closing(self, ids):
+        receipt = Pool().get('pos_cash.receipt', 'report')
+        configuration_obj = Pool().get('pos_cash.configuration')
+
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        for closing in self.browse(ids):
+            # Print on the printer of the lane of the closing
+            with Transaction().set_context(pos_lane=closing.lane):
+                if configuration_obj.get_profile()['printer_port']:
+                    receipt.print_closing(closing)
+
+PosCashClosing()
+
+
+class PosCashClosingTax(ModelSQL, ModelView):
+    'POS Closing Tax'
+    _name = 'pos_cash.closing.tax'
+    _description = __doc__
+
+    closing = fields.Many2One('pos_cash.closing', 'Closing', required=True,
+            ondelete='CASCADE', select=1)
+    tax = fields.Many2One('account.tax', 'Tax', required=True,
+            ondelete='RESTRICT')
+    percentage = fields.Numeric('Percentage', readonly=True)
+    amount = fields.Numeric('With tax', digits=(16, 2), readonly=True)
+    without_tax = fields.Numeric('Without tax', digits=(16, 2),
+            readonly=True)
+    tax_amount = fields.Numeric('Tax', digits=(16, 2), readonly=True)
+
+PosCashClosingTax()
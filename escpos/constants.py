@@ -15,6 +15,11 @@ MODE_STANDARD = '\x1b\x53'
 # Cash Drawer
 CD_KICK_2 = '\x1b\x70\x00'     # Sends a pulse to pin 2 []
 CD_KICK_5 = '\x1b\x70\x01'     # Sends a pulse to pin 5 []
+# Real-time status
+DLE_EOT_PRINTER = '\x10\x04\x01' # Transmit printer status
+DLE_EOT_OFFLINE = '\x10\x04\x02' # Transmit off-line cause status
+DLE_EOT_ERROR   = '\x10\x04\x03' # Transmit error cause status
+DLE_EOT_PAPER   = '\x10\x04\x04' # Transmit roll paper sensor status
 # Paper
 PAPER_FULL_CUT  = '\x1d\x56\x00' # Full cut paper
 PAPER_PART_CUT  = '\x1d\x56\x01' # Partial cut paper
@@ -71,4 +76,5 @@ DISPLAY_CURS_MOVE_RIGHT_MOST= '\x1f\x0d'
 DISPLAY_CURS_ON             = '\x1f\x43\x01'
 DISPLAY_CURS_OFF            = '\x1f\x43\x00'
 DISPLAY_CURS_MOVE_HOME      = '\x0b'
+DISPLAY_CURS_MOVE_POS       = '\x1f\x24' # Followed by column and row, from 1
 
@@ -6,78 +6,146 @@
 @license: GPL
 '''
 
-import usb
-import Image
-import time
+import errno
+import os
+import usb.core
+import usb.util
+from PIL import Image
 import serial
 
 from constants import *
 from exceptions import *
-
-class DeviceDescriptor:
-    """ Search device on USB tree and return it if found """
-    def __init__(self, idVendor, idProduct, interface) :
-        self.idVendor = idVendor
-        self.idProduct = idProduct
-        self.interface = interface
-
-    def get_device(self) :
-        buses = usb.busses()
-        for bus in buses :
-            for device in bus.devices :
-                if (device.idVendor == self.idVendor
-                        and device.idProduct == self.idProduct):
-                        return device
-        return None
+import raster
 
 class UsbDevice(object):
-    handle    = None
-    device    = None
-
+    """
+        USB printer through pyusb 1.0.
+        Writes in chunks of the packet size of the output endpoint with a
+        timeout and reads the printer status with DLE EOT queries, with
+        the shorter status_timeout, when a write fails.
+        A fake pyusb backend can be given as backend.
+    """
     def __init__(self, idVendor, idProduct, interface=0, in_ep=0x82,
-                out_ep=0x01) :
+                out_ep=0x01, timeout=5000, status_timeout=500, backend=None):
         self.idVendor  = idVendor
         self.idProduct = idProduct
         self.interface = interface
         self.in_ep     = in_ep
         self.out_ep    = out_ep
+        self.timeout   = timeout
+        self.status_timeout = status_timeout
+        self.backend   = backend
+        self.device    = None
+        self.packet_size = None
+        self._detached = False
+
+    def open_device(self):
+        """ Find the printer and claim its interface """
+        device = usb.core.find(idVendor=self.idVendor,
+            idProduct=self.idProduct, backend=self.backend)
+        if device is None:
+            raise UsbNotFoundError('%04x:%04x' % (self.idVendor,
+                    self.idProduct))
+        try:
+            if device.is_kernel_driver_active(self.interface):
+                device.detach_kernel_driver(self.interface)
+                self._detached = True
+        except NotImplementedError:
+            # Not supported by the backend of the platform
+            pass
+        try:
+            configuration = device.get_active_configuration()
+        except usb.core.USBError:
+            device.set_configuration()
+            configuration = device.get_active_configuration()
+        usb.util.claim_interface(device, self.interface)
+        endpoint = usb.util.find_descriptor(
+            configuration[(self.interface, 0)],
+            bEndpointAddress=self.out_ep)
+        self.packet_size = endpoint and endpoint.wMaxPacketSize or 64
+        self.device = device
 
-        device_descriptor = DeviceDescriptor(self.idVendor, self.idProduct,
-                self.interface)
-        self.device = device_descriptor.get_device()
-        if not self.device:
-            print "Cable isn't plugged in"
+    def close_device(self):
+        """ Release the interface, without resetting the printer """
+        device, self.device = self.device, None
+        if device is None:
+            return
         try:
-            self.handle = self.device.open()
-            self.handle.detachKernelDriver(self.interface) # Claim the interface
-            self.handle.setConfiguration(self.device.configurations[0])
-            self.handle.claimInterface(device_descriptor.interface)
-            #self.handle.AltInterface(device_descriptor.interface)
+            usb.util.release_interface(device, self.interface)
+            if self._detached:
+                device.attach_kernel_driver(self.interface)
+        except (usb.core.USBError, NotImplementedError):
+            pass
+        self._detached = False
+        usb.util.dispose_resources(device)
+
+    def is_open(self):
+        return self.device is not None
 
-        except usb.USBError, err:
-            print err
+    def is_healthy(self):
+        """
+            Return if the printer is open. It is not queried, as the
+            printers which do not answer status queries would delay each
+            write, the status is only read after a failed write.
+        """
+        return self.is_open()
 
     def write(self, msg):
         """ Print any of the commands above, or clear text """
-        self.handle.bulkWrite(self.out_ep, msg, 1000)
-
-    def __del__(self):
-        """ Release device interface """
-        if self.handle:
+        if not self.is_open():
+            raise Exception('Device not open.')
+        for i in range(0, len(msg), self.packet_size):
+            chunk = msg[i:i + self.packet_size]
             try:
-                self.handle.releaseInterface()
-                self.handle.resetEndpoint(self.out_ep)
-                self.handle.reset()
-            except Exception, err:
-                print err
-            self.handle, self.device = None, None
-            # Give a chance to return the interface to the system
-            # The following message could appear if the application is executed
-            # too fast twice or more times.
-            #
-            # >> could not detach kernel driver from interface 0: No data available
-            # >> No interface claimed
-            time.sleep(1)
+                written = self.device.write(self.out_ep, chunk,
+                    timeout=self.timeout)
+            except usb.core.USBError, error:
+                if not self._is_timeout(error):
+                    raise
+                written = 0
+            if written < len(chunk):
+                # The printer does not take more data, tell why
+                self.check_status()
+                raise UsbBusyError('%d of %d bytes written'
+                    % (i + written, len(msg)))
+
+    def _is_timeout(self, error):
+        return (getattr(error, 'errno', None) == errno.ETIMEDOUT
+            or getattr(error, 'backend_error_code', None) == -7)
+
+    def _query(self, command):
+        """ Send a DLE EOT command and return the status byte """
+        self.device.write(self.out_ep, command, timeout=self.status_timeout)
+        data = self.device.read(self.in_ep, 1, timeout=self.status_timeout)
+        if not len(data):
+            raise UsbStatusError(repr(command))
+        return data[0]
+
+    def status(self):
+        """
+            Return the status of the printer as a dictionary with the keys
+            online, cover_open, paper_end, paper_near_end and error
+        """
+        printer = self._query(DLE_EOT_PRINTER)
+        offline = self._query(DLE_EOT_OFFLINE)
+        paper = self._query(DLE_EOT_PAPER)
+        return {
+            'online': not printer & 0x08,
+            'cover_open': bool(offline & 0x04),
+            'paper_end': bool(offline & 0x20 or paper & 0x60),
+            'paper_near_end': bool(paper & 0x0c),
+            'error': bool(offline & 0x40),
+            }
+
+    def check_status(self):
+        """ Raise the error of the printer if it can not print """
+        status = self.status()
+        if status['cover_open']:
+            raise CoverOpenError()
+        if status['paper_end']:
+            raise PaperEndError()
+        if status['error'] or not status['online']:
+            raise PrinterOfflineError()
 
 
 class FileDevice(object):
@@ -89,7 +157,8 @@ class FileDevice(object):
         self._file = False
 
     def open_device(self):
-        self._file = open(self._filename, 'wb')
+        # Unbuffered, so that each write goes to the device at once
+        self._file = open(self._filename, 'wb', 0)
 
     def close_device(self):
         if self._file:
@@ -97,7 +166,17 @@ class FileDevice(object):
             self._file = False
 
     def is_open(self):
-        return self._file is False
+        return self._file is not False
+
+    def is_healthy(self):
+        """ Return if the device is open and still there """
+        if not self.is_open():
+            return False
+        try:
+            os.fstat(self._file.fileno())
+        except (IOError, OSError, ValueError):
+            return False
+        return True
 
     def write(self, text):
         if not self._file:
@@ -117,13 +196,34 @@ class EscPos(object):
         """
         self.port = port
         self._charset = charset
+        self._buffer = None
+        self.bytes_written = 0
+
+    def start_buffer(self):
+        """ Collect all output in a buffer, read with get_buffer() """
+        self._buffer = []
+
+    def get_buffer(self):
+        """ Return the buffered output """
+        if self._buffer is None:
+            return ''
+        return ''.join(self._buffer)
 
     def text(self, text):
-        text = text.encode(self._charset)
+        # Characters missing from the charset are printed as ?
+        text = text.encode(self._charset, 'replace')
         self._raw(text)
 
+    def raw(self, msg):
+        """ Send raw ESC/POS data like the one returned by Printer.raster """
+        self._raw(msg)
+
     def _raw(self, msg):
-        self.port.write(msg)
+        if self._buffer is not None:
+            self._buffer.append(msg)
+        else:
+            self.port.write(msg)
+            self.bytes_written += len(msg)
 
     def close(self):
         self.port.close()
@@ -133,89 +233,14 @@ class EscPos(object):
 class Printer(EscPos):
     """ ESC/POS Printer object """
 
-    def _check_image_size(self, size):
-        """Check and fix the size of the image to 32 bits"""
-        if size % 32 == 0:
-            return (0, 0)
-        else:
-            image_border = 32 - (size % 32)
-            if (image_border % 2) == 0:
-                return (image_border / 2, image_border / 2)
-            else:
-                return (image_border / 2, (image_border / 2) + 1)
-
-
-    def _print_image(self, line, size):
-        i = 0
-        cont = 0
-        buffer = ""
-
-        self._raw(S_RASTER_N)
-        buffer = "%02X%02X%02X%02X" % (((size[0]/size[1])/8), 0, size[1], 0)
-        self._raw(buffer.decode('hex'))
-        buffer = ""
-
-        while i < len(line):
-            hex_string = int(line[i:i+8],2)
-            buffer += "%02X" % hex_string
-            i += 8
-            cont += 1
-            if cont % 4 == 0:
-                self._raw(buffer.decode("hex"))
-                buffer = ""
-                cont = 0
-
-
-    def image(self, img):
+    def image(self, img, dither=raster.DITHER_FLOYD_STEINBERG):
         """Parse image and then print it"""
-        pixels   = []
-        pix_line = ""
-        im_left  = ""
-        im_right = ""
-        switch   = 0
-        img_size = [ 0, 0 ]
-
-        im_open = Image.open(img)
-        im = im_open.convert("RGB")
-
-        if im.size[0] > 512:
-            print  "WARNING: Image is wider than 512 and could be truncated at " \
-                    "print time "
-        if im.size[1] > 255:
-            raise ImageSizeError()
-
-        im_border = self._check_image_size(im.size[0])
-        for i in range(im_border[0]):
-            im_left += "0"
-        for i in range(im_border[1]):
-            im_right += "0"
-
-        for y in range(im.size[1]):
-            img_size[1] += 1
-            pix_line += im_left
-            img_size[0] += im_border[0]
-            for x in range(im.size[0]):
-                img_size[0] += 1
-                RGB = im.getpixel((x, y))
-                im_color = (RGB[0] + RGB[1] + RGB[2])
-                im_pattern = "1X0"
-                pattern_len = len(im_pattern)
-                switch = (switch - 1 ) * (-1)
-                for x in range(pattern_len):
-                    if im_color <= (255 * 3 / pattern_len * (x+1)):
-                        if im_pattern[x] == "X":
-                            pix_line += "%d" % switch
-                        else:
-                            pix_line += im_pattern[x]
-                        break
-                    elif im_color > (255 * 3 / pattern_len * pattern_len) \
-                            and im_color <= (255 * 3):
-                        pix_line += im_pattern[-1]
-                        break
-            pix_line += im_right
-            img_size[0] += im_border[1]
+        self._raw(self.raster(img, dither))
+
 
-        self._print_image(pix_line, img_size)
+    def raster(self, img, dither=raster.DITHER_FLOYD_STEINBERG):
+        """Parse image and return the raster commands printing it"""
+        return raster.raster(Image.open(img), dither)
 
     def barcode(self, code, bc, width, height, pos, font):
         """ Print Barcode """
@@ -274,7 +299,8 @@ class Printer(EscPos):
             raise BarcodeTypeError()
         # Print Code
         if code:
-            self._raw(code)
+            # Keep the buffered output a byte string
+            self._raw(code.encode('ascii'))
             if close_bc:
                 self._raw('\x00')
         else:
@@ -319,7 +345,7 @@ class Printer(EscPos):
         elif type.upper() == "BU2":
             self._raw(TXT_BOLD_ON)
             self._raw(TXT_UNDERL2_ON)
-        elif type.upper == "NORMAL":
+        elif type.upper() == "NORMAL":
             self._raw(TXT_BOLD_OFF)
             self._raw(TXT_UNDERL_OFF)
         # Width
@@ -385,24 +411,82 @@ class Printer(EscPos):
 class Display(EscPos):
     """
         Esc/Pos Display class
+
+        Keeps a copy of the characters shown, so show() only sends the
+        cells which changed, using absolute cursor positioning.
     """
-    def __init__(self, port, digits=20, charset='cp850'):
+    # A run of unchanged cells shorter than a cursor move is rewritten
+    _MOVE_SIZE = len(DISPLAY_CURS_MOVE_POS) + 2
+
+    def __init__(self, port, digits=20, charset='cp850', rows=2):
         super(Display, self).__init__(port, charset)
         self._align = 'LEFT'
         self._digits = digits
+        self._rows = rows
+        self._row = 1
+        # The shown rows, None when unknown
+        self._frame = None
 
     def text(self, text):
         text = text[:self._digits]
         if self._align == 'RIGHT':
-            self.curs_move_right_most()
-            for i in range(1, len(text)):
-                self.curs_move_left()
+            self.move_to(self._digits - len(text) + 1, self._row)
 
         super(Display, self).text(text)
         # Display adds newline if last character is written
         if (len(text) == self._digits
                 or self._align == 'RIGHT'):
             self.curs_move_up()
+        self._frame = None
+
+    def format_row(self, left, right=''):
+        """ Return a row with left aligned left and right aligned right """
+        right = right[:self._digits]
+        left = left[:self._digits - len(right)]
+        return left + ' ' * (self._digits - len(left) - len(right)) + right
+
+    def show(self, rows):
+        """
+            Show rows, a list of texts padded to the digits, sending only
+            the cells which differ from what is shown.
+        """
+        blank = u' ' * self._digits
+        rows = [(isinstance(x, str) and x.decode('utf-8', 'replace')
+                or unicode(x))[:self._digits].ljust(self._digits)
+            for x in list(rows)[:self._rows]]
+        rows += [blank] * (self._rows - len(rows))
+        if self._frame is None:
+            self.clear()
+        for i, (old, new) in enumerate(zip(self._frame, rows)):
+            column = 0
+            while column < self._digits:
+                if old[column] == new[column]:
+                    column += 1
+                    continue
+                start = end = column
+                # Extend the run over the short gaps of unchanged cells
+                while column < self._digits:
+                    if old[column] != new[column]:
+                        end = column = column + 1
+                    elif column - end >= self._MOVE_SIZE:
+                        break
+                    else:
+                        column += 1
+                self.move_to(start + 1, i + 1)
+                self._raw(new[start:end].encode(self._charset, 'replace'))
+                # Display adds newline if last character is written
+                if end == self._digits:
+                    self.curs_move_up()
+        self._frame = rows
+
+    def invalidate(self):
+        """ Forget what is shown, the next show() redraws everything """
+        self._frame = None
+
+    def move_to(self, column, row):
+        """ Move the cursor to column and row, both starting at 1 """
+        self._raw(DISPLAY_CURS_MOVE_POS + chr(column) + chr(row))
+        self._row = row
 
     def set_cursor(self, visible=True):
         if visible:
@@ -412,6 +496,7 @@ class Display(EscPos):
 
     def new_line(self):
         self._raw('\n' + DISPLAY_CURS_MOVE_LEFT_MOST)
+        self._row = min(self._row + 1, self._rows)
 
     def curs_move_left(self):
         self._raw(DISPLAY_CURS_MOVE_LEFT)
@@ -434,9 +519,10 @@ class Display(EscPos):
     def clear(self):
         self._raw(DISPLAY_CLEAR)
         self._align = 'LEFT'
+        self._row = 1
+        self._frame = [u' ' * self._digits] * self._rows
 
     def set_align(self, align='left'):
         if align.upper() not in ['LEFT', 'RIGHT']:
             raise Exception('Align must be left or right')
         self._align = align.upper()
-
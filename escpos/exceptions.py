@@ -22,6 +22,13 @@ class Error(Exception):
 # 40 = Image height is too large
 # 50 = No string supplied to be printed
 # 60 = Invalid pin to send Cash Drawer pulse
+# 70 = Unknown image dithering
+# 80 = USB printer not found
+# 81 = USB printer does not take more data
+# 82 = No answer to a status query
+# 83 = Printer cover open
+# 84 = Printer out of paper
+# 85 = Printer off-line
 
 
 class BarcodeTypeError(Error):
@@ -78,3 +85,73 @@ class CashDrawerError(Error):
 
     def __str__(self):
         return "Valid pin must be set to send pulse"
+
+
+class ImageDitherError(Error):
+    def __init__(self, msg=""):
+        Error.__init__(self, msg)
+        self.msg = msg
+        self.resultcode = 70
+
+    def __str__(self):
+        return "Unknown image dithering %s" % self.msg
+
+
+class UsbNotFoundError(Error):
+    def __init__(self, msg=""):
+        Error.__init__(self, msg)
+        self.msg = msg
+        self.resultcode = 80
+
+    def __str__(self):
+        return "USB printer %s not found" % self.msg
+
+
+class UsbBusyError(Error):
+    def __init__(self, msg=""):
+        Error.__init__(self, msg)
+        self.msg = msg
+        self.resultcode = 81
+
+    def __str__(self):
+        return "USB printer does not take more data: %s" % self.msg
+
+
+class UsbStatusError(Error):
+    def __init__(self, msg=""):
+        Error.__init__(self, msg)
+        self.msg = msg
+        self.resultcode = 82
+
+    def __str__(self):
+        return "No answer to status query %s" % self.msg
+
+
+class CoverOpenError(Error):
+    def __init__(self, msg=""):
+        Error.__init__(self, msg)
+        self.msg = msg
+        self.resultcode = 83
+
+    def __str__(self):
+        return "Printer cover is open"
+
+
+class PaperEndError(Error):
+    def __init__(self, msg=""):
+        Error.__init__(self, msg)
+        self.msg = msg
+        self.resultcode = 84
+
+    def __str__(self):
+        return "Printer is out of paper"
+
+
+class PrinterOfflineError(Error):
+    def __init__(self, msg=""):
+        Error.__init__(self, msg)
+        self.msg = msg
+        self.resultcode = 85
+
+    def __str__(self):
+        return "Printer is off-line"
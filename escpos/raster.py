@@ -0,0 +1,79 @@
+""" Conversion of images to ESC/POS raster commands """
+
+import struct
+
+import numpy
+from PIL import Image
+
+from constants import *
+from exceptions import *
+
+DITHER_THRESHOLD = 'threshold'
+DITHER_ORDERED = 'ordered'
+DITHER_FLOYD_STEINBERG = 'floyd-steinberg'
+DITHERS = (DITHER_THRESHOLD, DITHER_ORDERED, DITHER_FLOYD_STEINBERG)
+
+# Maximum number of rows sent with one GS v 0 command
+BAND_HEIGHT = 255
+
+# 4x4 Bayer matrix scaled to the 0-255 gray levels
+_BAYER = (numpy.array([
+            [0, 8, 2, 10],
+            [12, 4, 14, 6],
+            [3, 11, 1, 9],
+            [15, 7, 13, 5],
+            ]) + 0.5) * 16
+
+
+def _gray(img):
+    """ Return img as a gray scale image, transparency rendered white """
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P'
+            and 'transparency' in img.info):
+        img = img.convert('RGBA')
+        background = Image.new('RGBA', img.size, (255, 255, 255, 255))
+        background.paste(img, mask=img.split()[3])
+        img = background
+    return img.convert('L')
+
+
+def bitmap(img, dither=DITHER_FLOYD_STEINBERG):
+    """
+        Return a boolean array of the image size, True for the dots
+        to print.
+    """
+    if dither not in DITHERS:
+        raise ImageDitherError(dither)
+    gray = _gray(img)
+    width, height = gray.size
+
+    if dither == DITHER_FLOYD_STEINBERG:
+        # PIL dithers with Floyd-Steinberg when converting to bilevel
+        packed = numpy.frombuffer(gray.convert('1').tobytes(),
+            dtype=numpy.uint8).reshape(height, (width + 7) // 8)
+        return numpy.unpackbits(packed, axis=1)[:, :width] == 0
+
+    pixels = numpy.frombuffer(gray.tobytes(), dtype=numpy.uint8).reshape(
+        height, width)
+    if dither == DITHER_ORDERED:
+        threshold = numpy.tile(_BAYER, (height // 4 + 1, width // 4 + 1)
+            )[:height, :width]
+    else:
+        threshold = 128
+    return pixels < threshold
+
+
+def raster(img, dither=DITHER_FLOYD_STEINBERG, band_height=BAND_HEIGHT):
+    """
+        Return the GS v 0 commands printing img. Images higher than
+        band_height are sent as consecutive bands.
+    """
+    dots = numpy.packbits(bitmap(img, dither), axis=1)
+    height, width = dots.shape
+
+    commands = []
+    for top in range(0, height, band_height):
+        band = dots[top:top + band_height]
+        commands.append(S_RASTER_N)
+        commands.append(struct.pack('<HH', width, band.shape[0]))
+        commands.append(band.tobytes())
+    return ''.join(commands)
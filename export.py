@@ -0,0 +1,244 @@
+#This file is part of Tryton.  The COPYRIGHT file at the top level of
+#this repository contains the full copyright notices and license terms.
+from decimal import Decimal
+import csv
+import datetime
+import json
+import os
+
+from trytond.config import CONFIG
+from trytond.model import ModelSQL, ModelView, fields
+from trytond.transaction import Transaction
+from trytond.pool import Pool
+
+_EXPORT_CHUNK_SIZE = 500
+_CURSOR_DATE_FORMATS = ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S')
+
+SALE_COLUMNS = ['id', 'receipt_code', 'lane', 'closing', 'sale_date',
+    'create_date', 'write_date', 'total_amount', 'total_without_tax',
+    'total_tax', 'total_paid', 'drawback']
+LINE_COLUMNS = ['id', 'line_type', 'product', 'quantity', 'unit_price',
+    'total', 'without_tax', 'tax_amount']
+
+
+def _format_value(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+
+def _csv_value(value):
+    value = _format_value(value)
+    # The csv module of Python 2 only writes byte strings
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def get_export_directory():
+    '''
+    Return the directory of the export files in the data path
+    '''
+    return os.path.join(CONFIG['data_path'], 'pos_cash', 'export')
+
+
+class PosCashExport(ModelSQL, ModelView):
+    'POS Export'
+    _name = 'pos_cash.export'
+    _description = __doc__
+    _rec_name = 'path'
+
+    path = fields.Char('Path', readonly=True,
+            help='Path of the file in the export directory')
+    format = fields.Selection([
+            ('csv', 'CSV'),
+            ('jsonl', 'JSON Lines'),
+            ], 'Format', readonly=True)
+    sales = fields.Integer('Sales', readonly=True)
+    last_date = fields.DateTime('Last date', readonly=True,
+            help='Last modification date of the exported sales')
+    last_sale = fields.Integer('Last sale', readonly=True,
+            help='Id of the last exported sale with the last date')
+    # The DateTime fields drop the microseconds of the modification dates
+    cursor_date = fields.Char('Cursor date', readonly=True,
+            help='Last date with its microseconds')
+
+    def __init__(self):
+        super(PosCashExport, self).__init__()
+        self._rpc.update({
+            'export': True,
+        })
+        self._error_messages.update({
+            'unknown_format': 'Unknown export format "%s"!',
+            'invalid_path': 'The export path "%s" must be relative and '
+                'stay in the export directory!',
+        })
+
+    def get_cursor(self):
+        '''
+        Return the (last date, last sale) cursor of the last export or None
+        '''
+        # The exports of a period have no cursor
+        export_ids = self.search([('last_date', '!=', None)],
+            order=[('id', 'DESC')], limit=1)
+        if not export_ids:
+            return None
+        export = self.browse(export_ids[0])
+        last_date = export.last_date
+        for format in _CURSOR_DATE_FORMATS:
+            try:
+                last_date = datetime.datetime.strptime(export.cursor_date,
+                    format)
+                break
+            except (TypeError, ValueError):
+                continue
+        return (last_date, export.last_sale)
+
+    def iter_sales(self, cursor=None, closed_only=False, start_date=None,
+            end_date=None, chunk_size=_EXPORT_CHUNK_SIZE):
+        '''
+        Yield the sales modified after cursor, a (date, sale id) tuple, as
+        dictionaries with their lines. They are read in chunks of chunk_size
+        sales ordered by modification date and id, so memory stays bounded.
+        The sales can be limited to the sale dates from start_date to
+        end_date.
+        '''
+        pool = Pool()
+        sale_obj = pool.get('pos_cash.sale')
+        line_obj = pool.get('pos_cash.sale.line')
+        db_cursor = Transaction().cursor
+
+        date_column = 'COALESCE(write_date, create_date)'
+        while True:
+            clauses = []
+            params = []
+            if cursor:
+                last_date, last_sale = cursor
+                clauses.append('(' + date_column + ' > %s '
+                    'OR (' + date_column + ' = %s AND id > %s))')
+                params.extend([last_date, last_date, last_sale])
+            if closed_only:
+                clauses.append('closing IS NOT NULL')
+            if start_date:
+                clauses.append('sale_date >= %s')
+                params.append(start_date)
+            if end_date:
+                clauses.append('sale_date <= %s')
+                params.append(end_date)
+            where = clauses and 'WHERE ' + ' AND '.join(clauses) or ''
+            db_cursor.execute('SELECT ' + ', '.join(SALE_COLUMNS) + ' '
+                'FROM "' + sale_obj._table + '" '
+                + where + ' '
+                'ORDER BY ' + date_column + ', id '
+                'LIMIT %s', params + [chunk_size])
+            rows = db_cursor.fetchall()
+            if not rows:
+                return
+
+            sales = []
+            id2sale = {}
+            for row in rows:
+                sale = dict(zip(SALE_COLUMNS, row))
+                sale['lines'] = []
+                sales.append(sale)
+                id2sale[sale['id']] = sale
+            # The dates are taken from the columns, as SQLite does not type
+            # the result of COALESCE
+            cursor = (sales[-1]['write_date'] or sales[-1]['create_date'],
+                sales[-1]['id'])
+
+            sale_ids = id2sale.keys()
+            db_cursor.execute('SELECT sale, ' + ', '.join(
+                    x for x in LINE_COLUMNS if x != 'total') + ' '
+                'FROM "' + line_obj._table + '" '
+                'WHERE sale IN (' + ','.join(('%s',) * len(sale_ids)) + ') '
+                'ORDER BY sale, create_date, id', sale_ids)
+            subtotals = {}
+            for row in db_cursor.fetchall():
+                line = dict(zip(['sale'] + [x for x in LINE_COLUMNS
+                            if x != 'total'], row))
+                sale_id = line.pop('sale')
+                subtotal = subtotals.get(sale_id, Decimal(0))
+                if line['line_type'] == 'sum':
+                    line['total'] = subtotal
+                else:
+                    line['total'] = Decimal(str(line['unit_price'] or 0)) \
+                        * Decimal(str(line['quantity'] or 0))
+                    subtotals[sale_id] = subtotal + line['total']
+                id2sale[sale_id]['lines'].append(line)
+
+            # The consumer gets the cursor to resume from with the last sale
+            # of each chunk
+            for sale in sales:
+                sale['cursor'] = None
+            sales[-1]['cursor'] = cursor
+            for sale in sales:
+                yield sale
+
+    def _write_csv(self, output, sales):
+        writer = csv.writer(output)
+        writer.writerow(['sale_' + x for x in SALE_COLUMNS]
+            + ['line_' + x for x in LINE_COLUMNS])
+        for sale in sales:
+            sale_row = [_csv_value(sale[x]) for x in SALE_COLUMNS]
+            for line in sale['lines'] or [dict.fromkeys(LINE_COLUMNS)]:
+                writer.writerow(sale_row
+                    + [_csv_value(line[x]) for x in LINE_COLUMNS])
+
+    def _write_jsonl(self, output, sales):
+        for sale in sales:
+            record = dict((x, _format_value(sale[x])) for x in SALE_COLUMNS)
+            record['lines'] = [dict((x, _format_value(line[x]))
+                    for x in LINE_COLUMNS) for line in sale['lines']]
+            output.write(json.dumps(record) + '\n')
+
+    def export(self, path, format='csv', since_last=True, closed_only=False,
+            start_date=None, end_date=None):
+        '''
+        Stream the sales with their lines to the file at path, relative to
+        the export directory, in CSV (one row per line) or JSON Lines (one
+        sale per line) format.
+        With since_last, only the sales modified since the last export are
+        written, and start_date and end_date limit the sale dates. The
+        modification date stays the cursor, so that the journaled sales
+        replayed late are not skipped. Return the id of the export.
+        '''
+        if format not in ('csv', 'jsonl'):
+            self.raise_user_error('unknown_format', (format,))
+        if (not path or os.path.isabs(path)
+                or os.pardir in path.replace(os.sep, '/').split('/')):
+            self.raise_user_error('invalid_path', (path,))
+        file_path = os.path.join(get_export_directory(), path)
+        if not os.path.isdir(os.path.dirname(file_path)):
+            os.makedirs(os.path.dirname(file_path))
+        cursor = since_last and self.get_cursor() or None
+        state = {'sales': 0, 'cursor': cursor}
+
+        def sales():
+            for sale in self.iter_sales(cursor, closed_only=closed_only,
+                    start_date=start_date, end_date=end_date):
+                state['sales'] += 1
+                if sale['cursor']:
+                    state['cursor'] = sale['cursor']
+                yield sale
+
+        with open(file_path, 'wb') as output:
+            getattr(self, '_write_' + format)(output, sales())
+
+        # The sales out of the period are not exported, so the cursor would
+        # skip them
+        if start_date or end_date:
+            state['cursor'] = None
+        last_date, last_sale = state['cursor'] or (None, None)
+        return self.create({
+                'path': path,
+                'format': format,
+                'sales': state['sales'],
+                'last_date': last_date,
+                'last_sale': last_sale,
+                'cursor_date': last_date and last_date.isoformat(' '),
+                })
+
+PosCashExport()
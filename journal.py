@@ -0,0 +1,745 @@
+#This file is part of Tryton.  The COPYRIGHT file at the top level of
+#this repository contains the full copyright notices and license terms.
+from decimal import Decimal
+import datetime
+import fcntl
+import json
+import logging
+import os
+import threading
+import uuid
+
+from trytond.config import CONFIG
+from trytond.model import ModelSQL, ModelView, fields
+from trytond.transaction import Transaction
+from trytond.pool import Pool
+from probe import timed
+
+_JOURNAL_BATCH_SIZE = 500
+_JOURNAL_DATE_FORMATS = ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S')
+# The SQLite module of Python 2 commits before a SAVEPOINT statement
+_SAVEPOINT = CONFIG['db_type'] == 'postgresql'
+
+logger = logging.getLogger('pos_cash')
+
+
+def _encode(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError(repr(value))
+
+
+def _decimal(value):
+    return Decimal(str(value or 0))
+
+
+def _decode_date(value):
+    for format in _JOURNAL_DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, format)
+        except ValueError:
+            continue
+    raise ValueError('Invalid date %r' % value)
+
+
+def _new_key():
+    return uuid.uuid4().hex[:16]
+
+
+def get_journal_path(lane, kind='journal'):
+    '''
+    Return the path of the journal file of lane in the data path, or of its
+    quarantine file with kind 'quarantine'
+    '''
+    if lane:
+        name = '%s-%s.jsonl' % (kind, lane.replace(os.sep, '_'))
+    else:
+        name = '%s.jsonl' % kind
+    return os.path.join(CONFIG['data_path'], 'pos_cash', name)
+
+
+class Journal(object):
+    '''
+    Append-only file of the sale operations of a lane, one JSON entry per
+    line. The first entry is the header holding the key of the file, which
+    changes when the replayed entries are dropped by rotate.
+    An entry is on disk once append returns.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._checked = False
+
+    def _open(self):
+        '''
+        Return the journal file opened to append, locked against the other
+        processes
+        '''
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        while True:
+            journal_file = open(self.path, 'ab')
+            fcntl.flock(journal_file.fileno(), fcntl.LOCK_EX)
+            # Open again the file rotated while waiting for the lock
+            try:
+                if os.path.samestat(os.fstat(journal_file.fileno()),
+                        os.stat(self.path)):
+                    return journal_file
+            except OSError:
+                pass
+            journal_file.close()
+
+    def _header(self):
+        return json.dumps({
+                'op': 'journal',
+                'key': uuid.uuid4().hex,
+                }) + '\n'
+
+    def _check_tail(self, journal_file):
+        # Terminate the entry of an interrupted append, so that it stays
+        # apart from the next one
+        with open(self.path, 'rb') as tail:
+            tail.seek(-1, os.SEEK_END)
+            if tail.read(1) != '\n':
+                journal_file.write('\n')
+        self._checked = True
+
+    def append(self, entry):
+        data = json.dumps(entry, default=_encode) + '\n'
+        with self._lock:
+            journal_file = self._open()
+            try:
+                if not os.fstat(journal_file.fileno()).st_size:
+                    journal_file.write(self._header())
+                    self._checked = True
+                elif not self._checked:
+                    self._check_tail(journal_file)
+                journal_file.write(data)
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+            finally:
+                journal_file.close()
+
+    def _read_header(self, journal_file):
+        '''
+        Return the key and the length of the header of the journal file,
+        None and 0 if it has no header
+        '''
+        line = journal_file.readline()
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            entry = None
+        if isinstance(entry, dict) and entry.get('op') == 'journal':
+            return entry['key'], len(line)
+        return None, 0
+
+    def get_key(self):
+        '''
+        Return the key of the journal file or None if it has no header
+        '''
+        try:
+            journal_file = open(self.path, 'rb')
+        except IOError:
+            return None
+        with journal_file:
+            return self._read_header(journal_file)[0]
+
+    def rotate(self, key, offset):
+        '''
+        Replace the journal file of key by a new one holding only its
+        entries from offset, the previous ones being replayed.
+        Return the key of the new file or None if the file is no longer the
+        one of key.
+        '''
+        with self._lock:
+            journal_file = self._open()
+            try:
+                with open(self.path, 'rb') as old_file:
+                    old_key, start = self._read_header(old_file)
+                    if old_key != key or offset <= start:
+                        return None
+                    old_file.seek(offset)
+                    tail = old_file.read()
+                new_header = self._header()
+                tmp_path = '%s.%s' % (self.path, os.getpid())
+                with open(tmp_path, 'wb') as new_file:
+                    new_file.write(new_header)
+                    new_file.write(tail)
+                    if tail and not tail.endswith('\n'):
+                        new_file.write('\n')
+                    new_file.flush()
+                    os.fsync(new_file.fileno())
+                os.rename(tmp_path, self.path)
+                self._checked = True
+            finally:
+                journal_file.close()
+        return json.loads(new_header)['key']
+
+    def read(self, offset=0):
+        '''
+        Yield the entries from offset with the offset of the next entry.
+        The last entry is left out while its append is not complete.
+        '''
+        try:
+            journal_file = open(self.path, 'rb')
+        except IOError:
+            return iter([])
+        return self._read_entries(journal_file, offset)
+
+    def read_since(self, key, offset):
+        '''
+        Return the key of the journal file and an iterator like read on its
+        entries from offset if it is the file of key, or else on all its
+        entries, the header excluded.
+        '''
+        try:
+            journal_file = open(self.path, 'rb')
+        except IOError:
+            return None, iter([])
+        file_key, start = self._read_header(journal_file)
+        if file_key != key:
+            offset = start
+        return file_key, self._read_entries(journal_file, offset)
+
+    def _read_entries(self, journal_file, offset):
+        with journal_file:
+            journal_file.seek(offset)
+            for line in journal_file:
+                if not line.endswith('\n'):
+                    break
+                offset += len(line)
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    logger.warning('Skip broken entry of journal %s: %r'
+                        % (self.path, line))
+                    continue
+                yield entry, offset
+
+_JOURNALS = {}
+_JOURNALS_LOCK = threading.Lock()
+
+
+def get_journal(lane, kind='journal'):
+    '''
+    Return the journal of lane, or its quarantine with kind 'quarantine'
+    '''
+    path = get_journal_path(lane, kind)
+    with _JOURNALS_LOCK:
+        journal = _JOURNALS.get(path)
+        if not journal:
+            journal = _JOURNALS[path] = Journal(path)
+    return journal
+
+
+class _Record(object):
+    '''
+    Stand-in for a browse record, built from journal entries
+    '''
+
+    def __init__(self, **values):
+        self.__dict__.update(values)
+
+# The sales of the journals which are not yet cashed by journal key
+_SALES = {}
+
+
+# In journal mode, the sale operations of a lane are appended to a local
+# journal file instead of being written to the database, and the receipt is
+# printed from the journal data. The journal is replayed later into sales and
+# lines, each entry once thanks to its journal key.
+class PosCashJournal(ModelSQL, ModelView):
+    'POS Journal'
+    _name = 'pos_cash.journal'
+    _description = __doc__
+    _rec_name = 'lane'
+
+    lane = fields.Char('Lane', readonly=True, select=1)
+    offset = fields.Integer('Offset', readonly=True,
+            help='Position up to which the journal file is replayed')
+    file_key = fields.Char('File key', readonly=True,
+            help='Key of the journal file which the offset is in')
+    entries = fields.Integer('Replayed entries', readonly=True)
+    quarantined = fields.Integer('Quarantined entries', readonly=True,
+            help='Entries of the sales which failed to replay, moved to '
+            'the quarantine file of the lane')
+    last_replay = fields.DateTime('Last replay', readonly=True)
+
+    def __init__(self):
+        super(PosCashJournal, self).__init__()
+        # The journal operations do not write to the database
+        self._rpc.update({
+            'open_sale': False,
+            'add_product': False,
+            'scan': False,
+            'add_sum': False,
+            'cash_sale': False,
+            'replay': True,
+        })
+        self._error_messages.update({
+            'unknown_sale': 'No sale "%s" in the journal!',
+            'sale_cashed': 'The sale "%s" is already cashed!',
+            'unknown_barcode': 'No product found for barcode "%s"!',
+            'unknown_product': 'Product "%s" is not available on the lane!',
+        })
+
+    def default_offset(self):
+        return 0
+
+    def default_entries(self):
+        return 0
+
+    def default_quarantined(self):
+        return 0
+
+    def _get_lane(self, lane=None):
+        if lane is None:
+            lane = Transaction().context.get('pos_lane')
+        return lane or None
+
+    def _get_receipt_code(self, entry):
+        '''
+        Return the receipt code printed for the sale of the entry, which the
+        entries written before it was journaled derive from the key
+        '''
+        return entry.get('receipt_code') or entry['key'].upper()
+
+    def _new_sale(self, entry):
+        return _Record(id=None, key=entry['key'], lane=entry['lane'],
+            receipt_code=self._get_receipt_code(entry), lines=[], taxes=[],
+            total_amount=Decimal(0), total_without_tax=Decimal(0),
+            total_tax=Decimal(0), total_paid=Decimal(0),
+            drawback=Decimal(0))
+
+    def _add_line(self, sale, entry):
+        '''
+        Add the line of the entry to sale and return it
+        '''
+        pool = Pool()
+        product_obj = pool.get('product.product')
+        line_obj = pool.get('pos_cash.sale.line')
+
+        if entry['line_type'] == 'sum':
+            line = _Record(line_type='sum', name='Sum:', product=None,
+                quantity=Decimal(0), unit_price=Decimal(0),
+                total=sale.total_amount, without_tax=Decimal(0), taxes=[])
+        else:
+            quantity = _decimal(entry['quantity'])
+            unit_price = _decimal(entry['unit_price'])
+            amounts = line_obj._get_amounts(entry['line_type'],
+                entry['product'], unit_price, quantity)
+            # The open sales outlive the transaction, so they keep values
+            # and no browse records
+            snapshot = product_obj.get_snapshot()
+            name = None
+            if entry['product'] in snapshot:
+                name = snapshot.get_name(entry['product'])
+            if name is None:
+                name = product_obj.browse(entry['product']).name
+            product = _Record(id=entry['product'], name=name)
+            taxes = [_Record(id=x, percentage=snapshot.get_tax_percentage(x))
+                for x in amounts['taxes'][0][1]]
+            line = _Record(line_type=entry['line_type'], name=product.name,
+                product=product, quantity=quantity,
+                unit_price=unit_price, total=unit_price * quantity,
+                without_tax=amounts['without_tax'], taxes=taxes)
+            sale.total_amount += line.total
+            sale.total_without_tax += line.without_tax
+            sale.total_tax = sale.total_amount - sale.total_without_tax
+            sale_tax_ids = set(x.id for x in sale.taxes)
+            sale.taxes.extend(x for x in line.taxes
+                if x.id not in sale_tax_ids)
+        sale.lines.append(line)
+        return line
+
+    def _pay(self, sale, amount):
+        sale_obj = Pool().get('pos_cash.sale')
+
+        if sale.total_paid <= amount:
+            sale.total_paid = amount
+        sale.drawback = sale_obj._get_drawback(sale.total_paid,
+            sale.total_amount)
+
+    def _get_state(self, lane):
+        state_ids = self.search([('lane', '=', lane)], limit=1)
+        return state_ids and self.browse(state_ids[0]) or None
+
+    def _get_sale(self, key):
+        '''
+        Return the open sale of key, rebuilt from the database and the
+        entries of the journal of the lane not yet replayed if the server
+        restarted since it was opened
+        '''
+        pool = Pool()
+        sale_obj = pool.get('pos_cash.sale')
+        line_obj = pool.get('pos_cash.sale.line')
+
+        if key in _SALES:
+            return _SALES[key]
+        # The state is read before the sale, so that the entries replayed
+        # meanwhile are read again from the journal
+        state = self._get_state(self._get_lane())
+        sale = None
+        line_keys = set()
+        sale_ids = sale_obj.search([('journal_key', '=', key)], limit=1)
+        if sale_ids:
+            replayed = sale_obj.browse(sale_ids[0])
+            if replayed.total_paid is not None:
+                self.raise_user_error('sale_cashed', (key,))
+            sale = self._new_sale({
+                    'key': key,
+                    'lane': replayed.lane,
+                    'receipt_code': replayed.receipt_code,
+                    })
+            line_ids = line_obj.search([('sale', '=', replayed.id)],
+                order=[('id', 'ASC')])
+            for line in line_obj.browse(line_ids):
+                self._add_line(sale, {
+                        'line_type': line.line_type,
+                        'product': line.product and line.product.id,
+                        'quantity': line.quantity,
+                        'unit_price': line.unit_price,
+                        })
+                line_keys.add(line.journal_key)
+
+        _, entries = get_journal(self._get_lane()).read_since(
+            state and state.file_key, state and state.offset or 0)
+        for entry, _ in entries:
+            if entry['op'] == 'sale' and entry['key'] == key:
+                sale = sale or self._new_sale(entry)
+            elif sale and entry.get('sale') == key:
+                if entry['op'] == 'cash':
+                    self.raise_user_error('sale_cashed', (key,))
+                elif entry['key'] not in line_keys:
+                    self._add_line(sale, entry)
+        if not sale:
+            self.raise_user_error('unknown_sale', (key,))
+        _SALES[key] = sale
+        return sale
+
+    def _show(self, method, record):
+        configuration_obj = Pool().get('pos_cash.configuration')
+        display = Pool().get('pos_cash.display', 'report')
+
+        if configuration_obj.get_profile()['display_port']:
+            getattr(display, method)(record)
+
+    @timed('journal.open_sale')
+    def open_sale(self):
+        '''
+        Open a sale in the journal of the lane and return its key
+        '''
+        key = _new_key()
+        # The code is journaled with the sale, so that the replayed sale
+        # carries the code printed on the receipt
+        entry = {
+            'op': 'sale',
+            'key': key,
+            'lane': self._get_lane(),
+            'date': datetime.datetime.now(),
+            'receipt_code': key.upper(),
+            }
+        get_journal(entry['lane']).append(entry)
+        _SALES[entry['key']] = self._new_sale(entry)
+        return entry['key']
+
+    @timed('journal.add_product')
+    def add_product(self, sale_key, product, quantity=1, unit_price=None):
+        '''
+        Add a line for product to the sale of the journal and return its key
+        '''
+        product_obj = Pool().get('product.product')
+
+        sale = self._get_sale(sale_key)
+        snapshot = product_obj.get_snapshot()
+        if product not in snapshot:
+            self.raise_user_error('unknown_product', (product,))
+        if unit_price is None:
+            unit_price = snapshot.get_list_price(product)
+        entry = {
+            'op': 'line',
+            'key': _new_key(),
+            'sale': sale_key,
+            'line_type': 'position',
+            'product': product,
+            'quantity': _decimal(quantity),
+            'unit_price': _decimal(unit_price),
+            }
+        get_journal(sale.lane).append(entry)
+        self._show('show_sale_line', self._add_line(sale, entry))
+        return entry['key']
+
+    @timed('journal.scan')
+    def scan(self, sale_key, barcode, qty=1):
+        product_obj = Pool().get('product.product')
+
+        barcode = barcode.strip()
+        snapshot = product_obj.get_snapshot()
+        product = snapshot.find(barcode)
+        if product is None:
+            self.raise_user_error('unknown_barcode', (barcode,))
+        return self.add_product(sale_key, product, qty,
+            snapshot.get_list_price(product))
+
+    @timed('journal.add_sum')
+    def add_sum(self, sale_key):
+        sale = self._get_sale(sale_key)
+        entry = {
+            'op': 'line',
+            'key': _new_key(),
+            'sale': sale_key,
+            'line_type': 'sum',
+            }
+        get_journal(sale.lane).append(entry)
+        self._add_line(sale, entry)
+        self._show('show_total', sale)
+        return entry['key']
+
+    @timed('journal.cash_sale')
+    def cash_sale(self, sale_key, cash_amount):
+        '''
+        Record the payment of the sale, print its receipt from the journal
+        data and return the drawback
+        '''
+        pool = Pool()
+        receipt = pool.get('pos_cash.receipt', 'report')
+        configuration_obj = pool.get('pos_cash.configuration')
+
+        configuration = configuration_obj.get_profile()
+        sale = self._get_sale(sale_key)
+        entry = {
+            'op': 'cash',
+            'key': _new_key(),
+            'sale': sale_key,
+            'amount': _decimal(cash_amount),
+            }
+        get_journal(sale.lane).append(entry)
+        self._pay(sale, entry['amount'])
+        del _SALES[sale_key]
+
+        self._show('show_paid', sale)
+        if configuration['printer_port']:
+            with Transaction().set_context(pos_journal=True):
+                receipt.print_sale(sale,
+                    kick_drawer=bool(configuration['logo']))
+        return sale.drawback
+
+    def _get_replay_values(self, sale_key, entries, key2sale,
+            done_line_keys):
+        '''
+        Return the values of the sale to create, the values of the lines to
+        create and the amount paid, to replay the entries of the sale which
+        are not yet in the database. Raise an exception for an entry which
+        can not be replayed.
+        '''
+        pool = Pool()
+        product_obj = pool.get('product.product')
+        line_obj = pool.get('pos_cash.sale.line')
+
+        line_types = dict(line_obj._columns['line_type'].selection)
+        sale_values = None
+        lines = []
+        amount = None
+        for entry in entries:
+            if entry['op'] == 'sale':
+                if sale_key not in key2sale:
+                    sale_values = {
+                        'journal_key': entry['key'],
+                        'lane': entry['lane'],
+                        'sale_date': _decode_date(entry['date']),
+                        'receipt_code': self._get_receipt_code(entry),
+                        }
+            elif entry['op'] == 'line':
+                if entry['key'] in done_line_keys:
+                    continue
+                if entry['line_type'] not in line_types:
+                    raise ValueError('Invalid line type %r'
+                        % entry['line_type'])
+                values = {
+                    'line_type': entry['line_type'],
+                    'journal_key': entry['key'],
+                    }
+                if entry['line_type'] != 'sum':
+                    values['product'] = int(entry['product'])
+                    values['quantity'] = _decimal(entry['quantity'])
+                    values['unit_price'] = _decimal(entry['unit_price'])
+                lines.append(values)
+            elif entry['op'] == 'cash':
+                paid = _decimal(entry['amount'])
+                if amount is None or amount < paid:
+                    amount = paid
+            else:
+                raise ValueError('Unknown operation %r' % entry['op'])
+        if sale_values is None and sale_key not in key2sale:
+            raise ValueError('Unknown sale %s' % sale_key)
+
+        product_ids = set(x['product'] for x in lines if 'product' in x)
+        if product_ids:
+            with Transaction().set_context(active_test=False):
+                missing = product_ids - set(product_obj.search([
+                            ('id', 'in', list(product_ids)),
+                            ]))
+            if missing:
+                raise ValueError('Unknown products %s'
+                    % ', '.join(str(x) for x in sorted(missing)))
+        return sale_values, lines, amount
+
+    def _replay_sale(self, sale_key, sale_values, lines, amount, key2sale):
+        pool = Pool()
+        sale_obj = pool.get('pos_cash.sale')
+        line_obj = pool.get('pos_cash.sale.line')
+
+        if sale_values:
+            with Transaction().set_context(pos_lane=sale_values['lane']):
+                key2sale[sale_key] = sale_obj.create(sale_values)
+        sale_id = key2sale[sale_key]
+        for values in lines:
+            values['sale'] = sale_id
+            line_obj.create(values)
+        if amount is not None:
+            if sale_obj.browse(sale_id).total_paid <= amount:
+                sale_obj.write(sale_id, {'total_paid': amount})
+
+    def replay(self, lane=None, batch_size=_JOURNAL_BATCH_SIZE):
+        '''
+        Replay at most batch_size entries of the journal of the lane into
+        sales and lines, from where the last replay stopped.
+        The entries of a sale which fails to replay are moved to the
+        quarantine file of the lane, the other sales are replayed.
+        Return the number of entries read.
+        '''
+        pool = Pool()
+        sale_obj = pool.get('pos_cash.sale')
+        line_obj = pool.get('pos_cash.sale.line')
+        cursor = Transaction().cursor
+
+        lane = self._get_lane(lane)
+        # Serialise the replays, so that each one starts at the offset
+        # stored by the previous one
+        cursor.lock(self._table)
+        state = self._get_state(lane)
+        # The offset is in the file of the stored key, a rotated file only
+        # holds entries not yet replayed
+        file_key, journal_entries = get_journal(lane).read_since(
+            state and state.file_key, state and state.offset or 0)
+        offset = state and state.file_key == file_key and state.offset or 0
+
+        entries = []
+        for entry, offset in journal_entries:
+            entries.append(entry)
+            if len(entries) >= batch_size:
+                break
+        if not entries:
+            return 0
+
+        # The entries are replayed sale by sale
+        sale_keys = []
+        sale_entries = {}
+        for entry in entries:
+            if entry.get('op') == 'journal':
+                continue
+            sale_key = entry.get('sale') or entry.get('key')
+            if sale_key not in sale_entries:
+                sale_keys.append(sale_key)
+                sale_entries[sale_key] = []
+            sale_entries[sale_key].append(entry)
+
+        # The entries already in the database are skipped
+        key2sale = {}
+        sale_ids = sale_obj.search([('journal_key', 'in', sale_keys)])
+        for sale in sale_obj.read(sale_ids, ['journal_key']):
+            key2sale[sale['journal_key']] = sale['id']
+        line_keys = [x.get('key') for x in entries if x.get('op') == 'line']
+        line_ids = line_obj.search([('journal_key', 'in', line_keys)])
+        done_line_keys = set(x['journal_key']
+            for x in line_obj.read(line_ids, ['journal_key']))
+
+        quarantined = 0
+        for sale_key in sale_keys:
+            try:
+                sale_values, lines, amount = self._get_replay_values(
+                    sale_key, sale_entries[sale_key], key2sale,
+                    done_line_keys)
+            except Exception:
+                quarantined += self._quarantine(lane, sale_key,
+                    sale_entries[sale_key])
+                continue
+            # Without savepoint, a sale failing to be written aborts the
+            # batch
+            if _SAVEPOINT:
+                cursor.execute('SAVEPOINT pos_cash_journal_sale')
+            try:
+                self._replay_sale(sale_key, sale_values, lines, amount,
+                    key2sale)
+            except Exception:
+                if not _SAVEPOINT:
+                    raise
+                cursor.execute('ROLLBACK TO SAVEPOINT pos_cash_journal_sale')
+                # The cache may hold records rolled back
+                cursor.cache.clear()
+                if sale_values:
+                    key2sale.pop(sale_key, None)
+                quarantined += self._quarantine(lane, sale_key,
+                    sale_entries[sale_key])
+            else:
+                if _SAVEPOINT:
+                    cursor.execute('RELEASE SAVEPOINT pos_cash_journal_sale')
+
+        values = {
+            'offset': offset,
+            'file_key': file_key,
+            'entries': (state and state.entries or 0) + len(entries),
+            'quarantined': (state and state.quarantined or 0) + quarantined,
+            'last_replay': datetime.datetime.now(),
+            }
+        if state:
+            self.write(state.id, values)
+        else:
+            values['lane'] = lane
+            self.create(values)
+        return len(entries)
+
+    def _quarantine(self, lane, sale_key, entries):
+        '''
+        Append the entries of the sale which failed to replay to the
+        quarantine file of the lane, to be checked and replayed by hand.
+        Return the number of entries.
+        '''
+        logger.exception('Quarantine the journal entries of sale %s of '
+            'lane %s' % (sale_key, lane))
+        quarantine = get_journal(lane, 'quarantine')
+        for entry in entries:
+            quarantine.append(entry)
+        return len(entries)
+
+    def replay_all(self):
+        '''
+        Replay the journals of all lanes, committing after each batch, and
+        rotate the journal files to drop the entries replayed.
+        Called by the cron.
+        '''
+        directory = os.path.join(CONFIG['data_path'], 'pos_cash')
+        if not os.path.isdir(directory):
+            return True
+        for name in sorted(os.listdir(directory)):
+            if name == 'journal.jsonl':
+                lane = None
+            elif name.startswith('journal-') and name.endswith('.jsonl'):
+                lane = name[len('journal-'):-len('.jsonl')]
+            else:
+                continue
+            while self.replay(lane) == _JOURNAL_BATCH_SIZE:
+                Transaction().cursor.commit()
+            Transaction().cursor.commit()
+            # Only the committed entries are dropped
+            state = self._get_state(lane)
+            if state:
+                get_journal(lane).rotate(state.file_key, state.offset)
+        return True
+
+PosCashJournal()
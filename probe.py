@@ -0,0 +1,120 @@
+#This file is part of Tryton.  The COPYRIGHT file at the top level of
+#this repository contains the full copyright notices and license terms.
+import logging
+import threading
+import time
+
+from trytond.model import Model
+from trytond.transaction import Transaction
+
+# Upper bounds in milliseconds of the latency histogram buckets
+LATENCY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+_METRICS = {}
+_METRICS_LOCK = threading.Lock()
+
+logger = logging.getLogger('pos_cash.probe')
+
+
+def _get_lane():
+    try:
+        context = Transaction().context or {}
+    except AttributeError:
+        # Outside of a transaction, e.g. in a device worker
+        context = {}
+    return context.get('pos_lane') or None
+
+
+def record(name, duration, lane=None, nbytes=0):
+    '''
+    Record a measure of the probe name.
+
+    :param duration: the duration in seconds
+    :param lane: the lane or, for device probes, the device port
+    :param nbytes: the number of bytes written to a device
+    '''
+    milliseconds = duration * 1000
+    with _METRICS_LOCK:
+        metric = _METRICS.get((name, lane))
+        if metric is None:
+            metric = _METRICS[(name, lane)] = {
+                'name': name,
+                'lane': lane,
+                'count': 0,
+                'total_ms': 0.0,
+                'max_ms': 0.0,
+                'bytes': 0,
+                'buckets': [0] * (len(LATENCY_BUCKETS) + 1),
+                }
+        metric['count'] += 1
+        metric['total_ms'] += milliseconds
+        metric['max_ms'] = max(metric['max_ms'], milliseconds)
+        metric['bytes'] += nbytes
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if milliseconds <= bound:
+                break
+        else:
+            i = len(LATENCY_BUCKETS)
+        metric['buckets'][i] += 1
+    logger.info('probe=%s lane=%s ms=%.3f bytes=%d'
+        % (name, lane or '-', milliseconds, nbytes))
+
+
+def timed(name):
+    '''
+    Decorator recording the duration of each call as the probe name for the
+    lane of the context.
+    '''
+    def decorator(function):
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(name, time.time() - start, _get_lane())
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__ = function.__doc__
+        return wrapper
+    return decorator
+
+
+def get_metrics():
+    '''
+    Return a list of the metrics by probe and lane. The histogram buckets
+    are given as (upper bound in ms, count) tuples, the last bound being None.
+    '''
+    res = []
+    with _METRICS_LOCK:
+        for metric in _METRICS.itervalues():
+            metric = metric.copy()
+            metric['buckets'] = zip(list(LATENCY_BUCKETS) + [None],
+                metric['buckets'])
+            res.append(metric)
+    res.sort(key=lambda x: (x['name'], x['lane']))
+    return res
+
+
+def reset_metrics():
+    with _METRICS_LOCK:
+        _METRICS.clear()
+
+
+class PosCashProbe(Model):
+    _name = 'pos_cash.probe'
+    _description = 'POS Probe'
+
+    def __init__(self):
+        super(PosCashProbe, self).__init__()
+        self._rpc.update({
+            'get_metrics': False,
+            'reset_metrics': False,
+        })
+
+    def get_metrics(self):
+        return get_metrics()
+
+    def reset_metrics(self):
+        reset_metrics()
+        return True
+
+PosCashProbe()
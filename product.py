@@ -1,7 +1,25 @@
 #This file is part of Tryton.  The COPYRIGHT file at the top level of
 #this repository contains the full copyright notices and license terms.
+from array import array
+from decimal import Decimal
+import datetime
+import logging
+import threading
+import time
+
 from trytond.model import ModelSQL, ModelView, fields
+from trytond.transaction import Transaction
 from trytond.pool import Pool
+from trytond.cache import Cache
+
+_SNAPSHOT_REFRESH_INTERVAL = 5
+# The products written shortly before a refresh are read again by the next
+# one, as their transactions may be committed after it
+_SNAPSHOT_OVERLAP = 60
+# The list prices are stored as integers of 1/_PRICE_SCALE
+_PRICE_SCALE = 10000
+
+logger = logging.getLogger('pos_cash')
 
 class Template(ModelSQL, ModelView):
     _name = 'product.template'
@@ -23,17 +41,363 @@ class Template(ModelSQL, ModelView):
         return res
 
     def get_taxes(self, ids, name):
+        category_obj = Pool().get('product.category')
         res = {}
         name = name[:-5]
+        category2taxes = None
         for product in self.browse(ids):
             if product.taxes_category:
+                if category2taxes is None:
+                    category2taxes = category_obj.get_taxes_index(name)
                 res[product.id] = []
-                c = product.category
-                while c:
-                    res[product.id] += [x.id for x in c[name]]
-                    c = c.parent
+                if product.category:
+                    res[product.id] += category2taxes.get(
+                        product.category.id, [])
             else:
                 res[product.id] = [x.id for x in product[name]]
         return res
 
+    def delete(self, ids):
+        product_obj = Pool().get('product.product')
+        res = super(Template, self).delete(ids)
+        # Rebuild the product snapshots without the deleted products
+        product_obj._get_snapshot_generation.reset()
+        return res
+
 Template()
+
+
+class Category(ModelSQL, ModelView):
+    _name = 'product.category'
+
+    @Cache('product_category.get_taxes_index')
+    def get_taxes_index(self, name):
+        '''
+        Return a dictionary with the category ids as key and the ids of the
+        taxes of the category and all its parents as value.
+
+        :param name: the tax field, customer_taxes or supplier_taxes
+        '''
+        category_ids = self.search([])
+        categories = {}
+        for category in self.read(category_ids, ['parent', name]):
+            categories[category['id']] = category
+
+        res = {}
+        for category_id in category_ids:
+            # Walk up to the first category already resolved
+            path = []
+            c = category_id
+            while c and c not in res:
+                path.append(c)
+                c = categories[c]['parent']
+            taxes = c and res[c] or []
+            for c in reversed(path):
+                taxes = categories[c][name] + taxes
+                res[c] = taxes
+        return res
+
+    def _reset_taxes(self):
+        product_obj = Pool().get('product.product')
+        # Restart the cache for get_taxes_index
+        self.get_taxes_index.reset()
+        # The taxes of the products change without a write on them
+        product_obj._get_snapshot_generation.reset()
+
+    def create(self, vals):
+        res = super(Category, self).create(vals)
+        self._reset_taxes()
+        return res
+
+    def write(self, ids, vals):
+        res = super(Category, self).write(ids, vals)
+        self._reset_taxes()
+        return res
+
+    def delete(self, ids):
+        res = super(Category, self).delete(ids)
+        self._reset_taxes()
+        return res
+
+Category()
+
+
+class Tax(ModelSQL, ModelView):
+    _name = 'account.tax'
+
+    def write(self, ids, vals):
+        category_obj = Pool().get('product.category')
+        res = super(Tax, self).write(ids, vals)
+        category_obj._reset_taxes()
+        return res
+
+    def delete(self, ids):
+        category_obj = Pool().get('product.category')
+        res = super(Tax, self).delete(ids)
+        category_obj._reset_taxes()
+        return res
+
+Tax()
+
+
+class ProductSnapshot(object):
+    '''
+    Compact copy of the products for the lanes: id, name per language, list
+    price, customer tax ids and barcode. The numbers are kept in arrays.
+    '''
+
+    def __init__(self, generation, languages=None):
+        self.generation = generation
+        self.lock = threading.Lock()
+        self.last_date = None
+        self.refresh_time = 0
+        # A snapshot of a new generation is being built
+        self.rebuilding = False
+        self.languages = set(languages or [])
+        self._ids = array('l')
+        self._prices = array('l')
+        # The index of the tuple of the customer tax ids in _tax_sets
+        self._tax_set = array('l')
+        self._tax_sets = [()]
+        self._tax_set_indexes = {(): 0}
+        self._names = {}
+        self._codes = []
+        self._positions = {}
+        self._barcodes = {}
+        self._tax_percentages = {}
+
+    # The readers take no lock: a position is published in _positions or
+    # _barcodes only once the arrays hold it, and each value of a position
+    # is replaced by a single assignment.
+
+    def _set(self, product):
+        position = self._positions.get(product['id'])
+        price = int((product['list_price'] or 0) * _PRICE_SCALE)
+        taxes = tuple(product['customer_taxes_used'])
+        tax_set = self._tax_set_indexes.get(taxes)
+        if tax_set is None:
+            self._tax_sets.append(taxes)
+            tax_set = self._tax_set_indexes[taxes] = len(self._tax_sets) - 1
+        if position is None:
+            position = len(self._ids)
+            self._ids.append(product['id'])
+            self._prices.append(price)
+            self._tax_set.append(tax_set)
+            for names in self._names.itervalues():
+                names.append(None)
+            self._codes.append(None)
+            self._positions[product['id']] = position
+        else:
+            self._prices[position] = price
+            self._tax_set[position] = tax_set
+        old_code = self._codes[position]
+        if old_code and self._barcodes.get(old_code) == position:
+            del self._barcodes[old_code]
+        code = product['active'] and product['code'] or None
+        self._codes[position] = code
+        if code:
+            self._barcodes[code] = position
+
+    def _set_names(self, language, products):
+        names = self._names.get(language)
+        new = names is None
+        if new:
+            names = [None] * len(self._ids)
+        for product in products:
+            names[self._positions[product['id']]] = product['name']
+        if new:
+            self._names[language] = names
+
+    def refresh(self):
+        '''
+        Read the products created or written since the last refresh, all of
+        them the first time, and the names of all the products in the
+        languages added since.
+        '''
+        pool = Pool()
+        product_obj = pool.get('product.product')
+        template_obj = pool.get('product.template')
+        tax_obj = pool.get('account.tax')
+        cursor = Transaction().cursor
+
+        # The dates are compared to the stored ones, which are set by the
+        # clock of the server writing them. The columns are read as SQLite
+        # does not type the result of COALESCE.
+        query = ('SELECT p.id, p.create_date, p.write_date, '
+                't.create_date, t.write_date '
+            'FROM "' + product_obj._table + '" AS p '
+                'JOIN "' + template_obj._table + '" AS t '
+                    'ON t.id = p.template ')
+        params = []
+        if self.last_date:
+            since = self.last_date - datetime.timedelta(
+                seconds=_SNAPSHOT_OVERLAP)
+            query += ('WHERE COALESCE(p.write_date, p.create_date) > %s '
+                    'OR COALESCE(t.write_date, t.create_date) > %s')
+            params = [since, since]
+        cursor.execute(query, params)
+        product_ids = []
+        last_date = self.last_date
+        for row in cursor.fetchall():
+            product_ids.append(row[0])
+            for date in row[1:]:
+                if date and (not last_date or date > last_date):
+                    last_date = date
+
+        for i in range(0, len(product_ids), cursor.IN_MAX):
+            products = product_obj.read(product_ids[i:i + cursor.IN_MAX],
+                ['code', 'list_price', 'active', 'customer_taxes_used'])
+            # The percentages are read before the products refer to them
+            tax_ids = set()
+            for product in products:
+                tax_ids.update(product['customer_taxes_used'])
+            tax_ids.difference_update(self._tax_percentages)
+            for tax in tax_obj.read(list(tax_ids), ['percentage']):
+                self._tax_percentages[tax['id']] = (tax['percentage']
+                    or Decimal(0))
+            for product in products:
+                self._set(product)
+
+        for language in list(self.languages):
+            if language in self._names:
+                ids = product_ids
+            else:
+                ids = self._ids.tolist()
+            with Transaction().set_context(language=language):
+                for i in range(0, len(ids), cursor.IN_MAX):
+                    self._set_names(language,
+                        product_obj.read(ids[i:i + cursor.IN_MAX], ['name']))
+        self.last_date = last_date
+        self.refresh_time = time.time()
+
+    def __contains__(self, product_id):
+        return product_id in self._positions
+
+    def find(self, barcode):
+        '''
+        Return the id of the active product with barcode or None
+        '''
+        position = self._barcodes.get(barcode)
+        if position is None:
+            return None
+        return self._ids[position]
+
+    def get_name(self, product_id, language=None):
+        '''
+        Return the name of the product in the language, by default the one
+        of the transaction, or None if the names of the language are not
+        read yet. They are read by the next refresh.
+        '''
+        if language is None:
+            language = Transaction().language
+        names = self._names.get(language)
+        if names is None:
+            self.languages.add(language)
+            return None
+        return names[self._positions[product_id]]
+
+    def get_list_price(self, product_id):
+        return (Decimal(self._prices[self._positions[product_id]])
+            / _PRICE_SCALE)
+
+    def get_taxes(self, product_id):
+        '''
+        Return the ids of the customer taxes of the product
+        '''
+        return self._tax_sets[self._tax_set[self._positions[product_id]]]
+
+    def get_tax_percentage(self, tax_id):
+        return self._tax_percentages[tax_id]
+
+_SNAPSHOTS = {}
+_SNAPSHOTS_LOCK = threading.Lock()
+
+
+def _rebuild_snapshot(database_name, user, generation, languages):
+    '''
+    Build a new product snapshot of the database for generation and put it
+    in place of the current one
+    '''
+    try:
+        with Transaction().start(database_name, user, readonly=True):
+            snapshot = ProductSnapshot(generation, languages)
+            snapshot.refresh()
+    except Exception:
+        logger.exception('Unable to rebuild the product snapshot of %s'
+            % database_name)
+        # Retried by the next refresh
+        with _SNAPSHOTS_LOCK:
+            current = _SNAPSHOTS.get(database_name)
+        if current:
+            current.rebuilding = False
+        return
+    with _SNAPSHOTS_LOCK:
+        _SNAPSHOTS[database_name] = snapshot
+
+
+class Product(ModelSQL, ModelView):
+    _name = 'product.product'
+
+    def __init__(self):
+        super(Product, self).__init__()
+        self._rpc.update({
+            'refresh_snapshot': True,
+        })
+
+    @Cache('product_product.get_snapshot_generation', timeout=0)
+    def _get_snapshot_generation(self):
+        return time.time()
+
+    def get_snapshot_generation(self):
+        '''
+        Return a new value each time the cache is reset, which makes the
+        product snapshot to be rebuilt.
+        '''
+        # The cache keys on the user and the context, while the generation
+        # is the same for all the lanes
+        with Transaction().set_user(0):
+            with Transaction().reset_context():
+                return self._get_snapshot_generation()
+
+    def get_snapshot(self):
+        '''
+        Return the product snapshot of the database, refreshed with the
+        products written since at most _SNAPSHOT_REFRESH_INTERVAL seconds.
+        A snapshot of a former generation is served until the new one is
+        built in the background.
+        '''
+        database_name = Transaction().cursor.database_name
+        generation = self.get_snapshot_generation()
+        with _SNAPSHOTS_LOCK:
+            snapshot = _SNAPSHOTS.get(database_name)
+            if snapshot is None:
+                snapshot = _SNAPSHOTS[database_name] = ProductSnapshot(
+                    generation, [Transaction().language])
+        with snapshot.lock:
+            if (time.time() - snapshot.refresh_time
+                    >= _SNAPSHOT_REFRESH_INTERVAL):
+                if (snapshot.generation != generation
+                        and not snapshot.rebuilding):
+                    snapshot.rebuilding = True
+                    thread = threading.Thread(target=_rebuild_snapshot,
+                        args=(database_name, Transaction().user, generation,
+                            list(snapshot.languages)))
+                    thread.daemon = True
+                    thread.start()
+                snapshot.refresh()
+        return snapshot
+
+    def refresh_snapshot(self):
+        '''
+        Warm and refresh the product snapshot. Called by the cron.
+        '''
+        self.get_snapshot()
+        return True
+
+    def delete(self, ids):
+        res = super(Product, self).delete(ids)
+        # Rebuild the product snapshots without the deleted products
+        self._get_snapshot_generation.reset()
+        return res
+
+Product()
@@ -1,103 +1,309 @@
 #This file is part of Tryton.  The COPYRIGHT file at the top level of
 #this repository contains the full copyright notices and license terms.
-from escpos import escpos
+from escpos import escpos, raster
 from decimal import Decimal
+import ast
 import base64
 import cStringIO
 import datetime
+import hashlib
+import logging
+import os
+import threading
+import time
+import Queue
 import serial
 
+from trytond.config import CONFIG
+from trytond.model import ModelSQL, ModelView
 from trytond.transaction import Transaction
 from trytond.report import Report
 from trytond.pool import Pool
+from trytond.cache import Cache
+from probe import timed, record
+from spool import write_device
 
 _ROW_CHARACTERS = 42
 _DIGITS = 9
+_DISPLAY_DIGITS = 20
+_DISPLAY_BAUD = 9600
+_DISPLAY_QUEUE_SIZE = 4
+_DISPLAY_RECONNECT_DELAY = 0.5
+_DISPLAY_RECONNECT_MAX_DELAY = 30
+_LOGO_DITHER = raster.DITHER_FLOYD_STEINBERG
+
+logger = logging.getLogger('pos_cash')
+
+# Raster commands of the receipt logos by SHA-1 of the logo and dithering
+_LOGO_RASTERS = {}
+
+
+def _grouping_sizes(grouping):
+    '''
+    Yield the sizes of the digit groups from the right like locale does:
+    0 repeats the last size and -1 or 127 stops the grouping.
+    '''
+    last = None
+    for size in grouping:
+        if size == 0:
+            while last:
+                yield last
+            return
+        if size < 0 or size >= 127:
+            return
+        yield size
+        last = size
+
+
+class LangFormatter(object):
+    '''
+    Number and date formatting of a language, without database access
+    '''
+
+    def __init__(self, decimal_point='.', thousands_sep='', grouping=None,
+            date='%m/%d/%Y'):
+        self.decimal_point = decimal_point
+        self.thousands_sep = thousands_sep
+        self.grouping = grouping or []
+        self.date = date
+
+    def _group(self, digits):
+        if not self.thousands_sep:
+            return digits
+        groups = []
+        for size in _grouping_sizes(self.grouping):
+            if len(digits) <= size:
+                break
+            groups.append(digits[-size:])
+            digits = digits[:-size]
+        groups.append(digits)
+        return self.thousands_sep.join(reversed(groups))
+
+    def format(self, value, digits=2, grouping=True, date=False):
+        '''
+        Format value like Report.format_lang
+        '''
+        if value is None or value is False:
+            return ''
+        if date or isinstance(value, datetime.date):
+            return value.strftime(self.date.encode('utf-8')).decode('utf-8')
+        text = '%.*f' % (digits, value)
+        sign = ''
+        if text.startswith('-'):
+            sign, text = '-', text[1:]
+        if '.' in text:
+            integer, fraction = text.split('.')
+        else:
+            integer, fraction = text, ''
+        if grouping:
+            integer = self._group(integer)
+        if fraction:
+            return sign + integer + self.decimal_point + fraction
+        return sign + integer
+
+
+class Lang(ModelSQL, ModelView):
+    _name = 'ir.lang'
+
+    @Cache('ir_lang.get_formatter')
+    def get_formatter(self, code):
+        '''
+        Return the LangFormatter of the language code, of English if there
+        is no such language.
+        '''
+        lang_ids = self.search([('code', '=', code)], limit=1)
+        if not lang_ids:
+            lang_ids = self.search([('code', '=', 'en_US')], limit=1)
+        if not lang_ids:
+            return LangFormatter()
+        lang = self.browse(lang_ids[0])
+        try:
+            grouping = ast.literal_eval(lang.grouping or '[]')
+        except (ValueError, SyntaxError):
+            grouping = []
+        return LangFormatter(lang.decimal_point, lang.thousands_sep or '',
+            grouping, lang.date)
+
+    def create(self, vals):
+        res = super(Lang, self).create(vals)
+        # Restart the cache for get_formatter
+        self.get_formatter.reset()
+        return res
+
+    def write(self, ids, vals):
+        res = super(Lang, self).write(ids, vals)
+        # Restart the cache for get_formatter
+        self.get_formatter.reset()
+        return res
+
+    def delete(self, ids):
+        res = super(Lang, self).delete(ids)
+        # Restart the cache for get_formatter
+        self.get_formatter.reset()
+        return res
+
+Lang()
+
+
+class ReceiptJob(object):
+    '''
+    The state of one printing: the profile of the lane, its logo, the
+    printer buffering the output and the sale printed.
+    '''
+
+    def __init__(self, profile):
+        self.profile = profile
+        self.logo = None
+        if profile['logo']:
+            self.logo = base64.decodestring(profile['logo'])
+        self.printer = escpos.Printer(None)
+        self.printer.start_buffer()
+        self.sale_id = None
+
 
 class Receipt(Report):
     _name = 'pos_cash.receipt'
 
-    def __init__(self):
-        super(Receipt, self).__init__()
-        self._config = False
+    def _get_lang(self):
+        lang_obj = Pool().get('ir.lang')
+        return lang_obj.get_formatter(Transaction().language)
 
-    def load_config(self):
+    def _open_job(self):
+        '''
+        Return a new job for the printer of the lane or None if it has none.
+        The report is shared by all the lanes, so nothing is kept on it.
+        '''
         configuration_obj = Pool().get('pos_cash.configuration')
 
-        self._port = None
-        self._logo = None
-        configuration_id = configuration_obj.search([])[0]
-        configuration = configuration_obj.browse(configuration_id)
-
-        self._config = configuration
-        if configuration.printer_port:
-            self._port = escpos.FileDevice(self._config.printer_port)
-        if self._config.logo:
-            self._logo = base64.decodestring(self._config.logo)
-
-    def _open_device(self):
-        self._printer = None
+        profile = configuration_obj.get_profile()
+        if not profile['printer_port']:
+            return None
+        return ReceiptJob(profile)
 
-        if not self._config:
-            self.load_config()
+    def _spool(self, job, kind):
+        print_job_obj = Pool().get('pos_cash.print_job')
 
-        if self._port:
-            self._port.open_device()
-            self._printer = escpos.Printer(self._port)
-
-    def _close_device(self):
-        if self._port:
-            self._port.close_device()
-        if self._printer:
-            del self._printer
-
-    def printing(f):
-        def p(self, *p, **kw):
-            self._open_device()
+        port = job.profile['printer_port']
+        if Transaction().context.get('pos_journal'):
+            # In journal mode nothing is stored, so print at once
             try:
-                res = f(self, *p, **kw)
-            finally:
-                self._close_device()
-            return res
-        return p
-
-    @printing
-    def test_printer(self):
-        configuration_obj = Pool().get('pos_cash.configuration')
-
-        configuration_id = configuration_obj.search([])[0]
-        configuration = configuration_obj.browse(configuration_id)
-        if configuration.printer_port:
-            self.print_logo()
-            self._printer.text('\n\n')
-            self.print_impressum()
-            self._printer.text('\n\n\n')
-            self._printer.cut()
-
-    def print_logo(self):
-        self._printer.set(align='center')
-        self._printer.image(cStringIO.StringIO(self._logo))
-        self._printer.text('\n')
-
-    def print_impressum(self):
-        company = self._config.company
+                write_device(port, job.printer.get_buffer())
+            except Exception:
+                logger.exception('Printing %s on %s failed' % (kind, port))
+            return
+        print_job_obj.enqueue(port, job.printer.get_buffer(), kind,
+            sale=job.sale_id)
+
+    def printing(kind):
+        def decorator(f):
+            def p(self, *args, **kwargs):
+                job = self._open_job()
+                if job is None:
+                    return None
+                res = f(self, job, *args, **kwargs)
+                self._spool(job, kind)
+                return res
+            return p
+        return decorator
+
+    @printing('test')
+    def test_printer(self, job):
+        self.print_logo(job)
+        job.printer.text('\n\n')
+        self.print_impressum(job)
+        job.printer.text('\n\n\n')
+        job.printer.cut()
+
+    def _get_logo_raster(self, job):
+        '''
+        Return the raster commands of the logo, computed only once per logo
+        and kept in memory and in the data path.
+        '''
+        key = '%s-%s' % (hashlib.sha1(job.logo).hexdigest(), _LOGO_DITHER)
+        logo_raster = _LOGO_RASTERS.get(key)
+        if logo_raster is not None:
+            return logo_raster
+
+        path = os.path.join(CONFIG['data_path'], 'pos_cash',
+            'logo-%s.raster' % key)
+        try:
+            with open(path, 'rb') as raster_file:
+                logo_raster = raster_file.read()
+        except IOError:
+            logo_raster = job.printer.raster(cStringIO.StringIO(job.logo),
+                _LOGO_DITHER)
+            try:
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                # Write to a temporary file first, so that a concurrent
+                # reader never sees a partial raster
+                tmp_path = '%s.%s' % (path, os.getpid())
+                with open(tmp_path, 'wb') as raster_file:
+                    raster_file.write(logo_raster)
+                os.rename(tmp_path, path)
+            except (IOError, OSError), exception:
+                logger.warning('Unable to store logo raster %s: %s'
+                    % (path, exception))
+        _LOGO_RASTERS[key] = logo_raster
+        return logo_raster
+
+    def print_logo(self, job):
+        if not job.logo:
+            return
+        job.printer.set(align='center')
+        job.printer.raw(self._get_logo_raster(job))
+        job.printer.text('\n')
+
+    def print_impressum(self, job):
+        company_obj = Pool().get('company.company')
+
+        company = company_obj.browse(job.profile['company'])
         address = company.addresses[0]
 
         impressum = '\n'.join([company.name,
             address.street,
             address.zip + ' ' + address.city])
-        self._printer.set(align='center')
-        self._printer.text(impressum + '\n')
-
-    @printing
-    def kick_cash_drawer(self):
-        self._printer.cashdraw(2)
-
-    @printing
-    def print_sale(self, sale):
-        lang_obj = Pool().get('ir.lang')
-        lang, = lang_obj.search([('code', '=', Transaction().language)])
-        lang = lang_obj.browse(lang)
+        job.printer.set(align='center')
+        job.printer.text(impressum + '\n')
+
+    @printing('drawer')
+    def kick_cash_drawer(self, job):
+        job.printer.cashdraw(2)
+
+    def get_sale_taxes(self, sale):
+        '''
+        Return the taxes of sale as a list of dictionaries with the code of
+        the tax on the lines, the tax, its base and its amount. The base of
+        each tax is the net amount of the lines it applies to, so the bases
+        of the taxes of a line with several taxes are not to be summed.
+        '''
+        res = []
+        taxes = {}
+        for tax in sale.taxes:
+            taxes[tax.id] = {
+                'code': str(len(res) + 1),
+                'tax': tax,
+                'without_tax': Decimal(0),
+                }
+            res.append(taxes[tax.id])
+        for line in sale.lines:
+            if line.line_type == 'sum':
+                continue
+            for tax in line.taxes:
+                taxes[tax.id]['without_tax'] += line.without_tax or Decimal(0)
+        for values in res:
+            values['tax_amount'] = (values['without_tax']
+                * (values['tax'].percentage or Decimal(0)) / 100)
+        return res
+
+    @timed('receipt.print_sale')
+    @printing('receipt')
+    def print_sale(self, job, sale, kick_drawer=False):
+        '''
+        Print the receipt of sale, after opening the cash drawer in the same
+        job if kick_drawer.
+        '''
+        lang = self._get_lang()
 
         def print_split(left, right):
             len_left = _ROW_CHARACTERS - len(right) - 1
@@ -106,45 +312,38 @@ class Receipt(Report):
             printer.text(left)
             printer.text(right + '\n')
 
-        printer = self._printer
+        printer = job.printer
+        job.sale_id = sale.id
 
-        self.print_logo()
-        self.print_impressum()
+        if kick_drawer:
+            printer.cashdraw(2)
+        self.print_logo(job)
+        self.print_impressum(job)
         printer.set(align='left')
-        taxes = {}
-        i = 0
-        for tax in sale.taxes:
-            i += 1
-            taxes[tax.id] = {}
-            taxes[tax.id]['code'] = str(i)
-            taxes[tax.id]['rec'] = tax
-            taxes[tax.id]['amount'] = Decimal(0)
+        taxes = self.get_sale_taxes(sale)
+        tax_codes = dict((x['tax'].id, x['code']) for x in taxes)
 
         printer.text('\n')
         for line in sale.lines:
             if line.line_type == 'sum':
-                print_split('Total:', self.format_lang(line.total, lang) + '  ')
+                print_split('Total:', lang.format(line.total) + '  ')
                 printer.text('\n')
             else:
-                tax_codes = []
-                for tax in line.taxes:
-                    tax_codes.append(taxes[tax.id]['code'])
-                    taxes[tax.id]['amount'] += line.unit_price * line.quantity
-                tax_codes = ' '.join(tax_codes)
+                line_codes = ' '.join(tax_codes[x.id] for x in line.taxes)
 
                 printer.text(line.name[:_ROW_CHARACTERS] + '\n')
                 pos_text = '  %s x %s' % (
-                            self.format_lang(line.quantity, lang, digits=1),
-                            self.format_lang(line.unit_price, lang)
+                            lang.format(line.quantity, digits=1),
+                            lang.format(line.unit_price)
                         )
-                total = self.format_lang(line.total, lang)
-                print_split(pos_text, total + ' ' + tax_codes)
+                total = lang.format(line.total)
+                print_split(pos_text, total + ' ' + line_codes)
 
 
         print_split('Cash:',
-                self.format_lang(sale.total_paid, lang) + '  ')
+                lang.format(sale.total_paid) + '  ')
         print_split('Drawback:',
-                self.format_lang(sale.drawback, lang) + '  ')
+                lang.format(sale.drawback) + '  ')
         printer.text('\n'*2)
         cols = 4
         col_width = int(_ROW_CHARACTERS / 4)
@@ -155,114 +354,277 @@ class Receipt(Report):
         f('With', col_width)
         printer.text('\n')
         for tax in taxes:
-            t = taxes[tax]['rec']
-            f(taxes[tax]['code'] + '=' + self.format_lang(t.percentage, lang) + '%',
+            f(tax['code'] + '=' + lang.format(tax['tax'].percentage) + '%',
                     col_width)
-            with_tax = taxes[tax]['amount']
-            without_tax = with_tax / ((t.percentage/100) +1)
-            tax = with_tax-without_tax
-            f(self.format_lang(without_tax, lang), col_width)
-            f(self.format_lang(tax, lang), col_width)
-            f(self.format_lang(with_tax, lang), col_width)
+            f(lang.format(tax['without_tax']), col_width)
+            f(lang.format(tax['tax_amount']), col_width)
+            f(lang.format(tax['without_tax'] + tax['tax_amount']), col_width)
             printer.text('\n')
+        # The net total is the one of the sale, as the bases of a line with
+        # several taxes overlap
+        f('Total', col_width)
+        f(lang.format(sale.total_without_tax), col_width)
+        f(lang.format(sale.total_tax), col_width)
+        f(lang.format(sale.total_amount), col_width)
+        printer.text('\n')
 
         printer.text('\n'*2)
         printer.set(align='center')
         printer.barcode(sale.receipt_code, 'CODE128B', 3, 50,'','')
         printer.text('\n'*2)
-        printer.text(self.format_lang(datetime.datetime.now(), lang, date=True))
+        printer.text(lang.format(datetime.datetime.now(), date=True))
+        printer.cut()
+
+    @timed('receipt.print_closing')
+    @printing('closing')
+    def print_closing(self, job, closing):
+        lang = self._get_lang()
+
+        def print_split(left, right):
+            len_left = _ROW_CHARACTERS - len(right) - 1
+            left = left[:len_left]
+            left += (len_left-len(left)+1) * ' '
+            printer.text(left)
+            printer.text(right + '\n')
+
+        printer = job.printer
+        f = lambda x: lang.format(x)
+
+        self.print_impressum(job)
+        printer.set(align='center', type='B', height=2)
+        if closing.kind == 'z':
+            printer.text('Z-Report %s\n' % closing.number)
+        else:
+            printer.text('X-Report\n')
+        printer.set(align='left')
+        printer.text('\n')
+        if closing.lane:
+            print_split('Lane:', closing.lane)
+        if closing.start_date:
+            print_split('From:', lang.format(closing.start_date,
+                    date=True))
+        print_split('To:', lang.format(closing.end_date,
+                date=True))
+        printer.text('\n')
+        print_split('Receipts:', str(closing.receipts))
+        print_split('Turnover:', f(closing.turnover))
+        print_split('Without tax:', f(closing.total_without_tax))
+        print_split('Tax:', f(closing.total_tax))
+        printer.text('\n')
+        print_split('Cash:', f(closing.total_paid))
+        print_split('Drawback:', f(closing.drawback))
+        print_split('Cash in drawer:', f(closing.total_paid
+                - closing.drawback))
+        printer.text('\n')
+        print_split('Cancellations:', str(closing.cancellations))
+        print_split('Cancelled amount:', f(closing.cancellation_amount))
+        printer.text('\n')
+
+        col_width = int(_ROW_CHARACTERS / 4)
+        c = lambda x, l: printer.text(x[:l] + (l-len(x)) * ' ')
+        c('Rate', col_width)
+        c('Without', col_width)
+        c('Tax', col_width)
+        c('With', col_width)
+        printer.text('\n')
+        for tax in closing.taxes:
+            c(f(tax.percentage or Decimal(0)) + '%', col_width)
+            c(f(tax.without_tax), col_width)
+            c(f(tax.tax_amount), col_width)
+            c(f(tax.amount), col_width)
+            printer.text('\n')
+
+        printer.text('\n'*2)
+        printer.text(lang.format(datetime.datetime.now(), date=True))
         printer.cut()
 
 Receipt()
 
 
+class DisplayWorker(threading.Thread):
+    '''
+    Owns the serial port of a customer display and draws the rows posted to
+    it, so the RPC threads never wait on the serial line.
+    '''
+
+    def __init__(self, port, baud, digits):
+        super(DisplayWorker, self).__init__(name='pos_cash display %s' % port)
+        self.daemon = True
+        self.port = port
+        self.baud = baud
+        self.digits = digits
+        self._queue = Queue.Queue(_DISPLAY_QUEUE_SIZE)
+        self._serial = None
+        self._display = None
+
+    def post(self, rows):
+        '''
+        Queue a redraw of the display with rows, a list of (left, right)
+        texts. The oldest pending redraw is dropped if the queue is full.
+        '''
+        while True:
+            try:
+                self._queue.put_nowait(rows)
+                return
+            except Queue.Full:
+                try:
+                    self._queue.get_nowait()
+                except Queue.Empty:
+                    pass
+
+    def stop(self):
+        '''
+        Stop the worker once the pending redraws are superseded, and close
+        the port
+        '''
+        self.post(None)
+
+    def run(self):
+        while True:
+            rows = self._queue.get()
+            # A newer redraw supersedes the pending ones
+            while True:
+                try:
+                    rows = self._queue.get_nowait()
+                except Queue.Empty:
+                    break
+            if rows is None:
+                self._disconnect()
+                return
+            try:
+                self._draw(rows)
+            except Exception:
+                # The worker outlives a bad redraw, which is not retried
+                logger.exception('Display %s failed' % self.port)
+                if self._display:
+                    self._display.invalidate()
+
+    def _connect(self):
+        self._serial = serial.Serial(self.port, self.baud)
+        self._display = escpos.Display(self._serial, digits=self.digits)
+        self._display.set_cursor(False)
+        self._display.clear()
+
+    def _disconnect(self):
+        if self._serial:
+            try:
+                self._serial.close()
+            except (serial.SerialException, IOError, OSError):
+                pass
+        self._serial = None
+        self._display = None
+
+    def _draw(self, rows):
+        delay = _DISPLAY_RECONNECT_DELAY
+        while True:
+            start = time.time()
+            try:
+                if not self._display:
+                    self._connect()
+                written = self._display.bytes_written
+                self._display.show([
+                        self._display.format_row(left or '', right or '')
+                        for left, right in rows])
+                record('display.write', time.time() - start, self.port,
+                    self._display.bytes_written - written)
+                return
+            except (serial.SerialException, IOError, OSError), exception:
+                logger.warning('Display %s failed: %s' % (self.port,
+                        exception))
+                self._disconnect()
+            # Do not retry a redraw which is already superseded
+            if not self._queue.empty():
+                return
+            time.sleep(delay)
+            delay = min(delay * 2, _DISPLAY_RECONNECT_MAX_DELAY)
+
+_DISPLAY_WORKERS = {}
+_DISPLAY_WORKERS_LOCK = threading.Lock()
+
+
+def get_display_worker(port, baud, digits):
+    '''
+    Return the running worker of the display on port, which replaces the
+    one started with other settings
+    '''
+    with _DISPLAY_WORKERS_LOCK:
+        worker = _DISPLAY_WORKERS.get(port)
+        if worker and (worker.baud, worker.digits) != (baud, digits):
+            # Only one worker owns the port
+            worker.stop()
+            worker = None
+        if not worker or not worker.is_alive():
+            worker = DisplayWorker(port, baud, digits)
+            worker.start()
+            _DISPLAY_WORKERS[port] = worker
+    return worker
+
+
 class Display(Report):
     _name = 'pos_cash.display'
 
-    def __init__(self):
-        super(Display, self).__init__()
-        self._display = False
-
     def _get_lang(self):
         lang_obj = Pool().get('ir.lang')
-        lang, = lang_obj.search([('code', '=', Transaction().language)])
-        return lang_obj.browse(lang)
+        return lang_obj.get_formatter(Transaction().language)
 
     def load_display(self):
+        '''
+        Return the worker of the configured display or None
+        '''
         configuration_obj = Pool().get('pos_cash.configuration')
 
-        configuration_id = configuration_obj.search([])[0]
-        configuration = configuration_obj.browse(configuration_id)
+        configuration = configuration_obj.get_profile()
 
-        lang = self._get_lang()
-        if configuration.display_port:
-            self._display = escpos.Display(serial.Serial(
-                configuration.display_port, configuration.display_baud),
-                digits=int(configuration.display_digits))
-            self._display.set_cursor(False)
-
-    def displaying(f):
-        def p(self, *p, **kw):
-            if not self._display:
-                self.load_display()
-            return f(self, *p, **kw)
-        return p
-
-    @displaying
-    def show_sale_line(self, sale_line):
-        configuration_obj = Pool().get('pos_cash.configuration')
+        if not configuration['display_port']:
+            return None
+        return get_display_worker(configuration['display_port'],
+            int(configuration['display_baud'] or _DISPLAY_BAUD),
+            int(configuration['display_digits'] or _DISPLAY_DIGITS))
 
-        configuration_id = configuration_obj.search([])[0]
-        configuration = configuration_obj.browse(configuration_id)
-
-        if configuration.display_port:
-            lang = self._get_lang()
-            self._display.clear()
-            self._display.set_align('left')
-            self._display.text(sale_line.product.name)
-            self._display.new_line()
-            self._display.text('%s x %s' % (
-                            self.format_lang(sale_line.quantity, lang, digits=0),
-                            self.format_lang(sale_line.unit_price, lang),
-                        )
-                    )
-            self._display.set_align('right')
-            self._display.text(self.format_lang(sale_line.total, lang))
+    def show_rows(self, rows):
+        worker = self.load_display()
+        if worker:
+            worker.post(rows)
 
-    @displaying
-    def show_total(self, sale):
-        configuration_obj = Pool().get('pos_cash.configuration')
-
-        configuration_id = configuration_obj.search([])[0]
-        configuration = configuration_obj.browse(configuration_id)
+    def show_message(self, *texts):
+        self.show_rows([(text, '') for text in texts])
 
-        if configuration.display_port:
-            lang = self._get_lang()
-            self._display.clear()
-            self._display.text('Total:')
-            self._display.set_align('right')
-            self._display.text(self.format_lang(sale.total_amount, lang))
+    @timed('display.show_sale_line')
+    def show_sale_line(self, sale_line):
+        # The rows are only formatted for a configured display
+        worker = self.load_display()
+        if not worker:
+            return
+        lang = self._get_lang()
+        worker.post([
+                (sale_line.name, ''),
+                ('%s x %s' % (
+                        lang.format(sale_line.quantity, digits=0),
+                        lang.format(sale_line.unit_price),
+                        ),
+                    lang.format(sale_line.total)),
+                ])
+
+    @timed('display.show_total')
+    def show_total(self, sale):
+        worker = self.load_display()
+        if not worker:
+            return
+        lang = self._get_lang()
+        worker.post([
+                ('Total:', lang.format(sale.total_amount)),
+                ])
 
-    @displaying
+    @timed('display.show_paid')
     def show_paid(self, sale):
-        configuration_obj = Pool().get('pos_cash.configuration')
-
-        configuration_id = configuration_obj.search([])[0]
-        configuration = configuration_obj.browse(configuration_id)
-
-        if configuration.display_port:
-            lang = self._get_lang()
-            self._display.clear()
-            self._display.text('Paid:')
-            self._display.set_align('right')
-            f = lambda x: self.format_lang(x, lang)
-            self._display.text(f(sale.total_paid))
-            self._display.new_line()
-            self._display.set_align('left')
-            self._display.text('Drawback:')
-            self._display.set_align('right')
-            self._display.text(f(sale.drawback))
-
+        worker = self.load_display()
+        if not worker:
+            return
+        lang = self._get_lang()
+        f = lambda x: lang.format(x)
+        worker.post([
+                ('Paid:', f(sale.total_paid)),
+                ('Drawback:', f(sale.drawback)),
+                ])
 
 Display()
-
@@ -0,0 +1,276 @@
+#This file is part of Tryton.  The COPYRIGHT file at the top level of
+#this repository contains the full copyright notices and license terms.
+from escpos import escpos
+import datetime
+import logging
+import threading
+import time
+
+from trytond.model import ModelSQL, ModelView, fields
+from trytond.transaction import Transaction
+from trytond.pool import Pool
+from probe import record
+
+_SPOOL_POLL_INTERVAL = 30
+_SPOOL_COMMIT_GRACE = 5
+_SPOOL_COMMIT_POLL = 0.1
+_SPOOL_RETRY_DELAY = 5
+_SPOOL_MAX_ATTEMPTS = 10
+
+logger = logging.getLogger('pos_cash')
+
+
+class PrinterConnection(object):
+    '''
+    The handle of a printer, kept open between jobs and shared by the
+    threads through its lock. It is reopened when it is no longer healthy
+    or after a failed write.
+    The USB printers are found with usb_backend, the pyusb default if None.
+    '''
+
+    def __init__(self, port, usb_backend=None):
+        self.port = port
+        self.usb_backend = usb_backend
+        self.lock = threading.Lock()
+        self._device = None
+
+    def _open(self):
+        if self.port.startswith('usb:'):
+            vendor, product = self.port[4:].split(':')
+            device = escpos.UsbDevice(int(vendor, 16), int(product, 16),
+                backend=self.usb_backend)
+        else:
+            device = escpos.FileDevice(self.port)
+        device.open_device()
+        self._device = device
+
+    def _close(self):
+        device, self._device = self._device, None
+        if device is not None:
+            try:
+                device.close_device()
+            except (IOError, OSError):
+                pass
+
+    def write(self, payload):
+        with self.lock:
+            if not (self._device and self._device.is_healthy()):
+                self._close()
+                self._open()
+            try:
+                self._device.write(payload)
+            except Exception:
+                # Start over with a new handle for the next job
+                self._close()
+                raise
+
+    def close(self):
+        with self.lock:
+            self._close()
+
+_PRINTER_CONNECTIONS = {}
+_PRINTER_CONNECTIONS_LOCK = threading.Lock()
+
+
+def get_printer_connection(port):
+    '''
+    Return the connection to the printer on port
+    '''
+    with _PRINTER_CONNECTIONS_LOCK:
+        connection = _PRINTER_CONNECTIONS.get(port)
+        if not connection:
+            connection = _PRINTER_CONNECTIONS[port] = PrinterConnection(port)
+    return connection
+
+
+def write_device(port, payload):
+    '''
+    Write payload to the printer on port, either a file like /dev/lp0 or
+    usb:<vendor id>:<product id> in hexadecimal.
+    '''
+    start = time.time()
+    get_printer_connection(port).write(payload)
+    record('printer.write', time.time() - start, port, len(payload))
+
+
+class SpoolWorker(threading.Thread):
+    '''
+    Prints the pending jobs of one printer port in their own transactions.
+    '''
+
+    def __init__(self, database_name, port):
+        super(SpoolWorker, self).__init__(
+            name='pos_cash spool %s %s' % (database_name, port))
+        self.daemon = True
+        self.database_name = database_name
+        self.port = port
+        self._wakeup = threading.Event()
+
+    def wakeup(self):
+        self._wakeup.set()
+
+    def run(self):
+        while True:
+            woken = self._wakeup.wait(_SPOOL_POLL_INTERVAL)
+            self._wakeup.clear()
+            # The job which woke the worker is only visible once the
+            # transaction that created it is committed
+            deadline = time.time()
+            if woken:
+                deadline += _SPOOL_COMMIT_GRACE
+            while True:
+                try:
+                    printed = self._drain()
+                except Exception:
+                    logger.exception('Spool %s failed' % self.port)
+                    printed = None
+                if printed is None:
+                    time.sleep(_SPOOL_RETRY_DELAY)
+                    break
+                if printed or time.time() >= deadline:
+                    break
+                time.sleep(_SPOOL_COMMIT_POLL)
+
+    def _drain(self):
+        '''
+        Print the pending jobs in order. Return the number of jobs printed or
+        None if a job failed.
+        '''
+        printed = 0
+        while True:
+            Transaction().start(self.database_name, 0)
+            try:
+                job_obj = Pool().get('pos_cash.print_job')
+                job_ids = job_obj.search([
+                        ('port', '=', self.port),
+                        ('state', '=', 'pending'),
+                        ], order=[('id', 'ASC')], limit=1)
+                if not job_ids:
+                    return printed
+                success = job_obj.print_job(job_ids[0])
+                Transaction().cursor.commit()
+            finally:
+                Transaction().stop()
+            if not success:
+                return None
+            printed += 1
+
+_SPOOL_WORKERS = {}
+_SPOOL_WORKERS_LOCK = threading.Lock()
+
+
+def get_spool_worker(database_name, port):
+    '''
+    Return the running spool worker of the printer on port
+    '''
+    key = (database_name, port)
+    with _SPOOL_WORKERS_LOCK:
+        worker = _SPOOL_WORKERS.get(key)
+        if not worker:
+            worker = SpoolWorker(database_name, port)
+            worker.start()
+            _SPOOL_WORKERS[key] = worker
+    return worker
+
+
+class PrintJob(ModelSQL, ModelView):
+    'Print Job'
+    _name = 'pos_cash.print_job'
+    _description = __doc__
+
+    port = fields.Char('Printer port', required=True, readonly=True)
+    kind = fields.Selection([
+            ('receipt', 'Receipt'),
+            ('drawer', 'Cash Drawer'),
+            ('closing', 'Closing'),
+            ('test', 'Test'),
+            ], 'Kind', required=True, readonly=True)
+    sale = fields.Many2One('pos_cash.sale', 'POS Sale', readonly=True,
+            ondelete='SET NULL')
+    payload = fields.Binary('Payload', readonly=True)
+    state = fields.Selection([
+            ('pending', 'Pending'),
+            ('done', 'Done'),
+            ('failed', 'Failed'),
+            ], 'State', required=True, readonly=True)
+    attempts = fields.Integer('Attempts', readonly=True)
+    error = fields.Text('Error', readonly=True)
+    print_date = fields.DateTime('Print date', readonly=True)
+
+    def __init__(self):
+        super(PrintJob, self).__init__()
+        self._rpc.update({
+            'reprint': True,
+        })
+
+    def default_state(self):
+        return 'pending'
+
+    def default_attempts(self):
+        return 0
+
+    def enqueue(self, port, payload, kind, sale=None):
+        '''
+        Create a pending job and wake up the worker of its port.
+        '''
+        job_id = self.create({
+                'port': port,
+                # Binary values are stored from buffers
+                'payload': buffer(payload),
+                'kind': kind,
+                'sale': sale,
+                })
+        get_spool_worker(Transaction().cursor.database_name, port).wakeup()
+        return job_id
+
+    def print_job(self, job_id):
+        '''
+        Send the job to its printer and record the outcome.
+        Return True if it was printed.
+        '''
+        job = self.browse(job_id)
+        try:
+            write_device(job.port, str(job.payload))
+        except Exception, exception:
+            attempts = job.attempts + 1
+            logger.warning('Print job %s on %s failed: %s'
+                % (job.id, job.port, exception))
+            self.write(job.id, {
+                    'attempts': attempts,
+                    'error': str(exception),
+                    'state': (attempts >= _SPOOL_MAX_ATTEMPTS
+                        and 'failed' or 'pending'),
+                    })
+            return False
+        self.write(job.id, {
+                'attempts': job.attempts + 1,
+                'error': None,
+                'state': 'done',
+                'print_date': datetime.datetime.now(),
+                })
+        return True
+
+    def reprint(self, ids):
+        '''
+        Queue the jobs again as new jobs.
+        '''
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        new_ids = []
+        for job in self.browse(ids):
+            new_ids.append(self.enqueue(job.port, str(job.payload), job.kind,
+                    sale=job.sale and job.sale.id or None))
+        return new_ids
+
+    def process_pending(self):
+        '''
+        Wake up the workers of all ports with pending jobs, e.g. after a
+        server restart. Called by the cron.
+        '''
+        job_ids = self.search([('state', '=', 'pending')])
+        database_name = Transaction().cursor.database_name
+        for port in set(x.port for x in self.browse(job_ids)):
+            get_spool_worker(database_name, port).wakeup()
+        return True
+
+PrintJob()
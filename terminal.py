@@ -0,0 +1,119 @@
+#This file is part of Tryton.  The COPYRIGHT file at the top level of
+#this repository contains the full copyright notices and license terms.
+from trytond.model import ModelSQL, ModelView, fields
+from trytond.transaction import Transaction
+from trytond.pool import Pool
+from trytond.cache import Cache
+
+# The fields of a terminal which are cached, the receipt counter is not
+_TERMINAL_FIELDS = ['name', 'code', 'receipt_prefix', 'receipt_padding',
+    'printer_port', 'display_port', 'display_baud', 'display_digits', 'logo']
+
+
+class PosCashTerminal(ModelSQL, ModelView):
+    'POS Terminal'
+    _name = 'pos_cash.terminal'
+    _description = __doc__
+
+    name = fields.Char('Name', required=True)
+    code = fields.Char('Lane', required=True, select=1,
+            help='The lane of the sessions of the terminal')
+    receipt_prefix = fields.Char('Receipt prefix', required=True,
+            help='Prefix of the receipt numbers of the lane')
+    receipt_next = fields.Integer('Next receipt number', required=True,
+            readonly=True)
+    receipt_padding = fields.Integer('Receipt number padding',
+            required=True)
+    printer_port = fields.Char('Printer port',
+            help='Empty to use the printer of the configuration')
+    display_port = fields.Char('Display port',
+            help='Empty to use the display of the configuration')
+    display_baud = fields.Numeric('BAUD-Rate', digits=(10,0))
+    display_digits = fields.Numeric('Digits per row', digits=(10,0))
+    logo = fields.Binary('Receipt Logo')
+
+    def __init__(self):
+        super(PosCashTerminal, self).__init__()
+        self._rpc.update({
+            'test_printer': True,
+            'test_display': True,
+        })
+        self._sql_constraints += [
+            ('code_uniq', 'UNIQUE(code)', 'The lane must be unique!'),
+            ('receipt_prefix_uniq', 'UNIQUE(receipt_prefix)',
+                'The receipt prefix must be unique!'),
+        ]
+
+    def default_receipt_next(self):
+        return 1
+
+    def default_receipt_padding(self):
+        return 6
+
+    @Cache('pos_cash_terminal.get_terminal')
+    def get_terminal(self, code):
+        '''
+        Return the values of the terminal of the lane code as a dictionary or
+        None if there is none.
+        '''
+        if not code:
+            return None
+        terminal_ids = self.search([('code', '=', code)], limit=1)
+        if not terminal_ids:
+            return None
+        return self.read(terminal_ids[0], _TERMINAL_FIELDS)
+
+    def next_receipt_number(self, terminal_id):
+        '''
+        Return the next receipt number of the terminal.
+        The counter row stays locked until the end of the transaction, so
+        the numbers of a lane are gap-free while the other lanes do not wait.
+        '''
+        cursor = Transaction().cursor
+        cursor.execute('UPDATE "' + self._table + '" '
+            'SET receipt_next = receipt_next + 1 '
+            'WHERE id = %s', (terminal_id,))
+        cursor.execute('SELECT receipt_next - 1 FROM "' + self._table + '" '
+            'WHERE id = %s', (terminal_id,))
+        return cursor.fetchone()[0]
+
+    def get_receipt_code(self, terminal, company_id):
+        '''
+        Return a new receipt code for terminal, the values returned by
+        get_terminal.
+        '''
+        number = self.next_receipt_number(terminal['id'])
+        return '%04d%s%0*d' % (company_id, terminal['receipt_prefix'],
+            terminal['receipt_padding'], number)
+
+    def test_printer(self, ids):
+        receipt = Pool().get('pos_cash.receipt', 'report')
+        for terminal in self.browse(ids):
+            with Transaction().set_context(pos_lane=terminal.code):
+                receipt.test_printer()
+
+    def test_display(self, ids):
+        display = Pool().get('pos_cash.display', 'report')
+        for terminal in self.browse(ids):
+            with Transaction().set_context(pos_lane=terminal.code):
+                display.show_message('Display works!!!', terminal.name)
+
+    def create(self, vals):
+        res = super(PosCashTerminal, self).create(vals)
+        # Restart the cache for get_terminal
+        self.get_terminal.reset()
+        return res
+
+    def write(self, ids, vals):
+        res = super(PosCashTerminal, self).write(ids, vals)
+        # Restart the cache for get_terminal
+        self.get_terminal.reset()
+        return res
+
+    def delete(self, ids):
+        res = super(PosCashTerminal, self).delete(ids)
+        # Restart the cache for get_terminal
+        self.get_terminal.reset()
+        return res
+
+PosCashTerminal()
@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+#This file is part of Tryton.  The COPYRIGHT file at the top level of
+#this repository contains the full copyright notices and license terms.
+
+import sys
+import os
+DIR = os.path.abspath(os.path.normpath(os.path.join(__file__,
+    '..', '..', '..', '..', '..', 'trytond')))
+if os.path.isdir(DIR):
+    sys.path.insert(0, os.path.dirname(DIR))
+
+import unittest
+import struct
+from cStringIO import StringIO
+from PIL import Image
+import trytond.tests.test_tryton
+from trytond.modules.pos_cash.escpos import escpos, raster
+from trytond.modules.pos_cash.escpos.constants import S_RASTER_N
+from trytond.modules.pos_cash.escpos.exceptions import UsbNotFoundError, \
+    UsbBusyError, PaperEndError, CoverOpenError, ImageDitherError
+from trytond.modules.pos_cash.spool import PrinterConnection
+from trytond.modules.pos_cash.tests.usb_backend import FakePrinterBackend
+
+
+class UsbDeviceTestCase(unittest.TestCase):
+    '''
+    Test the USB printer transport against a fake backend.
+    '''
+
+    def setUp(self):
+        self.backend = FakePrinterBackend(packet_size=16)
+        self.device = escpos.UsbDevice(0x04b8, 0x0202,
+            backend=self.backend)
+
+    def tearDown(self):
+        self.device.close_device()
+
+    def test0010open(self):
+        '''
+        Test the printer is found and its interface claimed.
+        '''
+        self.device.open_device()
+        self.assert_(self.device.is_open())
+        self.assert_(self.backend.claimed)
+        self.assertEqual(self.device.packet_size, 16)
+
+    def test0020not_found(self):
+        '''
+        Test a missing printer.
+        '''
+        device = escpos.UsbDevice(0x04b8, 0x0e15, backend=self.backend)
+        self.assertRaises(UsbNotFoundError, device.open_device)
+
+    def test0030write(self):
+        '''
+        Test the data is written in chunks of the packet size.
+        '''
+        self.device.open_device()
+        data = ''.join(chr(x) for x in range(40))
+        self.device.write(data)
+        self.assertEqual([len(x) for x in self.backend.writes], [16, 16, 8])
+        self.assertEqual(self.backend.get_data(), data)
+        self.assertEqual(self.backend.queries, [])
+
+    def test0040healthy(self):
+        '''
+        Test the health check does not query the printer.
+        '''
+        self.assertFalse(self.device.is_healthy())
+        self.device.open_device()
+        self.backend.answer = False
+        self.assert_(self.device.is_healthy())
+        self.assertEqual(self.backend.queries, [])
+
+    def test0050status(self):
+        '''
+        Test the status of the printer.
+        '''
+        self.device.open_device()
+        status = self.device.status()
+        self.assert_(status['online'])
+        self.assertFalse(status['paper_end'])
+        self.assertFalse(status['cover_open'])
+
+        self.backend.status[4] = 0x12 | 0x0c
+        self.assert_(self.device.status()['paper_near_end'])
+
+    def test0060paper_end(self):
+        '''
+        Test a write refused by the printer raises the error of its status.
+        '''
+        self.device.open_device()
+        self.backend.accept = 0
+        self.backend.status[2] = 0x12 | 0x20
+        self.assertRaises(PaperEndError, self.device.write, 'receipt')
+
+        self.backend.status[2] = 0x12 | 0x04
+        self.assertRaises(CoverOpenError, self.device.write, 'receipt')
+
+    def test0070short_write(self):
+        '''
+        Test a short write of a printer without error.
+        '''
+        self.device.open_device()
+        self.backend.accept = 10
+        self.assertRaises(UsbBusyError, self.device.write, 'x' * 16)
+
+    def test0080close(self):
+        '''
+        Test closing releases the interface without resetting the printer.
+        '''
+        self.device.open_device()
+        self.device.close_device()
+        self.assertFalse(self.device.is_open())
+        self.assertFalse(self.backend.claimed)
+        self.assertFalse(self.backend.reset)
+
+    def test0090connection(self):
+        '''
+        Test the printer connection keeps the device open between writes and
+        opens it again after a failed write.
+        '''
+        connection = PrinterConnection('usb:04b8:0202',
+            usb_backend=self.backend)
+        connection.write('first')
+        connection.write('second')
+        self.assertEqual(self.backend.opened, 1)
+        self.assertEqual(self.backend.get_data(), 'firstsecond')
+
+        self.backend.accept = 0
+        self.assertRaises(UsbBusyError, connection.write, 'third')
+        self.backend.accept = None
+        connection.write('fourth')
+        self.assertEqual(self.backend.opened, 2)
+        self.assertEqual(self.backend.get_data(), 'firstsecondfourth')
+        connection.close()
+
+
+class FakePort(object):
+    '''
+    Port keeping the data written
+    '''
+
+    def __init__(self):
+        self.data = []
+
+    def write(self, data):
+        self.data.append(data)
+
+    def close(self):
+        pass
+
+    def pop(self):
+        data = ''.join(self.data)
+        self.data = []
+        return data
+
+
+def move(column, row):
+    return '\x1f$' + chr(column) + chr(row)
+
+
+class DisplayTestCase(unittest.TestCase):
+    '''
+    Test the bytes sent to the customer display.
+    '''
+
+    def setUp(self):
+        self.port = FakePort()
+        self.display = escpos.Display(self.port, digits=20)
+
+    def test0010show(self):
+        '''
+        Test the first show clears the display.
+        '''
+        self.display.show(['Apple', 'Total'])
+        self.assertEqual(self.port.pop(),
+            '\x0c' + move(1, 1) + 'Apple' + move(1, 2) + 'Total')
+
+    def test0020show_changes(self):
+        '''
+        Test only the changed cells are sent.
+        '''
+        self.display.show(['Apple', 'Total'])
+        self.port.pop()
+        self.display.show(['Apple', 'Total'])
+        self.assertEqual(self.port.pop(), '')
+
+        self.display.show(['Apply', 'Total'])
+        self.assertEqual(self.port.pop(), move(5, 1) + 'y')
+
+        # The short gap of unchanged cells is rewritten
+        self.display.show(['Xpplz', 'Total'])
+        self.assertEqual(self.port.pop(), move(1, 1) + 'Xpplz')
+
+    def test0030show_last_cell(self):
+        '''
+        Test the cursor is moved up after a change of the last cell of a
+        row, as the display adds a newline.
+        '''
+        display = self.display
+        display.show(['Apple', display.format_row('Total', '1.05')])
+        self.port.pop()
+        display.show(['Apple', display.format_row('Total', '1.06')])
+        self.assertEqual(self.port.pop(), move(20, 2) + '6' + '\x1f\x0a')
+
+        display.show([display.format_row('Pear', '1.00'),
+                display.format_row('Total', '1.06')])
+        self.assertEqual(self.port.pop(), move(1, 1) + 'Pear '
+            + move(17, 1) + '1.00' + '\x1f\x0a')
+
+    def test0040show_charset(self):
+        '''
+        Test the texts are encoded to the charset of the display.
+        '''
+        self.display.show([u'Caf\xe9 \u20ac', 'Caf\xc3\xa9'])
+        self.assertEqual(self.port.pop(),
+            '\x0c' + move(1, 1) + 'Caf\x82 ?' + move(1, 2) + 'Caf\x82')
+
+    def test0050invalidate(self):
+        '''
+        Test the display is redrawn after invalidate.
+        '''
+        self.display.show(['Apple', 'Total'])
+        self.port.pop()
+        self.display.invalidate()
+        self.display.show(['Apple'])
+        self.assertEqual(self.port.pop(), '\x0c' + move(1, 1) + 'Apple')
+
+
+class RasterTestCase(unittest.TestCase):
+    '''
+    Test the conversion of images to raster commands.
+    '''
+
+    def test0010raster(self):
+        '''
+        Test the dots are packed by row, the first at the high bit.
+        '''
+        img = Image.new('L', (10, 3), 255)
+        img.putpixel((0, 0), 0)
+        img.putpixel((9, 2), 0)
+        self.assertEqual(raster.raster(img, raster.DITHER_THRESHOLD),
+            S_RASTER_N + struct.pack('<HH', 2, 3)
+            + '\x80\x00' + '\x00\x00' + '\x00\x40')
+
+    def test0020bands(self):
+        '''
+        Test the images higher than a band are sent in bands.
+        '''
+        img = Image.new('L', (8, 5), 0)
+        self.assertEqual(raster.raster(img, raster.DITHER_THRESHOLD,
+                band_height=2),
+            S_RASTER_N + struct.pack('<HH', 1, 2) + '\xff\xff'
+            + S_RASTER_N + struct.pack('<HH', 1, 2) + '\xff\xff'
+            + S_RASTER_N + struct.pack('<HH', 1, 1) + '\xff')
+
+    def test0030transparency(self):
+        '''
+        Test the transparent pixels are not printed.
+        '''
+        img = Image.new('RGBA', (8, 2), (0, 0, 0, 0))
+        img.putpixel((7, 1), (0, 0, 0, 255))
+        self.assertEqual(raster.bitmap(img).tolist(),
+            [[False] * 8, [False] * 7 + [True]])
+
+    def test0040dithers(self):
+        '''
+        Test the dithers of a middle gray.
+        '''
+        img = Image.new('L', (8, 8), 100)
+        self.assert_(raster.bitmap(img, raster.DITHER_THRESHOLD).all())
+        for dither in (raster.DITHER_ORDERED, raster.DITHER_FLOYD_STEINBERG):
+            dots = raster.bitmap(img, dither).sum()
+            self.assert_(0 < dots < 64, dither)
+        self.assertRaises(ImageDitherError, raster.bitmap, img, 'unknown')
+
+    def test0050printer(self):
+        '''
+        Test the printer reads the image from a file.
+        '''
+        img = Image.new('L', (16, 4), 255)
+        img.putpixel((3, 1), 0)
+        data = StringIO()
+        img.save(data, 'PNG')
+        printer = escpos.Printer(None)
+        self.assertEqual(printer.raster(StringIO(data.getvalue()),
+                raster.DITHER_THRESHOLD),
+            raster.raster(img, raster.DITHER_THRESHOLD))
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(
+        UsbDeviceTestCase))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(
+        DisplayTestCase))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(
+        RasterTestCase))
+    return suite
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,1038 @@
+#!/usr/bin/env python
+#This file is part of Tryton.  The COPYRIGHT file at the top level of
+#this repository contains the full copyright notices and license terms.
+
+import sys
+import os
+DIR = os.path.abspath(os.path.normpath(os.path.join(__file__,
+    '..', '..', '..', '..', '..', 'trytond')))
+if os.path.isdir(DIR):
+    sys.path.insert(0, os.path.dirname(DIR))
+
+import unittest
+import datetime
+import json
+import shutil
+import tempfile
+from decimal import Decimal
+import trytond.tests.test_tryton
+from trytond.tests.test_tryton import POOL, DB_NAME, USER, CONTEXT, \
+    test_view, test_depends
+from trytond.config import CONFIG
+from trytond.exceptions import UserError
+from trytond.transaction import Transaction
+from trytond.modules.pos_cash import journal as pos_journal
+from trytond.modules.pos_cash import product as pos_product
+from trytond.modules.pos_cash.journal import Journal
+from trytond.modules.pos_cash.product import ProductSnapshot
+from trytond.modules.pos_cash import reporting
+from trytond.modules.pos_cash import spool
+from trytond.modules.pos_cash.reporting import LangFormatter
+from trytond.modules.pos_cash.tests import test_escpos
+
+
+class LangFormatterTestCase(unittest.TestCase):
+    '''
+    Test the formatting of numbers and dates of the receipts.
+    '''
+
+    def test0010format(self):
+        '''
+        Test the numbers are formatted with the separators of the language.
+        '''
+        formatter = LangFormatter(',', '.', [3, 3, 0], '%d.%m.%Y')
+        self.assertEqual(formatter.format(Decimal('1234567.891')),
+            '1.234.567,89')
+        self.assertEqual(formatter.format(-1234.5, digits=1), '-1.234,5')
+        self.assertEqual(formatter.format(Decimal('1234567.891'),
+                grouping=False), '1234567,89')
+        self.assertEqual(formatter.format(1234.6, digits=0), '1.235')
+        self.assertEqual(formatter.format(Decimal('999.99')), '999,99')
+
+    def test0020grouping(self):
+        '''
+        Test the grouping stops at -1 and repeats the last size at 0.
+        '''
+        formatter = LangFormatter('.', ',', [3, -1])
+        self.assertEqual(formatter.format(1234567, digits=0), '1234,567')
+        formatter = LangFormatter('.', ',', [3, 2, 0])
+        self.assertEqual(formatter.format(123456789, digits=0),
+            '12,34,56,789')
+        self.assertEqual(LangFormatter().format(1234.5), '1234.50')
+
+    def test0030format_date(self):
+        '''
+        Test the dates and the empty values.
+        '''
+        formatter = LangFormatter(',', '.', [3, 0], '%d.%m.%Y')
+        self.assertEqual(formatter.format(datetime.date(2012, 3, 4)),
+            u'04.03.2012')
+        self.assertEqual(formatter.format(None), '')
+        self.assertEqual(formatter.format(False), '')
+
+
+class JournalTestCase(unittest.TestCase):
+    '''
+    Test the journal file of the sale operations.
+    '''
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'pos_cash',
+            'journal-1.jsonl')
+        self.journal = Journal(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test0010append(self):
+        '''
+        Test the entries are read with the offset of the next one.
+        '''
+        self.journal.append({'op': 'sale', 'key': 'a'})
+        self.journal.append({'op': 'line', 'key': 'b', 'sale': 'a',
+                'quantity': Decimal('1.5')})
+        entries = list(self.journal.read())
+        self.assertEqual([x['op'] for x, _ in entries],
+            ['journal', 'sale', 'line'])
+        self.assertEqual(entries[0][0]['key'], self.journal.get_key())
+        self.assertEqual(entries[2][0]['quantity'], '1.5')
+        self.assertEqual(entries[-1][1], os.path.getsize(self.path))
+        self.assertEqual(list(self.journal.read(entries[1][1])),
+            entries[2:])
+        self.assertEqual(list(self.journal.read(entries[-1][1])), [])
+
+    def test0020incomplete(self):
+        '''
+        Test an interrupted append is left out and kept apart from the next
+        entry.
+        '''
+        self.journal.append({'op': 'sale', 'key': 'a'})
+        with open(self.path, 'ab') as journal_file:
+            journal_file.write('{"op": "li')
+        self.assertEqual([x['key'] for x, _ in self.journal.read()][1:],
+            ['a'])
+
+        journal = Journal(self.path)
+        journal.append({'op': 'sale', 'key': 'c'})
+        self.assertEqual([x['key'] for x, _ in journal.read()][1:],
+            ['a', 'c'])
+
+    def test0030read_since(self):
+        '''
+        Test the entries are read from the offset only in the file of the
+        key.
+        '''
+        self.assertEqual(self.journal.get_key(), None)
+        self.journal.append({'op': 'sale', 'key': 'a'})
+        self.journal.append({'op': 'sale', 'key': 'b'})
+        key = self.journal.get_key()
+        offset = list(self.journal.read())[1][1]
+
+        file_key, entries = self.journal.read_since(key, offset)
+        self.assertEqual(file_key, key)
+        self.assertEqual([x['key'] for x, _ in entries], ['b'])
+        file_key, entries = self.journal.read_since('other', offset)
+        self.assertEqual(file_key, key)
+        self.assertEqual([x['key'] for x, _ in entries], ['a', 'b'])
+
+    def test0040rotate(self):
+        '''
+        Test the rotation drops the entries before the offset.
+        '''
+        for key in ('a', 'b', 'c'):
+            self.journal.append({'op': 'sale', 'key': key})
+        key = self.journal.get_key()
+        entries = list(self.journal.read())
+        self.assertEqual(self.journal.rotate(key, entries[0][1]), None)
+
+        new_key = self.journal.rotate(key, entries[2][1])
+        self.assert_(new_key)
+        self.assertNotEqual(new_key, key)
+        self.assertEqual(self.journal.get_key(), new_key)
+        self.assertEqual([x['key'] for x, _ in self.journal.read()],
+            [new_key, 'c'])
+        # The offset of the former file is no longer used
+        self.assertEqual(self.journal.rotate(key, entries[3][1]), None)
+        file_key, entries = self.journal.read_since(key, entries[2][1])
+        self.assertEqual(file_key, new_key)
+        self.assertEqual([x['key'] for x, _ in entries], ['c'])
+
+        self.journal.append({'op': 'sale', 'key': 'd'})
+        with open(self.path, 'rb') as journal_file:
+            self.assertEqual([json.loads(x)['key']
+                    for x in journal_file][1:], ['c', 'd'])
+
+
+class ProductSnapshotTestCase(unittest.TestCase):
+    '''
+    Test the product snapshot of the lanes.
+    '''
+
+    def setUp(self):
+        self.snapshot = ProductSnapshot(1, ['en_US'])
+        self.snapshot._set({
+                'id': 1,
+                'code': '4000001',
+                'list_price': Decimal('2.99'),
+                'active': True,
+                'customer_taxes_used': [1],
+                })
+        self.snapshot._set({
+                'id': 2,
+                'code': '4000002',
+                'list_price': Decimal('0.5'),
+                'active': False,
+                'customer_taxes_used': [1, 2],
+                })
+        self.snapshot._set_names('en_US', [
+                {'id': 1, 'name': u'Apple'},
+                {'id': 2, 'name': u'Pear'},
+                ])
+
+    def test0010find(self):
+        '''
+        Test the lookup of the products by barcode.
+        '''
+        snapshot = self.snapshot
+        self.assertEqual(snapshot.find('4000001'), 1)
+        self.assertEqual(snapshot.find('4000002'), None)
+        self.assertEqual(snapshot.find('4000003'), None)
+        self.assert_(2 in snapshot)
+        self.assert_(3 not in snapshot)
+        self.assertEqual(snapshot.get_list_price(1), Decimal('2.99'))
+        self.assertEqual(snapshot.get_list_price(2), Decimal('0.5'))
+        self.assertEqual(list(snapshot.get_taxes(1)), [1])
+        self.assertEqual(list(snapshot.get_taxes(2)), [1, 2])
+
+    def test0020update(self):
+        '''
+        Test a product written again.
+        '''
+        snapshot = self.snapshot
+        snapshot._set({
+                'id': 1,
+                'code': '4000003',
+                'list_price': Decimal('3.49'),
+                'active': True,
+                'customer_taxes_used': [2],
+                })
+        self.assertEqual(snapshot.find('4000001'), None)
+        self.assertEqual(snapshot.find('4000003'), 1)
+        self.assertEqual(snapshot.get_list_price(1), Decimal('3.49'))
+        self.assertEqual(list(snapshot.get_taxes(1)), [2])
+        self.assertEqual(list(snapshot.get_taxes(2)), [1, 2])
+
+    def test0030names(self):
+        '''
+        Test the names are kept per language.
+        '''
+        snapshot = self.snapshot
+        self.assertEqual(snapshot.get_name(1, 'en_US'), u'Apple')
+        self.assertEqual(snapshot.get_name(1, 'fr_FR'), None)
+        self.assert_('fr_FR' in snapshot.languages)
+        snapshot._set_names('fr_FR', [{'id': 1, 'name': u'Pomme'}])
+        self.assertEqual(snapshot.get_name(1, 'fr_FR'), u'Pomme')
+        self.assertEqual(snapshot.get_name(1, 'en_US'), u'Apple')
+
+        snapshot._set({
+                'id': 3,
+                'code': None,
+                'list_price': Decimal(1),
+                'active': True,
+                'customer_taxes_used': [],
+                })
+        self.assertEqual(snapshot.get_name(3, 'en_US'), None)
+        self.assertEqual(snapshot.get_name(2, 'en_US'), u'Pear')
+
+
+class DisplayWorkerTestCase(unittest.TestCase):
+    '''
+    Test the workers of the customer displays.
+    '''
+
+    def tearDown(self):
+        for port in ('/dev/test-display', '/dev/test-display2'):
+            worker = reporting._DISPLAY_WORKERS.pop(port, None)
+            if worker:
+                worker.stop()
+                worker.join(1)
+
+    def test0010one_worker_per_port(self):
+        '''
+        Test a port has one worker, replaced when its settings change.
+        '''
+        worker = reporting.get_display_worker('/dev/test-display', 9600, 20)
+        self.assert_(reporting.get_display_worker('/dev/test-display', 9600,
+                20) is worker)
+        other = reporting.get_display_worker('/dev/test-display2', 9600, 20)
+        self.assert_(other is not worker)
+
+        new_worker = reporting.get_display_worker('/dev/test-display',
+            19200, 20)
+        self.assert_(new_worker is not worker)
+        self.assertEqual(new_worker.baud, 19200)
+        worker.join(1)
+        self.assertFalse(worker.is_alive())
+        self.assert_(new_worker.is_alive())
+        self.assert_(reporting.get_display_worker('/dev/test-display', 19200,
+                20) is new_worker)
+
+
+class PosCashTestCase(unittest.TestCase):
+    '''
+    Test the sales in the database.
+    '''
+
+    def setUp(self):
+        trytond.tests.test_tryton.install_module('pos_cash')
+        self.sale = POOL.get('pos_cash.sale')
+        self.line = POOL.get('pos_cash.sale.line')
+        self.product = POOL.get('product.product')
+        # The snapshot outlives the transactions rolled back by the tests
+        pos_product._SNAPSHOTS.clear()
+        # The journals are written in the data path
+        self.data_path = CONFIG['data_path']
+        CONFIG['data_path'] = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(CONFIG['data_path'])
+        CONFIG['data_path'] = self.data_path
+
+    def test0005views(self):
+        '''
+        Test views.
+        '''
+        test_view('pos_cash')
+
+    def test0006depends(self):
+        '''
+        Test depends.
+        '''
+        test_depends()
+
+    def _setup(self):
+        '''
+        Create the company, the configuration without devices, a tax of 7%
+        and one of 19%, and the products: apple with the tax of 7%, wine
+        with both and bag without tax.
+        Return a dictionary of the ids by name.
+        '''
+        pool = POOL
+        currency_obj = pool.get('currency.currency')
+        company_obj = pool.get('company.company')
+        user_obj = pool.get('res.user')
+        sequence_obj = pool.get('ir.sequence.strict')
+        configuration_obj = pool.get('pos_cash.configuration')
+        account_obj = pool.get('account.account')
+        tax_obj = pool.get('account.tax')
+        uom_obj = pool.get('product.uom')
+
+        currency_id = currency_obj.create({
+                'name': 'Euro',
+                'symbol': u'\u20ac',
+                'code': 'EUR',
+                })
+        company_id = company_obj.create({
+                'name': 'POS Shop',
+                'currency': currency_id,
+                })
+        user_obj.write(USER, {
+                'main_company': company_id,
+                'company': company_id,
+                })
+        sequence_id = sequence_obj.create({
+                'name': 'POS Shop',
+                'code': 'pos_cash',
+                })
+        configuration_obj.write(1, {
+                'sequence': sequence_id,
+                'company': company_id,
+                'printer_port': None,
+                'display_port': None,
+                })
+        ids = {'company': company_id}
+        with Transaction().set_context(company=company_id):
+            account_id = account_obj.create({
+                    'name': 'Tax',
+                    'company': company_id,
+                    'kind': 'other',
+                    })
+            for name, percentage in (('vat7', 7), ('vat19', 19)):
+                ids[name] = tax_obj.create({
+                        'name': name,
+                        'description': name,
+                        'type': 'percentage',
+                        'percentage': Decimal(percentage),
+                        'company': company_id,
+                        'invoice_account': account_id,
+                        'credit_note_account': account_id,
+                        })
+
+        unit_id, = uom_obj.search([('name', '=', 'Unit')])
+        for code, name, price, taxes in (
+                ('4000001', 'apple', Decimal('2.14'), ['vat7']),
+                ('4000002', 'wine', Decimal('12.60'), ['vat7', 'vat19']),
+                ('4000003', 'bag', Decimal('0.10'), []),
+                ):
+            ids[name] = self.product.create({
+                    'name': name,
+                    'code': code,
+                    'type': 'goods',
+                    'consumable': True,
+                    'list_price': price,
+                    'cost_price': price,
+                    'default_uom': unit_id,
+                    'customer_taxes': [('set', [ids[x] for x in taxes])],
+                    })
+        return ids
+
+    def _totals(self, sale_id):
+        # SQLite computes the increments of the totals in floating point
+        sale = self.sale.browse(sale_id)
+        return tuple(x.quantize(Decimal('0.01')) for x in (sale.total_amount,
+                sale.total_without_tax, sale.total_tax))
+
+    def test0010totals(self):
+        '''
+        Test the stored totals follow the creation, the writes and the
+        deletion of the lines.
+        '''
+        with Transaction().start(DB_NAME, USER,
+                context=CONTEXT) as transaction:
+            ids = self._setup()
+            sale_id = self.sale.create({})
+            self.assertEqual(self._totals(sale_id),
+                (Decimal(0), Decimal(0), Decimal(0)))
+
+            apple_id = self.line.create({
+                    'sale': sale_id,
+                    'product': ids['apple'],
+                    'unit_price': Decimal('2.14'),
+                    'quantity': Decimal(5),
+                    })
+            self.line.create({
+                    'sale': sale_id,
+                    'product': ids['bag'],
+                    'unit_price': Decimal('0.10'),
+                    'quantity': Decimal(1),
+                    })
+            self.line.create({'sale': sale_id, 'line_type': 'sum'})
+            self.assertEqual(self._totals(sale_id),
+                (Decimal('10.80'), Decimal('10.10'), Decimal('0.70')))
+            apple = self.line.browse(apple_id)
+            self.assertEqual([x.id for x in apple.taxes], [ids['vat7']])
+            self.assertEqual(apple.without_tax, Decimal('10'))
+
+            self.line.write(apple_id, {'quantity': Decimal(2)})
+            self.assertEqual(self._totals(sale_id),
+                (Decimal('4.38'), Decimal('4.10'), Decimal('0.28')))
+
+            self.sale.write(sale_id, {'total_paid': Decimal(5)})
+            self.assertEqual(self.sale.browse(sale_id).drawback,
+                Decimal('0.62'))
+            self.line.delete(apple_id)
+            self.assertEqual(self._totals(sale_id),
+                (Decimal('0.10'), Decimal('0.10'), Decimal('0.00')))
+            self.assertEqual(self.sale.browse(sale_id).drawback,
+                Decimal('4.90'))
+
+            transaction.cursor.rollback()
+
+    def test0020recompute_totals(self):
+        '''
+        Test recompute_totals repairs the totals and the line amounts.
+        '''
+        with Transaction().start(DB_NAME, USER,
+                context=CONTEXT) as transaction:
+            ids = self._setup()
+            sale_id = self.sale.create({})
+            line_id = self.line.create({
+                    'sale': sale_id,
+                    'product': ids['apple'],
+                    'unit_price': Decimal('2.14'),
+                    'quantity': Decimal(5),
+                    })
+            cursor = transaction.cursor
+            cursor.execute('UPDATE "' + self.sale._table + '" '
+                'SET total_amount = 0, total_without_tax = 0, '
+                    'total_tax = 0')
+            cursor.execute('UPDATE "' + self.line._table + '" '
+                'SET without_tax = NULL, tax_amount = NULL')
+            cursor.cache.clear()
+
+            self.sale.recompute_totals([sale_id])
+            self.assertEqual(self._totals(sale_id),
+                (Decimal('10.70'), Decimal('10.00'), Decimal('0.70')))
+            line = self.line.browse(line_id)
+            self.assertEqual(line.without_tax, Decimal('10'))
+            self.assertEqual(line.tax_amount, Decimal('0.70'))
+
+            transaction.cursor.rollback()
+
+
+    def test0030snapshot_generation(self):
+        '''
+        Test the product snapshot is shared by the lanes and the users and
+        rebuilt only when the generation is reset.
+        '''
+        with Transaction().start(DB_NAME, USER,
+                context=CONTEXT) as transaction:
+            ids = self._setup()
+            snapshot = self.product.get_snapshot()
+            generation = snapshot.generation
+            self.assertEqual(snapshot.find('4000002'), ids['wine'])
+            self.assertEqual(set(snapshot.get_taxes(ids['wine'])),
+                set([ids['vat7'], ids['vat19']]))
+            for lane in ('1', '2'):
+                # Make the refresh due
+                snapshot.refresh_time = 0
+                with Transaction().set_context(pos_lane=lane):
+                    self.assertEqual(
+                        self.product.get_snapshot_generation(), generation)
+                    self.assert_(self.product.get_snapshot() is snapshot)
+            with Transaction().set_user(0):
+                self.assertEqual(self.product.get_snapshot_generation(),
+                    generation)
+            self.assertFalse(snapshot.rebuilding)
+
+            self.product._get_snapshot_generation.reset()
+            self.assertNotEqual(self.product.get_snapshot_generation(),
+                generation)
+
+            transaction.cursor.rollback()
+
+
+    def test0040journal_replay(self):
+        '''
+        Test a journaled sale is replayed once, with the receipt code which
+        was printed.
+        '''
+        journal_obj = POOL.get('pos_cash.journal')
+        with Transaction().start(DB_NAME, USER,
+                context=CONTEXT) as transaction:
+            ids = self._setup()
+            with Transaction().set_context(pos_lane='1'):
+                key = journal_obj.open_sale()
+                receipt_code = pos_journal._SALES[key].receipt_code
+                journal_obj.add_product(key, ids['apple'], 5)
+                journal_obj.add_sum(key)
+                drawback = journal_obj.cash_sale(key, Decimal(20))
+            self.assertEqual(drawback, Decimal('9.30'))
+
+            self.assert_(journal_obj.replay('1'))
+            sale_ids = self.sale.search([('journal_key', '=', key)])
+            self.assertEqual(len(sale_ids), 1)
+            sale = self.sale.browse(sale_ids[0])
+            self.assertEqual(sale.receipt_code, receipt_code)
+            self.assertEqual(sale.lane, '1')
+            self.assertEqual(len(sale.lines), 2)
+            self.assertEqual(sale.total_amount, Decimal('10.70'))
+            self.assertEqual(sale.total_paid, Decimal(20))
+            self.assertEqual(sale.drawback.quantize(Decimal('0.01')),
+                drawback)
+
+            self.assertEqual(journal_obj.replay('1'), 0)
+            self.assertEqual(self.sale.search([('journal_key', '=', key)]),
+                sale_ids)
+
+            transaction.cursor.rollback()
+
+
+    def _create_sale(self, lines, paid=None):
+        '''
+        Create a sale with the lines of (product id, quantity), paid if
+        paid is set, and return its id
+        '''
+        sale_id = self.sale.create({})
+        self.sale.add_products(sale_id, lines)
+        if paid is not None:
+            self.sale.cash_sale(sale_id, paid)
+        return sale_id
+
+    def test0050closing(self):
+        '''
+        Test the X-report closes nothing and the Z-report closes the settled
+        sales once.
+        '''
+        closing_obj = POOL.get('pos_cash.closing')
+        with Transaction().start(DB_NAME, USER,
+                context=CONTEXT) as transaction:
+            ids = self._setup()
+            paid_id = self._create_sale([(ids['apple'], 5)], Decimal(20))
+            open_id = self._create_sale([(ids['bag'], 1)])
+
+            x_id = closing_obj.x_report()
+            x_report = closing_obj.browse(x_id)
+            self.assertEqual(x_report.kind, 'x')
+            self.assertEqual(x_report.receipts, 1)
+            self.assertEqual(x_report.turnover, Decimal('10.70'))
+            self.assertEqual([bool(x.closing) for x in
+                    self.sale.browse([paid_id, open_id])], [False, False])
+
+            z_id = closing_obj.z_report()
+            z_report = closing_obj.browse(z_id)
+            self.assertEqual((z_report.kind, z_report.number), ('z', 1))
+            self.assertEqual(z_report.receipts, 1)
+            self.assertEqual(z_report.turnover, Decimal('10.70'))
+            self.assertEqual(z_report.total_paid, Decimal(20))
+            self.assertEqual([x.id for x in z_report.sales], [paid_id])
+            self.assertFalse(self.sale.browse(open_id).closing)
+
+            z_id = closing_obj.z_report()
+            z_report = closing_obj.browse(z_id)
+            self.assertEqual(z_report.number, 2)
+            self.assertEqual(z_report.receipts, 0)
+            self.assertEqual(z_report.turnover, Decimal(0))
+            self.assertEqual(z_report.taxes, [])
+
+            # The sale still being rung up is closed once paid
+            self.sale.add_products(open_id, [(ids['bag'], 1)])
+            self.sale.cash_sale(open_id, Decimal(1))
+            z_report = closing_obj.browse(closing_obj.z_report())
+            self.assertEqual(z_report.number, 3)
+            self.assertEqual([x.id for x in z_report.sales], [open_id])
+
+            transaction.cursor.rollback()
+
+    def test0060closed_sale(self):
+        '''
+        Test the sales closed by a Z-report can not be changed.
+        '''
+        closing_obj = POOL.get('pos_cash.closing')
+        with Transaction().start(DB_NAME, USER,
+                context=CONTEXT) as transaction:
+            ids = self._setup()
+            sale_id = self._create_sale([(ids['apple'], 1)], Decimal(5))
+            line_id, = self.line.search([('sale', '=', sale_id)])
+            closing_obj.z_report()
+
+            self.assertRaises(UserError, self.line.create, {
+                    'sale': sale_id,
+                    'product': ids['bag'],
+                    'unit_price': Decimal('0.10'),
+                    'quantity': Decimal(1),
+                    })
+            self.assertRaises(UserError, self.line.write, line_id,
+                {'quantity': Decimal(2)})
+            self.assertRaises(UserError, self.line.delete, line_id)
+            self.assertRaises(UserError, self.sale.write, sale_id,
+                {'total_paid': Decimal(10)})
+            self.assertRaises(UserError, self.sale.delete, sale_id)
+            self.assertEqual(self.sale.browse(sale_id).total_amount,
+                Decimal('2.14'))
+
+            # A line can not be moved into a closed sale
+            other_id = self._create_sale([(ids['bag'], 1)])
+            other_line_id, = self.line.search([('sale', '=', other_id)])
+            self.assertRaises(UserError, self.line.write, other_line_id,
+                {'sale': sale_id})
+
+            transaction.cursor.rollback()
+
+
+    def test0070set_quantity(self):
+        '''
+        Test the quantity of a line is set without display.
+        '''
+        with Transaction().start(DB_NAME, USER,
+                context=CONTEXT) as transaction:
+            ids = self._setup()
+            sale_id = self._create_sale([(ids['apple'], 1)])
+            line_id, = self.line.search([('sale', '=', sale_id)])
+
+            self.assertEqual(self.sale.set_quantity([line_id], 3), True)
+            self.assertEqual(self.line.browse(line_id).quantity, 3)
+            self.assertEqual(self.sale.set_quantity(line_id, '2'), True)
+            self.assertEqual(self.line.browse(line_id).quantity, 2)
+            self.assertEqual(self._totals(sale_id)[0], Decimal('4.28'))
+
+            transaction.cursor.rollback()
+
+
+    def test0080cash_sale(self):
+        '''
+        Test the database and the journal return the drawback of the
+        payment.
+        '''
+        journal_obj = POOL.get('pos_cash.journal')
+        with Transaction().start(DB_NAME, USER,
+                context=CONTEXT) as transaction:
+            ids = self._setup()
+            for amount, drawback in ((Decimal(20), Decimal('9.30')),
+                    (Decimal('10.70'), Decimal(0))):
+                sale_id = self._create_sale([(ids['apple'], 5)])
+                self.assertEqual(self.sale.cash_sale(sale_id,
+                        amount).quantize(Decimal('0.01')), drawback)
+
+                key = journal_obj.open_sale()
+                journal_obj.add_product(key, ids['apple'], 5)
+                self.assertEqual(journal_obj.cash_sale(key, amount),
+                    drawback)
+
+            transaction.cursor.rollback()
+
+
+    def test0090add_products(self):
+        '''
+        Test the lines added together update the totals of the sale once.
+        '''
+        with Transaction().start(DB_NAME, USER,
+                context=CONTEXT) as transaction:
+            ids = self._setup()
+            sale_id = self.sale.create({})
+            updates = []
+            add_amounts = self.sale.add_amounts
+
+            def count_add_amounts(amounts):
+                updates.append(amounts)
+                return add_amounts(amounts)
+            self.sale.add_amounts = count_add_amounts
+            try:
+                line_ids = self.sale.add_products(sale_id, [
+                        (ids['apple'], 5),
+                        (ids['wine'], 1, Decimal('12.60')),
+                        (ids['bag'], 2),
+                        ])
+            finally:
+                del self.sale.add_amounts
+            self.assertEqual(len(updates), 1)
+            self.assertEqual(len(line_ids), 3)
+            self.assertEqual([x.product.id for x in
+                    self.line.browse(line_ids)],
+                [ids['apple'], ids['wine'], ids['bag']])
+            self.assertEqual(self._totals(sale_id),
+                (Decimal('23.50'), Decimal('20.20'), Decimal('3.30')))
+
+            transaction.cursor.rollback()
+
+
+    def test0100tax_bases(self):
+        '''
+        Test each tax of a line with several taxes has the net amount of
+        the line as base, on the receipt and on the reports.
+        '''
+        receipt = POOL.get('pos_cash.receipt', 'report')
+        closing_obj = POOL.get('pos_cash.closing')
+        with Transaction().start(DB_NAME, USER,
+                context=CONTEXT) as transaction:
+            ids = self._setup()
+            sale_id = self._create_sale([
+                    (ids['wine'], 1),
+                    (ids['apple'], 5),
+                    ], Decimal(30))
+
+            def taxes(rows):
+                return sorted((x['without_tax'].quantize(Decimal('0.01')),
+                        x['tax_amount'].quantize(Decimal('0.01')))
+                    for x in rows)
+            sale_taxes = receipt.get_sale_taxes(self.sale.browse(sale_id))
+            self.assertEqual([x['code'] for x in sale_taxes], ['1', '2'])
+            self.assertEqual(taxes(sale_taxes), [
+                    (Decimal('10.00'), Decimal('1.90')),
+                    (Decimal('20.00'), Decimal('1.40')),
+                    ])
+
+            closing = closing_obj.browse(closing_obj.x_report())
+            self.assertEqual(closing.total_without_tax.quantize(
+                    Decimal('0.01')), Decimal('20.00'))
+            self.assertEqual(closing.total_tax.quantize(Decimal('0.01')),
+                Decimal('3.30'))
+            self.assertEqual(taxes({
+                        'without_tax': x.without_tax,
+                        'tax_amount': x.tax_amount,
+                        } for x in closing.taxes), [
+                    (Decimal('10.00'), Decimal('1.90')),
+                    (Decimal('20.00'), Decimal('1.40')),
+                    ])
+            for tax in closing.taxes:
+                self.assertEqual(tax.amount,
+                    tax.without_tax + tax.tax_amount)
+
+            transaction.cursor.rollback()
+
+
+    def test0110scan(self):
+        '''
+        Test the scanned barcodes add lines of the active products at their
+        list price.
+        '''
+        with Transaction().start(DB_NAME, USER,
+                context=CONTEXT) as transaction:
+            ids = self._setup()
+            sale_id = self.sale.create({})
+            line_id = self.sale.scan(sale_id, ' 4000002\n')
+            line = self.line.browse(line_id)
+            self.assertEqual(line.product.id, ids['wine'])
+            self.assertEqual(line.unit_price, Decimal('12.60'))
+            self.assertEqual(line.quantity, 1)
+            self.assertEqual(line.name, 'wine')
+            line = self.line.browse(self.sale.scan(sale_id, '4000001', 3))
+            self.assertEqual(line.quantity, 3)
+            self.assertEqual(self._totals(sale_id)[0], Decimal('19.02'))
+            self.assertRaises(UserError, self.sale.scan, sale_id, '4009999')
+
+            # The snapshot follows the products written
+            self.product.write(ids['bag'], {'code': '4000004'})
+            self.product.write(ids['apple'], {'active': False})
+            self.product.get_snapshot().refresh_time = 0
+            line = self.line.browse(self.sale.scan(sale_id, '4000004'))
+            self.assertEqual(line.product.id, ids['bag'])
+            self.assertRaises(UserError, self.sale.scan, sale_id, '4000003')
+            self.assertRaises(UserError, self.sale.scan, sale_id, '4000001')
+
+            line_id = self.sale.add_product(sale_id, ids['bag'], 2,
+                Decimal('0.05'))
+            self.assertEqual(self.line.browse(line_id).total, Decimal('0.10'))
+
+            transaction.cursor.rollback()
+
+
+    def test0120receipt_numbers(self):
+        '''
+        Test the receipt numbers of each lane with a terminal are
+        consecutive, the other sales being numbered by the store.
+        '''
+        terminal_obj = POOL.get('pos_cash.terminal')
+        configuration_obj = POOL.get('pos_cash.configuration')
+        with Transaction().start(DB_NAME, USER,
+                context=CONTEXT) as transaction:
+            ids = self._setup()
+            configuration_obj.write(1, {'receipt_numbering': 'lane'})
+            for code, prefix in (('1', 'A'), ('2', 'B')):
+                terminal_obj.create({
+                        'name': 'Lane %s' % code,
+                        'code': code,
+                        'receipt_prefix': prefix,
+                        'receipt_padding': 3,
+                        })
+
+            codes = []
+            for lane in ('1', '2', '1', None, '1', '2'):
+                with Transaction().set_context(pos_lane=lane):
+                    codes.append(self.sale.browse(
+                            self.sale.create({})).receipt_code)
+            company = '%04d' % ids['company']
+            self.assertEqual(codes[:3] + codes[4:], [company + x for x in
+                    ('A001', 'B001', 'A002', 'A003', 'B002')])
+            self.assertEqual(codes[3], company + '1')
+            self.assertEqual(terminal_obj.read(terminal_obj.search([
+                            ('code', '=', '1'),
+                            ]), ['receipt_next'])[0]['receipt_next'], 4)
+
+            configuration_obj.write(1, {'receipt_numbering': 'store'})
+            with Transaction().set_context(pos_lane='1'):
+                self.assertEqual(self.sale.browse(
+                        self.sale.create({})).receipt_code, company + '2')
+
+            transaction.cursor.rollback()
+
+
+    def _spool_port(self, name):
+        '''
+        Return a port of a printer file in the data path, with a spool
+        worker which is not started, so that the jobs are printed by the
+        test
+        '''
+        port = os.path.join(CONFIG['data_path'], name)
+        spool._SPOOL_WORKERS[(DB_NAME, port)] = spool.SpoolWorker(DB_NAME,
+            port)
+        self.addCleanup(spool._SPOOL_WORKERS.pop, (DB_NAME, port))
+        self.addCleanup(spool.get_printer_connection(port).close)
+        return port
+
+    def test0130spool(self):
+        '''
+        Test the states of the print jobs and the reprint of a receipt.
+        '''
+        job_obj = POOL.get('pos_cash.print_job')
+        with Transaction().start(DB_NAME, USER,
+                context=CONTEXT) as transaction:
+            ids = self._setup()
+            sale_id = self._create_sale([(ids['bag'], 1)])
+            port = self._spool_port('printer')
+
+            job_id = job_obj.enqueue(port, 'RECEIPT', 'receipt', sale_id)
+            job = job_obj.browse(job_id)
+            self.assertEqual((job.state, job.attempts), ('pending', 0))
+            self.assert_(spool._SPOOL_WORKERS[(DB_NAME, port)]
+                ._wakeup.is_set())
+            self.assertEqual(job_obj.print_job(job_id), True)
+            job = job_obj.browse(job_id)
+            self.assertEqual((job.state, job.attempts), ('done', 1))
+            self.assert_(job.print_date)
+
+            new_ids = self.sale.reprint_receipt(sale_id)
+            self.assertEqual(len(new_ids), 1)
+            self.assertNotEqual(new_ids[0], job_id)
+            new_job = job_obj.browse(new_ids[0])
+            self.assertEqual((new_job.state, new_job.kind, new_job.sale.id,
+                    str(new_job.payload)),
+                ('pending', 'receipt', sale_id, 'RECEIPT'))
+            self.assertEqual(job_obj.print_job(new_job.id), True)
+            with open(port, 'rb') as printer:
+                self.assertEqual(printer.read(), 'RECEIPTRECEIPT')
+
+            # A job is retried until it fails for good
+            bad_port = self._spool_port(os.path.join('missing', 'printer'))
+            job_id = job_obj.enqueue(bad_port, 'TEST', 'test')
+            for attempt in range(1, spool._SPOOL_MAX_ATTEMPTS + 1):
+                self.assertEqual(job_obj.print_job(job_id), False)
+                job = job_obj.browse(job_id)
+                self.assertEqual(job.attempts, attempt)
+                self.assert_(job.error)
+                self.assertEqual(job.state,
+                    attempt < spool._SPOOL_MAX_ATTEMPTS and 'pending'
+                    or 'failed')
+
+            transaction.cursor.rollback()
+
+
+    def test0140export_cursor(self):
+        '''
+        Test the export resumes after the last sale of an interrupted chunk
+        and the next export only has the sales modified since.
+        '''
+        export_obj = POOL.get('pos_cash.export')
+        with Transaction().start(DB_NAME, USER,
+                context=CONTEXT) as transaction:
+            ids = self._setup()
+            sale_ids = [self._create_sale([(ids['bag'], x)])
+                for x in range(1, 6)]
+
+            cursor = None
+            for sale in export_obj.iter_sales(chunk_size=2):
+                self.assertEqual(len(sale['lines']), 1)
+                if sale['cursor']:
+                    cursor = sale['cursor']
+                    # Interrupted after the first chunk
+                    break
+            self.assert_(cursor)
+            self.assertEqual([x['id'] for x in export_obj.iter_sales(cursor,
+                        chunk_size=2)], sale_ids[2:])
+
+            export_id = export_obj.export('sales.jsonl', 'jsonl')
+            self.assertEqual(export_obj.browse(export_id).sales, 5)
+            with open(os.path.join(CONFIG['data_path'], 'pos_cash',
+                        'export', 'sales.jsonl')) as export_file:
+                self.assertEqual([json.loads(x)['id'] for x in export_file],
+                    sale_ids)
+
+            new_id = self._create_sale([(ids['apple'], 1)])
+            export_id = export_obj.export('next.csv')
+            self.assertEqual(export_obj.browse(export_id).sales, 1)
+            self.assertEqual([x['id'] for x in export_obj.iter_sales(
+                        export_obj.get_cursor())], [])
+            self.assertEqual(export_obj.browse(export_id).last_sale, new_id)
+
+            transaction.cursor.rollback()
+
+
+    def test0150configuration_cache(self):
+        '''
+        Test the cached configuration follows its writes.
+        '''
+        configuration_obj = POOL.get('pos_cash.configuration')
+        with Transaction().start(DB_NAME, USER,
+                context=CONTEXT) as transaction:
+            ids = self._setup()
+            configuration = configuration_obj.get_singleton()
+            self.assertEqual(configuration['company'], ids['company'])
+            self.assertFalse(configuration['printer_port'])
+            self.assert_(configuration_obj.get_singleton() is configuration)
+
+            configuration_obj.write(1, {'printer_port': '/dev/lp1'})
+            self.assertEqual(configuration_obj.get_singleton()[
+                    'printer_port'], '/dev/lp1')
+            self.assertEqual(configuration_obj.get_profile()[
+                    'printer_port'], '/dev/lp1')
+
+            transaction.cursor.rollback()
+
+
+    def test0160category_taxes(self):
+        '''
+        Test the products using the taxes of their category get the taxes
+        of the category and its parents, also once they are written.
+        '''
+        category_obj = POOL.get('product.category')
+        with Transaction().start(DB_NAME, USER,
+                context=CONTEXT) as transaction:
+            ids = self._setup()
+            food_id = category_obj.create({
+                    'name': 'Food',
+                    'customer_taxes': [('set', [ids['vat7']])],
+                    })
+            drinks_id = category_obj.create({
+                    'name': 'Drinks',
+                    'parent': food_id,
+                    'customer_taxes': [('set', [ids['vat19']])],
+                    })
+            self.assertEqual(category_obj.get_taxes_index('customer_taxes'),
+                {food_id: [ids['vat7']],
+                    drinks_id: [ids['vat19'], ids['vat7']]})
+            self.product.write(ids['wine'], {
+                    'taxes_category': True,
+                    'category': drinks_id,
+                    })
+            self.assertEqual([x.id for x in
+                    self.product.browse(ids['wine']).customer_taxes_used],
+                [ids['vat19'], ids['vat7']])
+
+            category_obj.write(food_id, {'customer_taxes': [('set', [])]})
+            self.assertEqual([x.id for x in
+                    self.product.browse(ids['wine']).customer_taxes_used],
+                [ids['vat19']])
+            self.assertEqual([x.id for x in
+                    self.product.browse(ids['apple']).customer_taxes_used],
+                [ids['vat7']])
+
+            transaction.cursor.rollback()
+
+
+    def test0170printer_connection(self):
+        '''
+        Test the jobs of a printer share its connection, which is opened
+        again once it is no longer healthy.
+        '''
+        job_obj = POOL.get('pos_cash.print_job')
+        with Transaction().start(DB_NAME, USER,
+                context=CONTEXT) as transaction:
+            port = self._spool_port('printer')
+            connection = spool.get_printer_connection(port)
+            self.assert_(spool.get_printer_connection(port) is connection)
+
+            job_ids = [job_obj.enqueue(port, x, 'test') for x in ('A', 'B')]
+            self.assertEqual(job_obj.print_job(job_ids[0]), True)
+            device = connection._device
+            self.assertEqual(job_obj.print_job(job_ids[1]), True)
+            self.assert_(connection._device is device)
+            with open(port, 'rb') as printer:
+                self.assertEqual(printer.read(), 'AB')
+
+            # The printer went away
+            device._file.close()
+            job_id = job_obj.enqueue(port, 'C', 'test')
+            self.assertEqual(job_obj.print_job(job_id), True)
+            self.assert_(connection._device is not device)
+            with open(port, 'rb') as printer:
+                self.assertEqual(printer.read(), 'C')
+
+            connection.close()
+            self.assertEqual(connection._device, None)
+
+            transaction.cursor.rollback()
+
+
+def suite():
+    suite = trytond.tests.test_tryton.suite()
+    for test_case in (LangFormatterTestCase, JournalTestCase,
+            ProductSnapshotTestCase, DisplayWorkerTestCase,
+            PosCashTestCase):
+        suite.addTests(unittest.TestLoader().loadTestsFromTestCase(
+            test_case))
+    suite.addTests(test_escpos.suite())
+    return suite
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
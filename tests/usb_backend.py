@@ -0,0 +1,142 @@
+#This file is part of Tryton.  The COPYRIGHT file at the top level of
+#this repository contains the full copyright notices and license terms.
+'''
+Fake pyusb 1.0 backend of one ESC/POS printer, to test the USB transport
+without hardware.
+'''
+import errno
+
+import usb.backend
+import usb.core
+import usb.util
+
+# The fixed bits of the DLE EOT status bytes of a printer without error
+STATUS_OK = 0x12
+
+
+class _Descriptor(object):
+
+    def __init__(self, **values):
+        self.__dict__.update(values)
+
+
+class FakePrinterBackend(usb.backend.IBackend):
+    '''
+    Backend with one printer. The data written to the output endpoint is
+    kept in writes. The DLE EOT queries are answered with the bytes of
+    status, by query number, unless answer is False.
+    Only accept bytes of each write are taken, all if it is None, and a
+    write which takes nothing times out.
+    '''
+
+    def __init__(self, id_vendor=0x04b8, id_product=0x0202, in_ep=0x82,
+            out_ep=0x01, packet_size=64):
+        self.id_vendor = id_vendor
+        self.id_product = id_product
+        self.in_ep = in_ep
+        self.out_ep = out_ep
+        self.packet_size = packet_size
+        self.status = {1: STATUS_OK, 2: STATUS_OK, 3: STATUS_OK,
+            4: STATUS_OK}
+        self.answer = True
+        self.accept = None
+        self.writes = []
+        self.queries = []
+        self.opened = 0
+        self.claimed = False
+        self.reset = False
+        self.configuration = 0
+        self._pending = []
+
+    def get_data(self):
+        '''
+        Return the data written which is no status query
+        '''
+        return ''.join(self.writes)
+
+    def _timeout(self):
+        return usb.core.USBError('Operation timed out', -7, errno.ETIMEDOUT)
+
+    def enumerate_devices(self):
+        yield 'printer'
+
+    def get_device_descriptor(self, dev):
+        return _Descriptor(bLength=18,
+            bDescriptorType=usb.util.DESC_TYPE_DEVICE, bcdUSB=0x0200,
+            bDeviceClass=0, bDeviceSubClass=0, bDeviceProtocol=0,
+            bMaxPacketSize0=64, idVendor=self.id_vendor,
+            idProduct=self.id_product, bcdDevice=0x0100, iManufacturer=0,
+            iProduct=0, iSerialNumber=0, bNumConfigurations=1, address=1,
+            bus=1, port_number=1, port_numbers=(1,), speed=None)
+
+    def get_configuration_descriptor(self, dev, config):
+        return _Descriptor(bLength=9,
+            bDescriptorType=usb.util.DESC_TYPE_CONFIG, wTotalLength=32,
+            bNumInterfaces=1, bConfigurationValue=1, iConfiguration=0,
+            bmAttributes=0xc0, bMaxPower=50, extra_descriptors=[])
+
+    def get_interface_descriptor(self, dev, intf, alt, config):
+        if intf or alt:
+            raise IndexError(intf)
+        return _Descriptor(bLength=9,
+            bDescriptorType=usb.util.DESC_TYPE_INTERFACE, bInterfaceNumber=0,
+            bAlternateSetting=0, bNumEndpoints=2, bInterfaceClass=7,
+            bInterfaceSubClass=1, bInterfaceProtocol=2, iInterface=0,
+            extra_descriptors=[])
+
+    def get_endpoint_descriptor(self, dev, ep, intf, alt, config):
+        address = (self.out_ep, self.in_ep)[ep]
+        return _Descriptor(bLength=7,
+            bDescriptorType=usb.util.DESC_TYPE_ENDPOINT,
+            bEndpointAddress=address,
+            bmAttributes=usb.util.ENDPOINT_TYPE_BULK,
+            wMaxPacketSize=self.packet_size, bInterval=0, bRefresh=0,
+            bSynchAddress=0, extra_descriptors=[])
+
+    def open_device(self, dev):
+        self.opened += 1
+        return dev
+
+    def close_device(self, dev_handle):
+        pass
+
+    def set_configuration(self, dev_handle, config_value):
+        self.configuration = config_value
+
+    def get_configuration(self, dev_handle):
+        return self.configuration
+
+    def set_interface_altsetting(self, dev_handle, intf, altsetting):
+        pass
+
+    def claim_interface(self, dev_handle, intf):
+        self.claimed = True
+
+    def release_interface(self, dev_handle, intf):
+        self.claimed = False
+
+    def reset_device(self, dev_handle):
+        self.reset = True
+
+    def is_kernel_driver_active(self, dev_handle, intf):
+        return False
+
+    def bulk_write(self, dev_handle, ep, intf, data, timeout):
+        data = data.tostring()
+        if data.startswith('\x10\x04') and len(data) == 3:
+            self.queries.append(ord(data[2]))
+            if self.answer:
+                self._pending.append(self.status[ord(data[2])])
+            return len(data)
+        if self.accept is not None:
+            data = data[:self.accept]
+            if not data:
+                raise self._timeout()
+        self.writes.append(data)
+        return len(data)
+
+    def bulk_read(self, dev_handle, ep, intf, buff, timeout):
+        if not self._pending:
+            raise self._timeout()
+        buff[0] = self._pending.pop(0)
+        return 1